@@ -1,9 +1,26 @@
 # --- agent.py (Modified for OpenAI) ---
 
+import asyncio
+import contextvars
 import json
+import logging
 import os
-from openai import OpenAI # Import the OpenAI library
-from agent_tools import search_federal_documents # Your existing tool function
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from openai import OpenAI, AsyncOpenAI # Import the OpenAI library
+from agent_tools import ( # Your tool functions
+    search_federal_documents,
+    search_document_passages,
+    semantic_search_documents,
+    hybrid_search,
+    document_stats,
+)
+from caching import create_response_cache
+from query_router import route_query
+from telemetry import span, record_span, run_in_context, register_collector, ERRORS, LLM_TOKENS
+
+logger = logging.getLogger(__name__)
 
 # Configure the OpenAI client
 # This relies on OPENAI_API_KEY being set in the environment (loaded by main.py)
@@ -12,6 +29,8 @@ if not API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable not set.")
 
 client = OpenAI(api_key=API_KEY)
+# Async client for the web app, so a request waiting on OpenAI does not block the worker
+async_client = AsyncOpenAI(api_key=API_KEY)
 
 # Choose an OpenAI model that supports function calling
 # "gpt-3.5-turbo" is a good and cost-effective choice for testing.
@@ -25,7 +44,7 @@ tools_schema_openai = [
         "type": "function",
         "function": {
             "name": "search_federal_documents",
-            "description": "Search federal documents based on keywords, agency, or publication dates.",
+            "description": "Search federal documents based on keywords, agency, or publication dates. Returns a page of results and a next_cursor for the following page (null on the last page).",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -49,124 +68,834 @@ tools_schema_openai = [
                         "type": "integer",
                         "description": "Maximum number of results to return. Defaults to 10.",
                     },
+                    "fields": {
+                        "type": "array",
+                        "items": {"type": "string", "enum": ["document_number", "title", "agency", "publication_date", "document_url", "content"]},
+                        "description": "Fields to return for each document. Omit content when only titles, dates or links are needed. Defaults to all fields.",
+                    },
+                    "max_content_chars": {
+                        "type": "integer",
+                        "description": "Maximum characters of content per document (up to 4000). Defaults to 500.",
+                    },
+                    "snippet": {
+                        "type": "boolean",
+                        "description": "Return the part of the content around the query match instead of its beginning. Defaults to true.",
+                    },
+                    "cursor": {
+                        "type": "string",
+                        "description": "next_cursor from a previous call with the same other arguments, to get only the next page of results.",
+                    },
                 },
                 "required": [], # OpenAI expects a list of required parameter names
                                  # e.g., ["query"] if 'query' is always required.
                                  # For now, making all optional as in your original Gemini schema.
             },
         },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "search_document_passages",
+            "description": "Search inside the full text of federal documents and return the most relevant short passages. Use when the answer depends on what a document actually says.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Keywords to look for in the document text.",
+                    },
+                    "agency": {
+                        "type": "string",
+                        "description": "Filter documents by the publishing agency name.",
+                    },
+                    "start_date": {
+                        "type": "string",
+                        "description": "Start date for publication date filter (YYYY-MM-DD format).",
+                    },
+                    "end_date": {
+                        "type": "string",
+                        "description": "End date for publication date filter (YYYY-MM-DD format).",
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Maximum number of passages to return. Defaults to 5.",
+                    },
+                },
+                "required": ["query"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "semantic_search_documents",
+            "description": "Find federal documents by meaning rather than exact keywords. Use for conceptual questions or when keyword search returns nothing.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Natural-language description of the documents to find.",
+                    },
+                    "queries": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Optional extra phrasings of the same need, searched together in one call.",
+                    },
+                    "agency": {
+                        "type": "string",
+                        "description": "Only return documents from agencies whose name contains this text.",
+                    },
+                    "start_date": {
+                        "type": "string",
+                        "description": "Start date for publication date filter (YYYY-MM-DD format).",
+                    },
+                    "end_date": {
+                        "type": "string",
+                        "description": "End date for publication date filter (YYYY-MM-DD format).",
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Maximum number of results to return. Defaults to 10.",
+                    },
+                },
+                "required": [],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "hybrid_search",
+            "description": "Best general-purpose search: combines keyword and semantic search in one call and returns the merged top results. Prefer this over issuing several searches with rephrased queries.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "What to search for, in keywords or natural language.",
+                    },
+                    "agency": {
+                        "type": "string",
+                        "description": "Filter documents by the publishing agency name.",
+                    },
+                    "start_date": {
+                        "type": "string",
+                        "description": "Start date for publication date filter (YYYY-MM-DD format).",
+                    },
+                    "end_date": {
+                        "type": "string",
+                        "description": "End date for publication date filter (YYYY-MM-DD format).",
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Maximum number of results to return. Defaults to 10.",
+                    },
+                },
+                "required": ["query"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "document_stats",
+            "description": "Counts documents by agency, month and/or document type from precomputed aggregates. Use this for 'how many' and 'which agency published the most' questions instead of searching and counting documents.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "group_by": {
+                        "type": "array",
+                        "items": {"type": "string", "enum": ["agency", "month", "document_type"]},
+                        "description": "Dimensions to count by. Defaults to [\"agency\"]; an empty list returns one overall count.",
+                    },
+                    "agency": {
+                        "type": "string",
+                        "description": "Only count documents of agencies whose name starts with this text.",
+                    },
+                    "document_type": {
+                        "type": "string",
+                        "enum": ["Rule", "Proposed Rule", "Notice", "Presidential Document"],
+                        "description": "Only count documents of this type.",
+                    },
+                    "start_date": {
+                        "type": "string",
+                        "description": "First month to count (YYYY-MM-DD or YYYY-MM); whole months are counted.",
+                    },
+                    "end_date": {
+                        "type": "string",
+                        "description": "Last month to count (YYYY-MM-DD or YYYY-MM); whole months are counted.",
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Maximum number of rows to return, largest counts first. Defaults to 20.",
+                    },
+                },
+                "required": [],
+            },
+        },
     }
     # Add other tools here, each as a new dictionary in the list
 ]
 
+# Maps tool names the model may call to the Python functions that implement them
+AVAILABLE_FUNCTIONS = {
+    "search_federal_documents": search_federal_documents,
+    "search_document_passages": search_document_passages,
+    "semantic_search_documents": semantic_search_documents,
+    "hybrid_search": hybrid_search,
+    "document_stats": document_stats,
+}
+
+SYSTEM_PROMPT = "You are a helpful assistant that can search federal documents."
+
+# --- Concurrency Limits (async path) ---
+# Caps on simultaneous OpenAI requests and tool executions per worker process.
+# Tool functions are blocking (MySQL driver, numpy), so they run on a
+# dedicated thread pool sized like the DB connection pool instead of on the
+# event loop; everything else awaits without holding a thread.
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "32"))
+TOOL_MAX_CONCURRENCY = int(os.environ.get("TOOL_MAX_CONCURRENCY", os.environ.get("DB_POOL_SIZE", "10")))
+_llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_CONCURRENCY, thread_name_prefix="agent-tool")
+# Per tool call, from when a worker starts it; a call that takes longer is
+# reported to the model as an error
+TOOL_TIMEOUT_SECONDS = float(os.environ.get("TOOL_TIMEOUT_SECONDS", "20"))
+# Timed-out calls keep running on their worker (threads cannot be killed).
+# Once this many are still running, tool calls are refused until some
+# finish, so stuck calls cannot take over the whole pool.
+TOOL_MAX_ABANDONED = int(os.environ.get("TOOL_MAX_ABANDONED", str(max(1, TOOL_MAX_CONCURRENCY // 2))))
+_abandoned_lock = threading.Lock()
+_abandoned_tool_calls = {"running": 0}
+
+def _collect_tool_metrics():
+    return [("rag_tool_calls_abandoned", "gauge", "Timed-out tool calls still running on a worker", [({}, _abandoned_tool_calls["running"])])]
+
+register_collector(_collect_tool_metrics)
+
+async def _run_blocking(function, *args):
+    """Runs a blocking helper on the tool thread pool so it does not stall the event loop."""
+    loop = asyncio.get_running_loop()
+    # run_in_executor does not carry context variables over; copy them so spans join the trace
+    return await loop.run_in_executor(_tool_executor, contextvars.copy_context().run, function, *args)
+
 # --- Store conversation history ---
 # OpenAI's API is stateless for chat completions by default,
 # so we need to manage the history if we want follow-up conversations.
-# For a single turn RAG, this might be simpler. Let's start with a simpler approach
-# and build up if multi-turn is needed.
 # For now, we will send the history in each call for simplicity.
 
-def run_conversation(user_query, conversation_history=None):
-    """
-    Sends user query to the OpenAI LLM, handles tool calls, and returns the final response.
-    """
+def _start_history(user_query, conversation_history):
+    """Initialises the history if needed and appends the user's query."""
     if conversation_history is None:
         # Initialize with a system message (optional, but can guide the AI)
-        conversation_history = [
-            {"role": "system", "content": "You are a helpful assistant that can search federal documents."}
-        ]
-
+        conversation_history = [{"role": "system", "content": SYSTEM_PROMPT}]
     # Add user's query to the history
     conversation_history.append({"role": "user", "content": user_query})
+    return conversation_history
+
+# --- Agent Loop Budget ---
+# The model may call tools over several rounds (e.g. to refine a search).
+# The loop stops offering tools, forcing a final answer, once any of these
+# limits is reached.
+AGENT_MAX_STEPS = int(os.environ.get("AGENT_MAX_STEPS", "4")) # Tool rounds per question
+AGENT_MAX_TOKENS = int(os.environ.get("AGENT_MAX_TOKENS", "24000")) # Prompt + completion tokens per question
+AGENT_MAX_SECONDS = float(os.environ.get("AGENT_MAX_SECONDS", "45")) # Wall-clock time per question
+
+class AgentBudget:
+    """Tracks tool rounds, token usage and elapsed time for one question, and records per-step timings."""
+
+    def __init__(self, max_steps=None, max_tokens=None, max_seconds=None):
+        self.max_steps = AGENT_MAX_STEPS if max_steps is None else max_steps
+        self.max_tokens = AGENT_MAX_TOKENS if max_tokens is None else max_tokens
+        self.max_seconds = AGENT_MAX_SECONDS if max_seconds is None else max_seconds
+        self.started = time.perf_counter()
+        self.tool_rounds = 0
+        self.tokens_used = 0
+        self.steps = []
+
+    def exhausted(self):
+        """Returns the name of the first limit reached, or None."""
+        if self.tool_rounds >= self.max_steps:
+            return "steps"
+        if self.tokens_used >= self.max_tokens:
+            return "tokens"
+        if time.perf_counter() - self.started >= self.max_seconds:
+            return "time"
+        return None
+
+    def record_llm_call(self, llm_seconds, usage=None):
+        """Starts a new step for an LLM call and returns it so tool timings can be added."""
+        step = {"step": len(self.steps) + 1, "llm_ms": round(llm_seconds * 1000, 1)}
+        record_span("llm.call", llm_seconds, step=step["step"])
+        if usage is not None:
+            step["prompt_tokens"] = usage.prompt_tokens
+            step["completion_tokens"] = usage.completion_tokens
+            self.tokens_used += usage.total_tokens
+            LLM_TOKENS.inc(usage.prompt_tokens, kind="prompt")
+            LLM_TOKENS.inc(usage.completion_tokens, kind="completion")
+        self.steps.append(step)
+        return step
+
+    def record_route(self, router_seconds, route):
+        """Starts a step for a tool call chosen by the query router instead of the model."""
+        step = {"step": len(self.steps) + 1, "router_ms": round(router_seconds * 1000, 1), "route_confidence": route["confidence"]}
+        self.steps.append(step)
+        return step
+
+    def record_tools(self, step, tool_messages, tool_seconds, memoized):
+        self.tool_rounds += 1
+        record_span("tools.round", tool_seconds, step=step["step"])
+        step["tool_calls"] = [message["name"] for message in tool_messages]
+        step["memoized_tool_calls"] = memoized
+        step["tools_ms"] = round(tool_seconds * 1000, 1)
+
+    def details(self, response, stop_reason=None, cache=None):
+        details = {
+            "response": response,
+            "steps": self.steps,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "total_tokens": self.tokens_used,
+            "stop_reason": stop_reason,
+            "cache": cache, # "exact" / "semantic" when answered from the response cache
+        }
+        # One structured record per question; the question and answer text are not logged
+        logger.info("Conversation finished", extra={
+            "steps": len(self.steps), "total_ms": details["total_ms"], "total_tokens": self.tokens_used,
+            "stop_reason": stop_reason, "cache_match": cache,
+        })
+        return details
+
+# --- Response Cache ---
+# The first question of a conversation depends only on its text, so its final
+# answer is cached (see caching.py; RESPONSE_CACHE_* settings) and a repeat of
+# the question skips both OpenAI calls and the tools. Follow-up turns depend on
+# the earlier conversation and always go to the model. Lookups and stores
+# block (SQLite, and the embedder for similarity matches), so the async flows
+# run them on the tool thread pool.
+response_cache = create_response_cache()
+
+def _is_first_turn(conversation_history):
+    """True when the conversation holds no earlier user/assistant turns."""
+    return not conversation_history or all(
+        isinstance(message, dict) and message.get("role") == "system" for message in conversation_history
+    )
+
+def _is_cacheable(conversation_history):
+    return response_cache is not None and _is_first_turn(conversation_history)
+
+def _answer_from_cache(user_query, conversation_history, budget):
+    """
+    Looks the question up in the response cache. On a hit, records the answer
+    in the history and returns (answer, details); otherwise (None, None).
+    """
+    with span("cache.lookup"):
+        cached, match_type = response_cache.lookup(user_query)
+    if cached is None:
+        return None, None
+    conversation_history.append({"role": "assistant", "content": cached["response"]})
+    logger.debug("Answered from response cache (%s match)", match_type)
+    return cached["response"], budget.details(cached["response"], cache=match_type)
+
+def _remember_answer(user_query, response, budget):
+    """Caches a successful answer together with how long it took to produce."""
+    if response:
+        response_cache.store(user_query, response, time.perf_counter() - budget.started)
+
+def _completion_request(conversation_history, offer_tools):
+    request = {"model": MODEL_NAME, "messages": conversation_history}
+    if offer_tools:
+        request["tools"] = tools_schema_openai
+        request["tool_choice"] = "auto" # "auto" lets the model decide
+    return request
+
+# --- Tool Execution ---
+def _tool_call_fields(tool_call):
+    """Returns (id, name, arguments JSON) for an SDK tool call object or an assembled dict."""
+    if isinstance(tool_call, dict):
+        return tool_call["id"], tool_call["function"]["name"], tool_call["function"]["arguments"]
+    return tool_call.id, tool_call.function.name, tool_call.function.arguments
+
+def _execute_tool_call(tool_call):
+    """
+    Runs one tool call requested by the model and returns the "tool" message
+    to append to the history. Errors are reported back to the model as JSON.
+    """
+    tool_call_id, function_name, arguments = _tool_call_fields(tool_call)
+    function_to_call = AVAILABLE_FUNCTIONS.get(function_name)
+
+    if function_to_call is None:
+        ERRORS.inc(component="tool", kind="unknown_function")
+        logger.warning("Model requested unknown tool %s", function_name)
+        content = {"error": f"Function {function_name} not found."}
+    else:
+        try:
+            function_args = json.loads(arguments or "{}")
+            logger.debug("Executing tool %s with args %s", function_name, function_args)
+            with span("tool.call", tool=function_name):
+                content = function_to_call(**function_args)
+        except Exception as e:
+            ERRORS.inc(component="tool", kind="exception")
+            logger.exception("Error executing tool %s", function_name)
+            content = {"error": f"Error executing function {function_name}: {str(e)}"}
+
+    with span("tool.serialize", tool=function_name):
+        serialized = json.dumps(content) # Ensure content is a JSON string
+    return {
+        "tool_call_id": tool_call_id,
+        "role": "tool",
+        "name": function_name,
+        "content": serialized,
+    }
+
+def _tool_overloaded_message(tool_call):
+    tool_call_id, function_name, _ = _tool_call_fields(tool_call)
+    ERRORS.inc(component="tool", kind="overloaded")
+    logger.warning("Tool %s not run: %d timed-out calls still occupy tool workers", function_name, _abandoned_tool_calls["running"])
+    return {
+        "tool_call_id": tool_call_id,
+        "role": "tool",
+        "name": function_name,
+        "content": json.dumps({"error": f"Function {function_name} is temporarily unavailable (earlier calls timed out)."}),
+    }
+
+def _tool_timeout_message(tool_call):
+    tool_call_id, function_name, _ = _tool_call_fields(tool_call)
+    ERRORS.inc(component="tool", kind="timeout")
+    logger.warning("Tool %s timed out after %ss", function_name, TOOL_TIMEOUT_SECONDS)
+    return {
+        "tool_call_id": tool_call_id,
+        "role": "tool",
+        "name": function_name,
+        "content": json.dumps({"error": f"Function {function_name} timed out after {TOOL_TIMEOUT_SECONDS} seconds."}),
+    }
+
+# --- Query Router ---
+# A first question that query_router.py can parse with confidence (agency,
+# date range, a few keywords) gets its search run directly, skipping the LLM
+# call that would only have written those arguments; the model then sees the
+# results and answers. The model is still offered the tools, so it can refine
+# the search if the results do not fit. Follow-up turns always go to the model.
+def _routed_tool_calls(route):
+    """The router's search as the assistant tool call the model would have made."""
+    return [{
+        "id": "call_router_1",
+        "type": "function",
+        "function": {"name": route["name"], "arguments": json.dumps(route["arguments"])},
+    }]
+
+def _route_first_turn(user_query, budget):
+    """Returns (step, tool calls) for a routed question, or (None, None) to let the model plan."""
+    started = time.perf_counter()
+    with span("router"):
+        route = route_query(user_query)
+    if route is None:
+        return None, None
+    logger.debug("Routed question to %s with %s", route["name"], route["arguments"])
+    return budget.record_route(time.perf_counter() - started, route), _routed_tool_calls(route)
+
+async def _route_first_turn_async(user_query, budget):
+    # The router may load the agency list from the database; keep that off the event loop
+    return await _run_blocking(_route_first_turn, user_query, budget)
+
+# --- Tool Result Memoization ---
+# Within one conversation an identical tool call (same name, same arguments)
+# is answered from the memo instead of being executed again. Failed calls are
+# not memoized so they can be retried: their payload starts with "error",
+# including the search tools' own reports of a database failure.
+def _tool_memo_key(tool_call):
+    _, function_name, arguments = _tool_call_fields(tool_call)
+    try:
+        arguments = json.dumps(json.loads(arguments or "{}"), sort_keys=True) # Argument order must not matter
+    except ValueError:
+        pass
+    return f"{function_name}:{arguments}"
+
+def _plan_tool_calls(tool_calls, memo):
+    """
+    Splits a turn's tool calls into memo hits (already answered, keyed by
+    position) and calls that still need to run. Duplicate calls within the
+    same turn run only once.
+    """
+    answered = {}
+    to_run = {} # memo key -> first tool call with that key
+    for position, tool_call in enumerate(tool_calls):
+        key = _tool_memo_key(tool_call)
+        if key in memo:
+            answered[position] = memo[key]
+        else:
+            to_run.setdefault(key, tool_call)
+    return answered, to_run
+
+def _assemble_tool_messages(tool_calls, memo, answered, fresh):
+    """Combines memo hits and fresh results into messages in the original order, updating the memo."""
+    for key, message in fresh.items():
+        if not message["content"].startswith('{"error"'):
+            memo[key] = message["content"]
+    messages = []
+    for position, tool_call in enumerate(tool_calls):
+        tool_call_id, function_name, _ = _tool_call_fields(tool_call)
+        content = answered.get(position)
+        if content is None:
+            content = fresh[_tool_memo_key(tool_call)]["content"]
+        messages.append({"tool_call_id": tool_call_id, "role": "tool", "name": function_name, "content": content})
+    return messages
+
+def _tracked_tool_call(tool_call, on_start):
+    """
+    Wraps a tool call for a worker thread. Returns (run, abandon): ``run``
+    calls ``on_start`` and executes the call; ``abandon``, used on timeout,
+    counts the call in _abandoned_tool_calls until it actually returns.
+    """
+    state = {"finished": False, "abandoned": False}
+
+    def run():
+        on_start()
+        try:
+            return _execute_tool_call(tool_call)
+        finally:
+            with _abandoned_lock:
+                state["finished"] = True
+                if state["abandoned"]:
+                    _abandoned_tool_calls["running"] -= 1
+
+    def abandon():
+        with _abandoned_lock:
+            if not state["finished"]:
+                state["abandoned"] = True
+                _abandoned_tool_calls["running"] += 1
+
+    return run, abandon
+
+def _execute_tool_calls(tool_calls, memo):
+    """
+    Runs all tool calls of one model turn concurrently on the tool thread pool
+    and returns their messages in the original order, so a turn with several
+    searches costs about as much as its slowest one. Returns (messages, number
+    of calls answered from the memo). Timeouts and the abandoned-call cap work
+    as in _execute_tool_call_async.
+    """
+    answered, to_run = _plan_tool_calls(tool_calls, memo)
+    fresh, calls = {}, {}
+    for key, tool_call in to_run.items():
+        if _abandoned_tool_calls["running"] >= TOOL_MAX_ABANDONED:
+            fresh[key] = _tool_overloaded_message(tool_call)
+            continue
+        started = {"event": threading.Event()}
+        def on_start(started=started):
+            started["at"] = time.monotonic()
+            started["event"].set()
+        run, abandon = _tracked_tool_call(tool_call, on_start)
+        calls[key] = (run_in_context(_tool_executor, run), started, abandon)
+    for key, (future, started, abandon) in calls.items():
+        started["event"].wait()
+        try:
+            fresh[key] = future.result(timeout=max(0.0, started["at"] + TOOL_TIMEOUT_SECONDS - time.monotonic()))
+        except FuturesTimeoutError:
+            abandon()
+            fresh[key] = _tool_timeout_message(to_run[key])
+    return _assemble_tool_messages(tool_calls, memo, answered, fresh), len(answered)
+
+# --- Conversation ---
+def run_conversation(user_query, conversation_history=None, return_details=False, tool_memo=None):
+    """
+    Sends user query to the OpenAI LLM and runs the tool-calling loop until
+    the model answers or the AgentBudget is used up, then returns the final
+    response. Blocking; the web app uses run_conversation_async instead.
 
-    print(f"Sending to OpenAI: {conversation_history}")
+    Args:
+        user_query (str): The user's question.
+        conversation_history (list, optional): Earlier messages; appended to in place.
+        return_details (bool): Return a dict with the response plus per-step
+            timings, token usage and stop reason instead of just the text.
+        tool_memo (dict, optional): Tool results to reuse across calls; pass the
+            same dict for every turn of a conversation.
+    """
+    first_turn = _is_first_turn(conversation_history)
+    cacheable = _is_cacheable(conversation_history)
+    conversation_history = _start_history(user_query, conversation_history)
+    memo = {} if tool_memo is None else tool_memo
+    budget = AgentBudget()
+    stop_reason = None
+
+    if cacheable:
+        cached_response, cached_details = _answer_from_cache(user_query, conversation_history, budget)
+        if cached_response is not None:
+            return cached_details if return_details else cached_response
 
     try:
-        # First call to OpenAI
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=conversation_history,
-            tools=tools_schema_openai,
-            tool_choice="auto",  # "auto" lets the model decide, or specify {"type": "function", "function": {"name": "my_function"}}
-        )
-
-        response_message = response.choices[0].message
-        tool_calls = response_message.tool_calls
-
-        # --- Step 2: Check if the model wants to call a tool ---
-        if tool_calls:
-            print(f"OpenAI wants to call tools: {tool_calls}")
+        step, routed_calls = _route_first_turn(user_query, budget) if first_turn else (None, None)
+        if routed_calls:
+            conversation_history.append({"role": "assistant", "content": None, "tool_calls": routed_calls})
+            started = time.perf_counter()
+            tool_messages, memoized = _execute_tool_calls(routed_calls, memo)
+            conversation_history.extend(tool_messages)
+            budget.record_tools(step, tool_messages, time.perf_counter() - started, memoized)
+
+        while True:
+            stop_reason = budget.exhausted()
+            offer_tools = stop_reason is None # Once over budget, the model must answer
+            started = time.perf_counter()
+            response = client.chat.completions.create(**_completion_request(conversation_history, offer_tools))
+            step = budget.record_llm_call(time.perf_counter() - started, getattr(response, "usage", None))
+
+            response_message = response.choices[0].message
+            tool_calls = response_message.tool_calls if offer_tools else None
+            if not tool_calls:
+                final_response_message = response_message.content
+                break
+
+            logger.debug("Model requested %d tool call(s): %s", len(tool_calls), tool_calls)
             # Add the assistant's response (requesting tool call) to history
             conversation_history.append(response_message)
+            started = time.perf_counter()
+            tool_messages, memoized = _execute_tool_calls(tool_calls, memo)
+            conversation_history.extend(tool_messages)
+            budget.record_tools(step, tool_messages, time.perf_counter() - started, memoized)
+
+        # Add final assistant response to history for future turns (if any)
+        conversation_history.append({"role": "assistant", "content": final_response_message})
+        if cacheable:
+            _remember_answer(user_query, final_response_message, budget)
+        return budget.details(final_response_message, stop_reason) if return_details else final_response_message
+
+    except Exception as e:
+        ERRORS.inc(component="conversation", kind="exception")
+        logger.exception("Conversation failed")
+        error_message = f"An internal error occurred during the conversation: {str(e)}"
+        return budget.details(error_message, "error") if return_details else error_message
+
+# --- Async Conversation (used by the FastAPI app) ---
+async def _create_completion_async(**kwargs):
+    """chat.completions.create on the async client, bounded by the LLM semaphore."""
+    async with _llm_semaphore:
+        return await async_client.chat.completions.create(**kwargs)
+
+async def _execute_tool_call_async(tool_call):
+    """
+    Runs a blocking tool call on the tool thread pool without blocking the
+    event loop. TOOL_TIMEOUT_SECONDS counts from when a worker starts the
+    call, not from when it was queued, so a saturated pool does not turn
+    waiting into timeouts. A call that times out cannot be interrupted and
+    keeps its worker until it returns; while TOOL_MAX_ABANDONED such calls
+    are still running, new calls fail fast instead of queueing behind them.
+    """
+    if _abandoned_tool_calls["running"] >= TOOL_MAX_ABANDONED:
+        return _tool_overloaded_message(tool_call)
+    loop = asyncio.get_running_loop()
+    started = asyncio.Event()
+    run, abandon = _tracked_tool_call(tool_call, lambda: loop.call_soon_threadsafe(started.set))
+    # run_in_executor does not carry context variables over; copy them so the tool's spans join the trace
+    call = loop.run_in_executor(_tool_executor, contextvars.copy_context().run, run)
+    await started.wait()
+    try:
+        return await asyncio.wait_for(call, TOOL_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        abandon()
+        return _tool_timeout_message(tool_call)
+
+async def _execute_tool_calls_async(tool_calls, memo):
+    """Async counterpart of _execute_tool_calls: concurrent, memoized, original order."""
+    answered, to_run = _plan_tool_calls(tool_calls, memo)
+    results = await asyncio.gather(*(_execute_tool_call_async(tool_call) for tool_call in to_run.values()))
+    fresh = dict(zip(to_run, results))
+    return _assemble_tool_messages(tool_calls, memo, answered, fresh), len(answered)
+
+async def run_conversation_async(user_query, conversation_history=None, return_details=False, tool_memo=None):
+    """
+    Non-blocking version of run_conversation (same arguments): OpenAI calls
+    use AsyncOpenAI and tool calls are offloaded to a thread pool, so one
+    worker process can serve many chats concurrently.
+    """
+    first_turn = _is_first_turn(conversation_history)
+    cacheable = _is_cacheable(conversation_history)
+    conversation_history = _start_history(user_query, conversation_history)
+    memo = {} if tool_memo is None else tool_memo
+    budget = AgentBudget()
+    stop_reason = None
+
+    if cacheable:
+        cached_response, cached_details = await _run_blocking(_answer_from_cache, user_query, conversation_history, budget)
+        if cached_response is not None:
+            return cached_details if return_details else cached_response
+
+    try:
+        step, routed_calls = await _route_first_turn_async(user_query, budget) if first_turn else (None, None)
+        if routed_calls:
+            conversation_history.append({"role": "assistant", "content": None, "tool_calls": routed_calls})
+            started = time.perf_counter()
+            tool_messages, memoized = await _execute_tool_calls_async(routed_calls, memo)
+            conversation_history.extend(tool_messages)
+            budget.record_tools(step, tool_messages, time.perf_counter() - started, memoized)
+
+        while True:
+            stop_reason = budget.exhausted()
+            offer_tools = stop_reason is None
+            started = time.perf_counter()
+            response = await _create_completion_async(**_completion_request(conversation_history, offer_tools))
+            step = budget.record_llm_call(time.perf_counter() - started, getattr(response, "usage", None))
+
+            response_message = response.choices[0].message
+            tool_calls = response_message.tool_calls if offer_tools else None
+            if not tool_calls:
+                final_response_message = response_message.content
+                break
+
+            logger.debug("Model requested %d tool call(s): %s", len(tool_calls), tool_calls)
+            conversation_history.append(response_message)
+            started = time.perf_counter()
+            tool_messages, memoized = await _execute_tool_calls_async(tool_calls, memo)
+            conversation_history.extend(tool_messages)
+            budget.record_tools(step, tool_messages, time.perf_counter() - started, memoized)
 
-            available_functions = {
-                "search_federal_documents": search_federal_documents,
-            }
-            
-            # --- Step 3: Execute tool calls ---
-            for tool_call in tool_calls:
-                function_name = tool_call.function.name
-                function_to_call = available_functions.get(function_name)
-                
-                if function_to_call:
-                    try:
-                        function_args = json.loads(tool_call.function.arguments)
-                        print(f"Executing tool: {function_name} with args: {function_args}")
-                        function_response = function_to_call(**function_args)
-                        
-                        # Add the tool's response to history
-                        conversation_history.append(
-                            {
-                                "tool_call_id": tool_call.id,
-                                "role": "tool",
-                                "name": function_name,
-                                "content": json.dumps(function_response), # Ensure content is a JSON string
-                            }
-                        )
-                    except Exception as e:
-                        print(f"Error executing tool {function_name}: {e}")
-                        conversation_history.append(
-                            {
-                                "tool_call_id": tool_call.id,
-                                "role": "tool",
-                                "name": function_name,
-                                "content": json.dumps({"error": f"Error executing function {function_name}: {str(e)}"}),
-                            }
-                        )
-                else:
-                    print(f"Error: Function '{function_name}' not found.")
-                    # Potentially add an error message back to the model for this tool call
-                    conversation_history.append(
-                        {
-                            "tool_call_id": tool_call.id,
-                            "role": "tool",
-                            "name": function_name,
-                            "content": json.dumps({"error": f"Function {function_name} not found."}),
-                        }
-                    )
-
-            # --- Step 4: Send the tool responses back to the model ---
-            print("Sending tool outputs back to OpenAI for summarization...")
-            print(f"History before second call: {conversation_history}")
-            
-            second_response = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=conversation_history,
+        conversation_history.append({"role": "assistant", "content": final_response_message})
+        if cacheable:
+            await _run_blocking(_remember_answer, user_query, final_response_message, budget)
+        return budget.details(final_response_message, stop_reason) if return_details else final_response_message
+
+    except Exception as e:
+        ERRORS.inc(component="conversation", kind="exception")
+        logger.exception("Conversation failed")
+        error_message = f"An internal error occurred during the conversation: {str(e)}"
+        return budget.details(error_message, "error") if return_details else error_message
+
+# --- Streaming Conversation (Server-Sent Events) ---
+def _accumulate_tool_call_deltas(assembled, deltas):
+    """Merges streamed tool-call fragments (keyed by index) into complete tool call dicts."""
+    for delta in deltas:
+        entry = assembled.setdefault(delta.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+        if delta.id:
+            entry["id"] = delta.id
+        if delta.function is not None:
+            if delta.function.name:
+                entry["function"]["name"] += delta.function.name
+            if delta.function.arguments:
+                entry["function"]["arguments"] += delta.function.arguments
+
+def _tool_result_event(tool_message):
+    payload = json.loads(tool_message["content"])
+    if isinstance(payload, dict) and isinstance(payload.get("results"), list): # Paged search results
+        payload = payload["results"]
+    elif isinstance(payload, dict) and "error" in payload:
+        payload = []
+    return {"type": "tool_result", "name": tool_message["name"], "results": len(payload) if isinstance(payload, list) else 1}
+
+_STREAM_END = object()
+
+async def _read_completion_stream(request, deltas, completion):
+    """
+    Reads one streamed completion while holding an LLM slot. Answer text goes
+    onto the ``deltas`` queue as it arrives; tool-call fragments, usage and
+    the call's duration go into ``completion``. The slot is released as soon
+    as OpenAI has finished, however slowly the client reads the deltas.
+    """
+    try:
+        async with _llm_semaphore:
+            started = time.perf_counter()
+            stream = await async_client.chat.completions.create(
+                stream=True,
+                stream_options={"include_usage": True}, # Final chunk carries token usage for the budget
+                **request,
             )
-            final_response_message = second_response.choices[0].message.content
-            # Add final assistant response to history for future turns (if any)
-            conversation_history.append({"role": "assistant", "content": final_response_message})
-            return final_response_message
-        else:
-            # --- If no tool call was requested, LLM provided a direct answer ---
-            final_response_message = response_message.content
-            # Add assistant's direct response to history
-            conversation_history.append({"role": "assistant", "content": final_response_message})
-            return final_response_message
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    completion["usage"] = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    deltas.put_nowait(delta.content)
+                if delta.tool_calls:
+                    _accumulate_tool_call_deltas(completion["tool_calls"], delta.tool_calls)
+            completion["seconds"] = time.perf_counter() - started
+    finally:
+        deltas.put_nowait(_STREAM_END)
+
+async def stream_conversation(user_query, conversation_history=None, tool_memo=None):
+    """
+    Streaming version of run_conversation_async. Yields event dicts as the
+    conversation progresses, so the UI can show progress and render the
+    answer token by token instead of waiting for the whole completion:
+
+        {"type": "tool_call", "name": ..., "arguments": ...}  - the model requested a tool
+        {"type": "tool_result", "name": ..., "results": n}    - the tool finished
+        {"type": "delta", "content": ...}                      - a piece of the answer
+        {"type": "done", "response": ..., "steps": [...]}      - the full answer and step timings
+        {"type": "error", "message": ...}                      - something failed
+    """
+    first_turn = _is_first_turn(conversation_history)
+    cacheable = _is_cacheable(conversation_history)
+    conversation_history = _start_history(user_query, conversation_history)
+    memo = {} if tool_memo is None else tool_memo
+    budget = AgentBudget()
+    stop_reason = None
+
+    if cacheable:
+        cached_response, cached_details = await _run_blocking(_answer_from_cache, user_query, conversation_history, budget)
+        if cached_response is not None:
+            yield {"type": "delta", "content": cached_response}
+            yield dict(cached_details, type="done")
+            return
+
+    try:
+        step, routed_calls = await _route_first_turn_async(user_query, budget) if first_turn else (None, None)
+        if routed_calls:
+            conversation_history.append({"role": "assistant", "content": None, "tool_calls": routed_calls})
+            for tool_call in routed_calls:
+                yield {"type": "tool_call", "name": tool_call["function"]["name"], "arguments": tool_call["function"]["arguments"]}
+            started = time.perf_counter()
+            tool_messages, memoized = await _execute_tool_calls_async(routed_calls, memo)
+            budget.record_tools(step, tool_messages, time.perf_counter() - started, memoized)
+            for tool_message in tool_messages:
+                conversation_history.append(tool_message)
+                yield _tool_result_event(tool_message)
+
+        # Every round is streamed: a direct answer reaches the user
+        # immediately, and tool calls are assembled from their deltas. Text
+        # the model writes before calling tools has been shown too, so it is
+        # part of the final answer (and of the cached one).
+        shown_parts = []
+        while True:
+            stop_reason = budget.exhausted()
+            offer_tools = stop_reason is None
+            answer_parts = []
+            deltas = asyncio.Queue()
+            completion = {"tool_calls": {}, "usage": None, "seconds": 0.0}
+            reader = asyncio.ensure_future(_read_completion_stream(_completion_request(conversation_history, offer_tools), deltas, completion))
+            try:
+                while (content := await deltas.get()) is not _STREAM_END:
+                    answer_parts.append(content)
+                    yield {"type": "delta", "content": content}
+                await reader # Re-raises a failed stream
+            finally:
+                reader.cancel() # No-op once finished; stops reading if the client went away
+            step = budget.record_llm_call(completion["seconds"], completion["usage"])
+            shown_parts.extend(answer_parts)
+
+            tool_calls = completion["tool_calls"]
+            if not tool_calls or not offer_tools:
+                break
+            assembled = [tool_calls[index] for index in sorted(tool_calls)]
+            conversation_history.append({"role": "assistant", "content": "".join(answer_parts) or None, "tool_calls": assembled})
+            for tool_call in assembled:
+                yield {"type": "tool_call", "name": tool_call["function"]["name"], "arguments": tool_call["function"]["arguments"]}
+            started = time.perf_counter()
+            tool_messages, memoized = await _execute_tool_calls_async(assembled, memo)
+            budget.record_tools(step, tool_messages, time.perf_counter() - started, memoized)
+            for tool_message in tool_messages:
+                conversation_history.append(tool_message)
+                yield _tool_result_event(tool_message)
+
+        # The history already holds the pre-tool text with its tool calls
+        conversation_history.append({"role": "assistant", "content": "".join(answer_parts)})
+        final_response_message = "".join(shown_parts)
+        if cacheable:
+            await _run_blocking(_remember_answer, user_query, final_response_message, budget)
+        yield dict(budget.details(final_response_message, stop_reason), type="done")
 
     except Exception as e:
-        print(f"An unexpected error occurred during OpenAI conversation: {e}")
-        return f"An internal error occurred during the conversation: {str(e)}"
+        ERRORS.inc(component="conversation", kind="stream")
+        logger.exception("Streaming conversation failed")
+        yield {"type": "error", "message": f"An internal error occurred during the conversation: {str(e)}"}
 
 # Example of how to run the agent function (for testing)
 if __name__ == "__main__":
@@ -175,6 +904,9 @@ if __name__ == "__main__":
     # If you are running this standalone and haven't loaded .env in main.py or similar:
     from dotenv import load_dotenv
     load_dotenv() # Load .env file if running agent.py directly
+    from app_logging import configure_logging
+    configure_logging()
+    from sessions import compact_history
 
     # Check if API key is loaded (it would have raised an error earlier if not)
     if not os.environ.get("OPENAI_API_KEY"):
@@ -198,6 +930,8 @@ if __name__ == "__main__":
         print("\nAgent Response:")
         print(agent_response)
         # The run_conversation function now appends to the history it was given
-        # so current_conversation_history is updated by reference.
+        # so current_conversation_history is updated by reference. Compact it
+        # between turns so old tool payloads are not re-sent forever.
+        current_conversation_history = compact_history(current_conversation_history)
 
     print("Agent stopped.")
\ No newline at end of file
@@ -1,147 +1,781 @@
 # agent_tools.py
 
-import mysql.connector
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
 from mysql.connector import Error
-import os # For reading environment variables
-from datetime import datetime, timedelta # For date handling in search
+from datetime import date, datetime, timedelta # For date handling in search
+from concurrent.futures import ThreadPoolExecutor
 
-# --- Database Connection Function ---
-def create_db_connection():
+# Connections come from the shared, bounded pool instead of a new TCP
+# connection + handshake per tool call.
+from db_pool import pooled_connection, PoolError
+from replica import replica_connection, ReplicaUnavailable
+from vector_index import get_vector_index
+from caching import ResultCache
+from telemetry import span, run_in_context, ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Storage backend of the database tools: "mysql" (the shared pool) or
+# "replica", the read-only SQLite/FTS5 file data_pipeline publishes after
+# each ingest (see replica.py), searched in-process. Both speak the same
+# schema; the few dialect differences are handled where the SQL is built.
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "mysql").lower()
+# Errors that mean "no database to ask" vs. "the query failed", per backend
+UNAVAILABLE_ERRORS = (PoolError, ReplicaUnavailable)
+DATABASE_ERRORS = (Error, sqlite3.Error)
+
+def _tool_error(message, **fields):
     """
-    Creates a database connection using credentials from environment variables.
-    Returns the connection object or None if connection fails.
+    Payload for a search the backend could not answer. "error" comes first
+    because the agent keeps payloads that start with it out of its tool memo,
+    so the call is retried instead of being answered with empty results.
     """
-    connection = None
-    # Read credentials from environment variables
-    # Provide defaults for host and port if not set in .env
-    db_host = os.environ.get("DB_HOST", "localhost")
-    db_name = os.environ.get("DB_NAME")
-    db_user = os.environ.get("DB_USER")
-    db_password = os.environ.get("DB_PASSWORD")
-    db_port = os.environ.get("DB_PORT", "3306") # Default MySQL port
+    return {"error": message, **fields}
 
-    # Basic check if essential variables were loaded
-    if not all([db_host, db_name, db_user]): # db_password can be empty for some local setups
-         print("CRITICAL ERROR in create_db_connection: DB_HOST, DB_NAME, or DB_USER not found in environment variables. Check .env file and ensure main.py loads it.")
-         return None
+def tool_connection():
+    """Connection context manager of the configured SEARCH_BACKEND."""
+    return replica_connection() if SEARCH_BACKEND == "replica" else pooled_connection()
 
-    try:
-        print(f"Attempting to connect to DB: mysql://{db_user}@{db_host}:{db_port}/{db_name}")
-        connection = mysql.connector.connect(
-            host=db_host,
-            port=int(db_port),    # Ensure port is an integer
-            database=db_name,
-            user=db_user,
-            password=db_password
-        )
-        print("MySQL Database connection successful!")
-        return connection
-    except ValueError as verr: # Handles error if DB_PORT is not a valid number
-        print(f"Configuration Error in create_db_connection: DB_PORT '{db_port}' is not a valid integer. {verr}")
-        return None
-    except Error as err:
-        print(f"Error connecting to DB in create_db_connection: '{err}'")
-        # Log connection details attempted (excluding password for security in logs)
-        print(f"Attempted connection details (excluding password): host={db_host}, port={db_port}, user={db_user}, database={db_name}")
-        return None
-    except Exception as e:
-        print(f"An unexpected error occurred in create_db_connection: {e}")
-        return None
+def _is_sqlite(conn):
+    return isinstance(conn, sqlite3.Connection)
+
+def _dict_cursor(conn):
+    # Replica connections already return dict rows
+    return conn.cursor() if _is_sqlite(conn) else conn.cursor(dictionary=True)
+
+def _dialect_sql(conn, sql):
+    """Query text for ``conn``: SQLite takes ? placeholders where mysql-connector takes %s."""
+    return sql.replace("%s", "?") if _is_sqlite(conn) else sql
+
+def _fts5_query(query):
+    """FTS5 form of a natural-language query: any of its words, each quoted so FTS5 syntax is taken literally."""
+    return " OR ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+# Supported values for the search_mode argument of search_federal_documents.
+# "fulltext" uses the FULLTEXT index on (title, content) created by
+# data_pipeline.ensure_schema(); "like" is the old substring scan, kept for
+# comparison benchmarks and for databases that have not been migrated yet.
+SEARCH_MODES = ("fulltext", "like")
+
+# Results of search_federal_documents are cached in-process, so a retried or
+# repeated call with the same arguments does not go back to MySQL. Entries
+# expire after SEARCH_CACHE_TTL seconds and whenever the pipeline ingests new
+# data; SEARCH_CACHE_MAX_ENTRIES=0 disables the cache. A call waiting on an
+# identical in-flight search runs its own after SEARCH_CACHE_WAIT_SECONDS.
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", "512"))
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_WAIT_SECONDS = float(os.environ.get("SEARCH_CACHE_WAIT_SECONDS", "10"))
+search_cache = (ResultCache(SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_TTL, wait_timeout=SEARCH_CACHE_WAIT_SECONDS)
+                if SEARCH_CACHE_MAX_ENTRIES > 0 else None)
+
+# Fields search_federal_documents can return. Results go straight into the
+# prompt, so content is never returned whole: it is cut to max_content_chars
+# (about four characters per token) in SQL, centred on the first query match
+# when snippets are on, and only the projected columns are fetched.
+RESULT_FIELDS = ("document_number", "title", "agency", "publication_date", "document_url", "content")
+DEFAULT_MAX_CONTENT_CHARS = 500
+MAX_CONTENT_CHARS_LIMIT = 4000
+TITLE_MAX_CHARS = 300
+SNIPPET_ELLIPSIS = "..."
 
 # --- Tool Function to Search Documents ---
-def search_federal_documents(query: str = None, agency: str = None, start_date: str = None, end_date: str = None, limit: int = 10):
+def search_federal_documents(query: str = None, agency: str = None, start_date: str = None, end_date: str = None, limit: int = 10, search_mode: str = "fulltext",
+                             fields: list = None, max_content_chars: int = DEFAULT_MAX_CONTENT_CHARS, snippet: bool = True, cursor: str = None):
     """
     Searches the federal documents database based on various criteria.
 
     Args:
         query (str, optional): Keywords to search in title or content. Defaults to None.
-        agency (str, optional): Filter by agency name. Defaults to None.
+        agency (str, optional): Filter by agency name (exact or prefix match against each of
+            the document's agencies). Defaults to None.
         start_date (str, optional): Start date for publication date filter (YYYY-MM-DD). Defaults to None.
         end_date (str, optional): End date for publication date filter (YYYY-MM-DD). Defaults to None.
         limit (int, optional): Maximum number of results to return. Defaults to 10.
+        search_mode (str, optional): "fulltext" (indexed MATCH ... AGAINST, ordered by
+            relevance, then newest first) or "like" (legacy substring scan, newest
+            first). Defaults to "fulltext".
+        fields (list, optional): Subset of RESULT_FIELDS to return; document_number
+            is always included. Defaults to all fields.
+        max_content_chars (int, optional): Character budget for content (at most
+            MAX_CONTENT_CHARS_LIMIT). Defaults to DEFAULT_MAX_CONTENT_CHARS.
+        snippet (bool, optional): Cut content around the first match of the query
+            instead of taking its beginning. Defaults to True.
+        cursor (str, optional): The next_cursor of a previous call with the same
+            other arguments (limit and the output options may change); returns the
+            page after it. A cursor from a search with other filters is rejected
+            with an "error". Defaults to None (first page).
 
     Returns:
-        list: A list of dictionaries, where each dictionary represents a matching document.
-              Returns an empty list if no results or an error occurs.
+        dict: {"results": [...], "next_cursor": str or None}. Each result is a
+              dictionary representing a matching document; truncated content is
+              marked with "..." at the cut ends. next_cursor is None on the last
+              page. Results are empty if nothing matches; if the database failed
+              the page also carries an "error" message.
     """
-    conn = create_db_connection() # Call the updated connection function
-    results = [] # Default to empty list
+    page = {"results": [], "next_cursor": None} # Default to an empty page
+    fields = _parse_fields(fields)
+    max_content_chars = _parse_max_chars(max_content_chars)
+    snippet = bool(snippet)
+    search_key = _search_cache_key(query, agency, start_date, end_date, limit, search_mode)
+    filters = _filters_fingerprint(search_key)
+    try:
+        after = _decode_cursor(cursor, filters)
+    except CursorMismatch:
+        logger.warning("Cursor was issued for a search with other filters; rejecting it")
+        return _tool_error("This cursor belongs to a search with other arguments; repeat the search without a cursor.", **page)
 
-    if conn is None:
-        print("Database connection failed in search_federal_documents, cannot perform search.")
-        return results # Return empty list if connection failed
+    def run():
+        with tool_connection() as conn:
+            return _run_search(conn, query, agency, start_date, end_date, limit, search_mode,
+                               fields, max_content_chars, snippet, after, filters)
 
-    cursor = None # Initialize cursor to None to ensure it's defined for finally block
     try:
-        cursor = conn.cursor(dictionary=True) # Use dictionary=True for easier result handling
+        if search_cache is None:
+            page = run()
+        else:
+            # Failed searches raise out of run() and are therefore never cached
+            key = search_key + (fields, max_content_chars, snippet, after)
+            page = search_cache.get_or_compute(key, run)
+    except UNAVAILABLE_ERRORS as err:
+        ERRORS.inc(component="search_federal_documents", kind="pool")
+        logger.error("Database connection unavailable in search_federal_documents: %s", err)
+        page = _tool_error("The document database is unavailable right now.", **page)
+    except DATABASE_ERRORS as err:
+        ERRORS.inc(component="search_federal_documents", kind="database")
+        logger.error("Error executing search query in search_federal_documents: %s", err)
+        page = _tool_error("The document search failed.", **page)
+    except Exception:
+        ERRORS.inc(component="search_federal_documents", kind="unexpected")
+        logger.exception("Unexpected error in search_federal_documents")
+        page = _tool_error("The document search failed.", **page)
 
-        sql_query_parts = ["SELECT document_number, title, agency, publication_date, document_url, content FROM federal_documents WHERE 1=1"]
-        params = [] # Use parameterized queries to prevent SQL injection
+    return page
+
+def _normalize_argument(value):
+    """Case- and whitespace-insensitive form of a text argument (MySQL comparisons ignore case too)."""
+    return " ".join(value.lower().split()) if isinstance(value, str) else value
+
+def _search_cache_key(query, agency, start_date, end_date, limit, search_mode):
+    # A LIKE pattern matches the text as given, spaces included; only the
+    # indexed search tokenizes it, so only there do rewordings share a key
+    normalize = (lambda value: value) if search_mode == "like" else _normalize_argument
+    return (
+        normalize(query) or None,
+        normalize(agency) or None,
+        (start_date or "").strip() or None,
+        (end_date or "").strip() or None,
+        _parse_limit(limit),
+        search_mode,
+    )
+
+def _parse_limit(limit, default=10):
+    """Returns ``limit`` as a positive int, falling back to ``default``."""
+    try:
+        limit_int = int(limit)
+    except (TypeError, ValueError):
+        logger.warning("Invalid limit value %r; defaulting to %s", limit, default)
+        return default
+    return limit_int if limit_int > 0 else default # Prevent non-positive limits
+
+def _add_date_filters(sql_query_parts, params, start_date, end_date, column="publication_date"):
+    """Validates YYYY-MM-DD bounds and appends them as parameterised filters on ``column``."""
+    if start_date:
+        try:
+            datetime.strptime(start_date, '%Y-%m-%d') # Validate format
+            sql_query_parts.append(f"AND {column} >= %s")
+            params.append(start_date)
+        except ValueError:
+            logger.warning("Invalid start_date format %r; ignoring it", start_date)
+    if end_date:
+        try:
+            datetime.strptime(end_date, '%Y-%m-%d') # Validate format
+            sql_query_parts.append(f"AND {column} <= %s")
+            params.append(end_date)
+        except ValueError:
+            logger.warning("Invalid end_date format %r; ignoring it", end_date)
+
+def _serialize_row(row):
+    """Converts date/datetime values to ISO strings so the row can be JSON-encoded for the LLM."""
+    for key, value in row.items():
+        if isinstance(value, (datetime, date)): # Check for both date and datetime
+            row[key] = value.isoformat()
+    if "relevance" in row:
+        row["relevance"] = round(float(row["relevance"]), 4)
+    return row
+
+def _parse_fields(fields):
+    """Returns the requested result fields in canonical order; document_number is always included."""
+    if not fields:
+        return RESULT_FIELDS
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    requested = {str(field).strip().lower() for field in fields}
+    unknown = requested - set(RESULT_FIELDS)
+    if unknown:
+        logger.warning("Ignoring unknown fields %s", sorted(unknown))
+    return tuple(field for field in RESULT_FIELDS if field in requested or field == "document_number")
+
+def _parse_max_chars(max_chars, default=DEFAULT_MAX_CONTENT_CHARS):
+    """Returns ``max_chars`` clamped to [1, MAX_CONTENT_CHARS_LIMIT], falling back to ``default``."""
+    try:
+        max_chars = int(max_chars)
+    except (TypeError, ValueError):
+        logger.warning("Invalid max_content_chars value %r; defaulting to %s", max_chars, default)
+        return default
+    return min(max(max_chars, 1), MAX_CONTENT_CHARS_LIMIT)
+
+def _snippet_term(query):
+    """The longest word of the query: the rarest, so the best anchor for a snippet."""
+    words = [word for word in (query or "").split() if any(ch.isalnum() for ch in word)]
+    return max(words, key=len).strip("\"'.,;:!?()") if words else None
+
+def _projection_sql(fields, max_content_chars, snippet_term, sqlite=False):
+    """
+    Returns (select expressions, params) for the projected fields. Content is
+    cut in SQL, so at most ``max_content_chars`` characters leave the server.
+    """
+    columns = []
+    params = []
+    for field in fields:
+        if field == "title":
+            columns.append(f"substr(title, 1, {TITLE_MAX_CHARS}) AS title" if sqlite else f"LEFT(title, {TITLE_MAX_CHARS}) AS title")
+        elif field == "content":
+            if snippet_term:
+                # Start a third of the budget before the first match; LOCATE is 0
+                # when the term is absent, which falls back to the lead text
+                if sqlite:
+                    start = "max(1, instr(lower(content), lower(%s)) - %s)" # instr() is case-sensitive
+                else:
+                    start = "GREATEST(1, LOCATE(%s, content) - %s)"
+                columns.append(f"{start} AS snippet_start")
+                columns.append(f"{'substr' if sqlite else 'SUBSTRING'}(content, {start}, %s) AS content")
+                lead_in = max_content_chars // 3
+                params.extend([snippet_term, lead_in, snippet_term, lead_in, max_content_chars])
+            else:
+                columns.append("1 AS snippet_start")
+                columns.append("substr(content, 1, %s) AS content" if sqlite else "LEFT(content, %s) AS content")
+                params.append(max_content_chars)
+            columns.append(f"{'length' if sqlite else 'CHAR_LENGTH'}(content) AS content_length")
+        else:
+            columns.append(field)
+    return columns, params
+
+def _mark_truncation(row):
+    """Replaces the snippet bookkeeping columns with "..." markers on the cut ends of content."""
+    start = row.pop("snippet_start", None)
+    length = row.pop("content_length", None)
+    content = row.get("content")
+    if content and start is not None and length is not None:
+        if start - 1 + len(content) < length:
+            content += SNIPPET_ELLIPSIS
+        if start > 1:
+            content = SNIPPET_ELLIPSIS + content
+        row["content"] = content
+    return row
+
+def _escape_like(value):
+    """Escapes LIKE wildcards so user input is matched literally."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _add_agency_filter(sql_query_parts, params, agency, start_date=None, end_date=None, prefix=True, column="document_number", sqlite=False):
+    """
+    Restricts ``column`` to documents linked to a matching agency through
+    agencies/document_agencies. Each agency name is matched on its own, so a
+    short name no longer matches inside another agency's name. The date bounds
+    are repeated on the link table so idx_agency_date (agency_id,
+    publication_date) serves both filters.
+    """
+    subquery = [
+        "SELECT da.document_number FROM agencies a"
+        " JOIN document_agencies da ON da.agency_id = a.agency_id"
+        " WHERE a.name LIKE %s" + (" ESCAPE '\\'" if sqlite else "") # Backslash is already MySQL's default
+    ]
+    params.append(f"{_escape_like(agency)}%" if prefix else f"%{_escape_like(agency)}%")
+    _add_date_filters(subquery, params, start_date, end_date, column="da.publication_date")
+    sql_query_parts.append(f"AND {column} IN ({' '.join(subquery)})")
+
+# --- Keyset Pagination ---
+# Pages are cut on the sort key of search_federal_documents: (relevance,
+# publication_date, document_number) for ranked fulltext searches and
+# (publication_date, document_number) otherwise, all descending. The cursor
+# is the key of the last returned row, so the next page starts right after it
+# with a range condition instead of re-reading and skipping earlier rows. It
+# also carries a fingerprint of the search's filters: positions in one result
+# list mean nothing in another.
+class CursorMismatch(Exception):
+    """A next_cursor was passed with other filters than the search that issued it."""
+
+def _filters_fingerprint(search_key):
+    """Short hash of a search's filters: its cache key (see _search_cache_key) without the limit."""
+    query, agency, start_date, end_date, _, search_mode = search_key
+    filters = json.dumps([query, agency, start_date, end_date, search_mode])
+    return hashlib.sha256(filters.encode("utf-8")).hexdigest()[:16]
+
+def _encode_cursor(row, use_fulltext, filters):
+    key = {"d": str(row["page_date"])[:10] if row["page_date"] else None, "n": row["document_number"], "f": filters}
+    if use_fulltext:
+        key["r"] = repr(float(row["relevance"])) # repr() round-trips the exact double
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor, filters):
+    """
+    Returns the (relevance, date, document_number) key of a next_cursor, or
+    None if it is missing or invalid. Raises CursorMismatch if it was issued
+    for a search whose filters fingerprint is not ``filters``.
+    """
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(str(cursor).encode("ascii")))
+        relevance = key.get("r")
+        if relevance is not None:
+            float(relevance) # Validate; sent to MySQL as the exact string
+        if key.get("d") is not None:
+            datetime.strptime(key["d"], '%Y-%m-%d')
+        after, issued_for = (relevance, key.get("d"), str(key["n"])), key["f"]
+    except (ValueError, TypeError, KeyError, AttributeError, UnicodeError):
+        logger.warning("Invalid cursor %r; returning the first page", cursor)
+        return None
+    if issued_for != filters:
+        raise CursorMismatch(cursor)
+    return after
+
+def _add_keyset_filter(sql_query_parts, params, after, relevance_sql=None, relevance_params=()):
+    """Appends the condition for rows sorting after the ``after`` key (see _decode_cursor)."""
+    relevance, page_date, number = after
+    # publication_date DESC puts NULL dates last
+    if page_date is None:
+        date_key = "(publication_date IS NULL AND document_number < %s)"
+        date_params = [number]
+    else:
+        date_key = ("(publication_date < %s OR (publication_date = %s AND document_number < %s)"
+                    " OR publication_date IS NULL)")
+        date_params = [page_date, page_date, number]
+    if relevance_sql is None:
+        sql_query_parts.append(f"AND {date_key}")
+        params.extend(date_params)
+    else:
+        sql_query_parts.append(f"AND ({relevance_sql} < %s OR ({relevance_sql} = %s AND {date_key}))")
+        params.extend([*relevance_params, relevance, *relevance_params, relevance, *date_params])
+
+def _run_search(conn, query, agency, start_date, end_date, limit, search_mode,
+                fields=RESULT_FIELDS, max_content_chars=DEFAULT_MAX_CONTENT_CHARS, snippet=True, after=None, filters=None):
+    """Builds and runs the search query on a checked-out connection; returns a results/next_cursor page."""
+    if search_mode not in SEARCH_MODES:
+        logger.warning("Unknown search_mode %r; defaulting to 'fulltext'", search_mode)
+        search_mode = "fulltext"
+    use_fulltext = bool(query) and search_mode == "fulltext"
+    if after is not None and (after[0] is not None) != use_fulltext:
+        logger.warning("Cursor does not match the search's ordering; returning the first page")
+        after = None
+
+    sqlite = _is_sqlite(conn)
+    cursor = _dict_cursor(conn) # Dictionary rows for easier result handling
+    try:
+        # Use parameterized queries to prevent SQL injection
+        columns, params = _projection_sql(fields, max_content_chars, _snippet_term(query) if snippet else None, sqlite)
+        # Sort key for next_cursor, whether or not publication_date is projected
+        select_columns = ", ".join(columns + ["publication_date AS page_date"])
+        if sqlite:
+            # bm25() is lower for better matches; negated so both backends sort relevance DESC
+            relevance_sql, relevance_params = "-bm25(documents_fts)", []
+        else:
+            relevance_sql, relevance_params = "MATCH(title, content) AGAINST (%s IN NATURAL LANGUAGE MODE)", [query]
+        if use_fulltext:
+            # Relevance score is selected so results can be ordered by it
+            select_columns += f", {relevance_sql} AS relevance"
+            params.extend(relevance_params)
+        if use_fulltext and sqlite:
+            sql_query_parts = [f"SELECT {select_columns} FROM documents_fts"
+                               " JOIN federal_documents ON federal_documents.rowid = documents_fts.rowid WHERE 1=1"]
+        else:
+            sql_query_parts = [f"SELECT {select_columns} FROM federal_documents WHERE 1=1"]
 
         if query:
-            sql_query_parts.append("AND (title LIKE %s OR content LIKE %s)")
-            params.extend([f"%{query}%", f"%{query}%"])
+            if use_fulltext and sqlite:
+                sql_query_parts.append("AND documents_fts MATCH %s")
+                params.append(_fts5_query(query))
+            elif use_fulltext:
+                sql_query_parts.append("AND MATCH(title, content) AGAINST (%s IN NATURAL LANGUAGE MODE)")
+                params.append(query)
+            else:
+                sql_query_parts.append("AND (title LIKE %s OR content LIKE %s)")
+                params.extend([f"%{query}%", f"%{query}%"])
         if agency:
-            sql_query_parts.append("AND agency LIKE %s")
-            params.append(f"%{agency}%")
+            # Fulltext mode matches agency names by prefix (an exact name is a
+            # prefix of itself); like mode matches anywhere in a name
+            _add_agency_filter(sql_query_parts, params, agency, start_date, end_date, prefix=search_mode == "fulltext", sqlite=sqlite)
+
+        _add_date_filters(sql_query_parts, params, start_date, end_date)
+
+        if after is not None:
+            if use_fulltext:
+                if sqlite: # A REAL compared with a TEXT parameter never matches in SQLite
+                    after = (float(after[0]),) + after[1:]
+                _add_keyset_filter(sql_query_parts, params, after, relevance_sql, relevance_params)
+            else:
+                _add_keyset_filter(sql_query_parts, params, after)
 
-        # Validate and add date parameters
-        if start_date:
+        # Newest first, with the document number as a tie-breaker, so equal
+        # relevance (or no query at all) still gives a stable order
+        sql_query_parts.append("ORDER BY " + ("relevance DESC, " if use_fulltext else "") + "publication_date DESC, document_number DESC")
+
+        limit_int = _parse_limit(limit)
+        sql_query_parts.append("LIMIT %s")
+        params.append(limit_int + 1) # One extra row tells whether there is a next page
+
+        final_sql_query = _dialect_sql(conn, " ".join(sql_query_parts))
+        logger.debug("Executing SQL: %s with params: %s", final_sql_query, params)
+
+        with span("db.execute", tool="search_federal_documents"):
+            cursor.execute(final_sql_query, params)
+        with span("db.fetch", tool="search_federal_documents"):
+            fetched_results = cursor.fetchall()
+        logger.debug("Found %d documents from database", len(fetched_results))
+
+        next_cursor = None
+        if len(fetched_results) > limit_int:
+            fetched_results = fetched_results[:limit_int]
+            next_cursor = _encode_cursor(fetched_results[-1], use_fulltext, filters)
+
+        with span("db.serialize", tool="search_federal_documents"):
+            for row in fetched_results:
+                row.pop("page_date", None)
+            results = [_mark_truncation(_serialize_row(row)) for row in fetched_results]
+
+    finally:
+        # The connection itself goes back to the pool; only the cursor is closed here
+        cursor.close()
+
+    return {"results": results, "next_cursor": next_cursor}
+
+# --- Tool Function to Search Full-Text Passages ---
+def search_document_passages(query: str, agency: str = None, start_date: str = None, end_date: str = None, limit: int = 5):
+    """
+    Searches the chunked full text of documents (document_chunks, filled by the
+    pipeline's full-text stage) and returns the most relevant short passages
+    instead of whole documents.
+
+    Args:
+        query (str): Keywords to look for in the document text.
+        agency (str, optional): Filter by agency name (exact or prefix match). Defaults to None.
+        start_date (str, optional): Start date for publication date filter (YYYY-MM-DD). Defaults to None.
+        end_date (str, optional): End date for publication date filter (YYYY-MM-DD). Defaults to None.
+        limit (int, optional): Maximum number of passages to return. Defaults to 5.
+
+    Returns:
+        list: Passages with their document's metadata, most relevant first.
+              Returns an empty list if nothing matches, or {"error": ...} if
+              the database failed.
+    """
+    if not query:
+        return []
+
+    results = []
+    try:
+        with tool_connection() as conn:
+            sql, params = _passages_sql(_is_sqlite(conn), query, agency, start_date, end_date, limit)
+            cursor = _dict_cursor(conn)
             try:
-                datetime.strptime(start_date, '%Y-%m-%d') # Validate format
-                sql_query_parts.append("AND publication_date >= %s")
-                params.append(start_date)
-            except ValueError:
-                print(f"Invalid start_date format: {start_date}. Ignoring.")
-        if end_date:
+                with span("db.execute", tool="search_document_passages"):
+                    cursor.execute(_dialect_sql(conn, sql), params)
+                with span("db.fetch", tool="search_document_passages"):
+                    rows = cursor.fetchall()
+                with span("db.serialize", tool="search_document_passages"):
+                    results = [_serialize_row(row) for row in rows]
+            finally:
+                cursor.close()
+        logger.debug("Found %d passages from database", len(results))
+    except UNAVAILABLE_ERRORS as err:
+        ERRORS.inc(component="search_document_passages", kind="pool")
+        logger.error("Database connection unavailable in search_document_passages: %s", err)
+        return _tool_error("The document database is unavailable right now.")
+    except DATABASE_ERRORS as err:
+        ERRORS.inc(component="search_document_passages", kind="database")
+        logger.error("Error executing passage query in search_document_passages: %s", err)
+        return _tool_error("The passage search failed.")
+    return results
+
+def _passages_sql(sqlite, query, agency, start_date, end_date, limit):
+    """Returns (sql, params) of the passage search for either backend."""
+    columns = "c.document_number, c.chunk_index, c.content AS passage, d.title, d.agency, d.publication_date, d.document_url"
+    if sqlite:
+        sql_query_parts = [
+            f"SELECT {columns}, -bm25(chunks_fts) AS relevance"
+            " FROM chunks_fts JOIN document_chunks c ON c.rowid = chunks_fts.rowid"
+            " JOIN federal_documents d ON d.document_number = c.document_number"
+            " WHERE chunks_fts MATCH %s"
+        ]
+        params = [_fts5_query(query)]
+    else:
+        sql_query_parts = [
+            f"SELECT {columns}, MATCH(c.content) AGAINST (%s IN NATURAL LANGUAGE MODE) AS relevance"
+            " FROM document_chunks c JOIN federal_documents d ON d.document_number = c.document_number"
+            " WHERE MATCH(c.content) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+        ]
+        params = [query, query]
+    if agency:
+        _add_agency_filter(sql_query_parts, params, agency, start_date, end_date, column="d.document_number", sqlite=sqlite)
+    _add_date_filters(sql_query_parts, params, start_date, end_date, column="d.publication_date")
+    sql_query_parts.append("ORDER BY relevance DESC, d.publication_date DESC, c.document_number DESC, c.chunk_index LIMIT %s")
+    params.append(_parse_limit(limit, default=5))
+    return " ".join(sql_query_parts), params
+
+# --- Tool Function for Aggregate Counts ---
+# Dimensions document_stats can group by, mapped to their column in the
+# stats tables that data_pipeline keeps up to date on every ingest batch.
+STATS_GROUPS = {"agency": "a.name", "month": "s.month", "document_type": "s.document_type"}
+
+def document_stats(group_by=None, agency: str = None, document_type: str = None, start_date: str = None, end_date: str = None, limit: int = 20):
+    """
+    Counts documents by agency, month and/or document type from the
+    pre-aggregated stats tables instead of fetching and counting documents.
+
+    Args:
+        group_by (list or str, optional): Any of "agency", "month" and "document_type"
+            (a list or a comma-separated string). Defaults to ["agency"]; an empty
+            list returns a single overall count.
+        agency (str, optional): Only count documents of agencies whose name starts
+            with this text. Defaults to None.
+        document_type (str, optional): Only count this type ("Rule", "Proposed Rule",
+            "Notice" or "Presidential Document"). Defaults to None.
+        start_date (str, optional): First month to count (YYYY-MM-DD or YYYY-MM);
+            counts are per calendar month, so the whole month is included. Defaults to None.
+        end_date (str, optional): Last month to count, as for start_date. Defaults to None.
+        limit (int, optional): Maximum number of rows to return, largest counts
+            first. Defaults to 20.
+
+    Returns:
+        dict: {"group_by": [...], "rows": [{<group>: value, ..., "documents": n}],
+               "truncated": bool}. A document with several agencies counts once
+               per agency when grouping or filtering by agency. If the database
+               failed, rows are empty and an "error" message comes first.
+    """
+    groups = _parse_groups(group_by)
+    limit_int = _parse_limit(limit, default=20)
+
+    rows = []
+    try:
+        with tool_connection() as conn:
+            sql, params = _stats_sql(_is_sqlite(conn), groups, agency, document_type, start_date, end_date, limit_int)
+            cursor = _dict_cursor(conn)
             try:
-                datetime.strptime(end_date, '%Y-%m-%d') # Validate format
-                sql_query_parts.append("AND publication_date <= %s")
-                params.append(end_date)
-            except ValueError:
-                print(f"Invalid end_date format: {end_date}. Ignoring.")
+                with span("db.execute", tool="document_stats"):
+                    cursor.execute(_dialect_sql(conn, sql), params)
+                with span("db.fetch", tool="document_stats"):
+                    rows = cursor.fetchall()
+            finally:
+                cursor.close()
+    except UNAVAILABLE_ERRORS as err:
+        ERRORS.inc(component="document_stats", kind="pool")
+        logger.error("Database connection unavailable in document_stats: %s", err)
+        return _tool_error("The document database is unavailable right now.", group_by=groups, rows=[], truncated=False)
+    except DATABASE_ERRORS as err:
+        ERRORS.inc(component="document_stats", kind="database")
+        logger.error("Error executing stats query in document_stats: %s", err)
+        return _tool_error("The document statistics query failed.", group_by=groups, rows=[], truncated=False)
+
+    for row in rows:
+        row["documents"] = int(row["documents"] or 0) # SUM() comes back as a Decimal
+        if "document_type" in row:
+            row["document_type"] = row["document_type"] or None
+    return {"group_by": groups, "rows": rows[:limit_int], "truncated": len(rows) > limit_int}
+
+def _stats_sql(sqlite, groups, agency, document_type, start_date, end_date, limit_int):
+    """Returns (sql, params) of a document_stats query for either backend."""
+    by_agency = "agency" in groups or bool(agency)
+    columns = [f"{STATS_GROUPS[group]} AS {group}" for group in groups]
+    sql_query_parts = [
+        f"SELECT {', '.join(columns + ['SUM(s.documents) AS documents'])}",
+        "FROM stats_agency_month_type s JOIN agencies a ON a.agency_id = s.agency_id" if by_agency else "FROM stats_month_type s",
+        "WHERE 1=1",
+    ]
+    params = []
+    if agency:
+        sql_query_parts.append("AND a.name LIKE %s" + (" ESCAPE '\\'" if sqlite else ""))
+        params.append(f"{_escape_like(agency)}%")
+    if document_type:
+        sql_query_parts.append("AND s.document_type = %s")
+        params.append(document_type)
+    for bound, operator in ((start_date, ">="), (end_date, "<=")):
+        month = _parse_month(bound)
+        if month:
+            sql_query_parts.append(f"AND s.month {operator} %s")
+            params.append(month)
+    if groups:
+        sql_query_parts.append("GROUP BY " + ", ".join(STATS_GROUPS[group] for group in groups))
+        sql_query_parts.append("ORDER BY documents DESC, " + ", ".join(STATS_GROUPS[group] for group in groups))
+    sql_query_parts.append("LIMIT %s")
+    params.append(limit_int + 1) # One extra row tells whether the result was cut
+    return " ".join(sql_query_parts), params
 
-        # Add limit (ensure it's an integer)
+def _parse_groups(group_by):
+    """Returns the valid STATS_GROUPS named in a list or comma-separated string, in order."""
+    if group_by is None:
+        return ["agency"]
+    if isinstance(group_by, str):
+        group_by = group_by.split(",")
+    groups = []
+    for group in group_by:
+        group = str(group).strip().lower()
+        if group in STATS_GROUPS and group not in groups:
+            groups.append(group)
+        elif group:
+            logger.warning("Ignoring unknown document_stats group %r", group)
+    return groups
+
+def _parse_month(value):
+    """Returns 'YYYY-MM' for a YYYY-MM-DD or YYYY-MM date, or None if it is missing or invalid."""
+    if not value:
+        return None
+    for date_format in ('%Y-%m-%d', '%Y-%m'):
         try:
-            limit_int = int(limit)
-            if limit_int <= 0: # Prevent non-positive limits
-                limit_int = 10 # Default to 10 if invalid
-            sql_query_parts.append("LIMIT %s")
-            params.append(limit_int)
+            return datetime.strptime(value, date_format).strftime('%Y-%m')
         except ValueError:
-            print(f"Invalid limit value: {limit}. Defaulting to 10.")
-            sql_query_parts.append("LIMIT %s")
-            params.append(10)
-
-
-        final_sql_query = " ".join(sql_query_parts)
-        print(f"Executing SQL: {final_sql_query} with params: {params}")
-
-        cursor.execute(final_sql_query, params)
-        fetched_results = cursor.fetchall()
-        print(f"Found {len(fetched_results)} documents from database.")
-
-        # Convert date/datetime objects to strings for JSON serialization if needed by the LLM
-        for row in fetched_results:
-            for key, value in row.items():
-                if isinstance(value, (datetime, datetime.date)): # Check for both date and datetime
-                    row[key] = value.isoformat()
-            results.append(row)
-
-    except Error as err:
-        print(f"Error executing search query in search_federal_documents: '{err}'")
-        # results will remain empty or partially filled if error occurs mid-fetch
-    except Exception as e:
-        print(f"An unexpected error occurred in search_federal_documents: {e}")
-    finally:
-        # Ensure cursor and connection are closed even if errors occur
-        if cursor:
-            cursor.close()
-            print("Database cursor closed.")
-        if conn and conn.is_connected(): # Check if connection object exists and is connected
-            conn.close()
-            print("Database connection closed.")
+            continue
+    logger.warning("Invalid date %r for document_stats; ignoring it", value)
+    return None
 
+# --- Tool Function for Semantic (Vector) Search ---
+def semantic_search_documents(query: str = None, queries: list = None, agency: str = None, start_date: str = None, end_date: str = None, limit: int = 10):
+    """
+    Finds documents whose meaning is close to the query, using the local
+    embedding index filled by data_pipeline.py (no keyword overlap required).
+
+    Args:
+        query (str, optional): Natural-language description of what to find.
+        queries (list, optional): Several phrasings searched in one batched call;
+            results are merged, keeping each document's best score.
+        agency (str, optional): Filter by agency name (exact or prefix match against each of
+            the document's agencies, as in search_federal_documents).
+        start_date (str, optional): Start date for publication date filter (YYYY-MM-DD).
+        end_date (str, optional): End date for publication date filter (YYYY-MM-DD).
+        limit (int, optional): Maximum number of results to return. Defaults to 10.
+
+    Returns:
+        list: Matching documents (metadata, a short summary and a cosine "score"),
+              best first. Returns an empty list if nothing matches, or
+              {"error": ...} if the vector index is missing or failed.
+    """
+    texts = [q for q in ([query] if query else []) + list(queries or []) if q]
+    if not texts:
+        return []
+    limit_int = _parse_limit(limit)
+
+    try:
+        with span("vector.search"):
+            per_query = get_vector_index().search(texts, top_k=limit_int, agency=agency, start_date=start_date, end_date=end_date)
+    except FileNotFoundError as err:
+        ERRORS.inc(component="semantic_search_documents", kind="index_missing")
+        logger.error("Vector index not available for semantic_search_documents: %s", err)
+        return _tool_error("Semantic search is not available right now.")
+    except Exception:
+        ERRORS.inc(component="semantic_search_documents", kind="unexpected")
+        logger.exception("Unexpected error in semantic_search_documents")
+        return _tool_error("The semantic search failed.")
+
+    # Merge the per-query lists, keeping the best score per document
+    best = {}
+    for hits in per_query:
+        for hit in hits:
+            current = best.get(hit["document_number"])
+            if current is None or hit["score"] > current["score"]:
+                best[hit["document_number"]] = hit
+    results = sorted(best.values(), key=lambda hit: hit["score"], reverse=True)[:limit_int]
+    logger.debug("Semantic search found %d documents", len(results))
     return results
 
+# --- Tool Function for Hybrid (Keyword + Semantic) Search ---
+# Constant from the reciprocal rank fusion paper; it damps the influence of the
+# very top ranks so one list cannot dominate the merged ranking on its own.
+RRF_K = 60
+
+# Shared pool for running the two retrievers side by side. Two workers per
+# concurrent hybrid call is all that is needed; the cap just bounds threads.
+_hybrid_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-search")
+
+def reciprocal_rank_fusion(result_lists, k=RRF_K, key="document_number"):
+    """
+    Merges several ranked result lists with reciprocal rank fusion:
+    score(doc) = sum over lists of 1 / (k + rank), rank starting at 1.
+
+    Documents are deduplicated on ``key``; the first list a document appears in
+    provides its fields. Returns the merged list, best first, with an added
+    "rrf_score".
+    """
+    merged = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            doc_id = doc.get(key)
+            if not doc_id:
+                continue
+            entry = merged.get(doc_id)
+            if entry is None:
+                entry = merged[doc_id] = dict(doc, rrf_score=0.0)
+            entry["rrf_score"] += 1.0 / (k + rank)
+    ranked = sorted(merged.values(), key=lambda doc: doc["rrf_score"], reverse=True)
+    for doc in ranked:
+        doc["rrf_score"] = round(doc["rrf_score"], 6)
+    return ranked
+
+def hybrid_search(query: str, agency: str = None, start_date: str = None, end_date: str = None, limit: int = 10):
+    """
+    Runs the full-text keyword search and the semantic vector search
+    concurrently and merges them with reciprocal rank fusion, so a single
+    call covers both exact terms and paraphrases.
+
+    Args:
+        query (str): What to search for.
+        agency (str, optional): Filter by agency name. Defaults to None.
+        start_date (str, optional): Start date for publication date filter (YYYY-MM-DD). Defaults to None.
+        end_date (str, optional): End date for publication date filter (YYYY-MM-DD). Defaults to None.
+        limit (int, optional): Maximum number of results to return. Defaults to 10.
+
+    Returns:
+        list: Up to ``limit`` documents deduplicated on document_number, each with
+              an "rrf_score" and a "matched_by" list naming the retrievers that found it.
+              If a retriever failed: {"error": ..., "results": [...]} with the
+              other retriever's results, or just {"error": ...} if both failed.
+    """
+    limit_int = _parse_limit(limit)
+    # Each retriever contributes a deeper candidate list than the final cut,
+    # otherwise documents ranked moderately by both would never be fused.
+    candidates = max(limit_int * 2, 20)
+
+    # Submitted in the caller's context so the searches' spans join its trace
+    keyword_future = run_in_context(_hybrid_executor,
+        search_federal_documents, query=query, agency=agency, start_date=start_date, end_date=end_date, limit=candidates
+    )
+    semantic_future = run_in_context(_hybrid_executor,
+        semantic_search_documents, query=query, agency=agency, start_date=start_date, end_date=end_date, limit=candidates
+    )
+    # Both tool functions catch their own errors and report them as an "error" payload
+    keyword_page = keyword_future.result()
+    semantic_results = semantic_future.result()
+    errors = [payload["error"] for payload in (keyword_page, semantic_results) if isinstance(payload, dict) and "error" in payload]
+    if len(errors) == 2:
+        return _tool_error(" ".join(errors))
+    keyword_results = keyword_page["results"]
+    if isinstance(semantic_results, dict):
+        semantic_results = []
+
+    keyword_ids = {doc["document_number"] for doc in keyword_results}
+    semantic_ids = {doc["document_number"] for doc in semantic_results}
+    merged = reciprocal_rank_fusion([keyword_results, semantic_results])[:limit_int]
+    for doc in merged:
+        doc["matched_by"] = [name for name, ids in (("keyword", keyword_ids), ("semantic", semantic_ids)) if doc["document_number"] in ids]
+        # Per-retriever scores are not comparable with each other; drop them
+        doc.pop("relevance", None)
+        doc.pop("score", None)
+    logger.debug("Hybrid search merged %d keyword and %d semantic hits into %d results",
+                 len(keyword_results), len(semantic_results), len(merged))
+    if errors:
+        return _tool_error(errors[0], results=merged)
+    return merged
+
 # You can add other tool functions here if needed, following a similar pattern.
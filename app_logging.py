@@ -0,0 +1,126 @@
+# app_logging.py
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+
+# Modules log through the standard library (logger = logging.getLogger(__name__))
+# with %-style arguments, so a message below the configured level is never
+# formatted. configure_logging() routes every record through a bounded queue
+# to a single background thread that formats and writes it, so request
+# threads and the event loop never block on stdout/stderr.
+#
+# Settings:
+#   LOG_LEVEL        DEBUG | INFO (default) | WARNING | ERROR
+#   LOG_FORMAT       json (default) | text
+#   LOG_SAMPLE_RATE  fraction of DEBUG/INFO records kept, default 1.0;
+#                    warnings and errors are always kept
+#   LOG_QUEUE_SIZE   records buffered for the writer thread, default 10000;
+#                    when full, new records are dropped rather than blocking
+
+# Attributes every LogRecord has; anything else was passed via extra= and is
+# emitted as a structured field
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, any extra= fields and the exception."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a ``rate`` fraction of records below WARNING; always keeps warnings and errors."""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1.0 or random.random() < self.rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking the caller when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def prepare(self, record):
+        # The listener thread formats the record; only the arguments are
+        # merged here so mutable objects are captured as they were
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_listener = None
+_queue_handler = None
+_configure_lock = threading.Lock()
+
+def configure_logging(level=None):
+    """
+    Installs the queued handler on the root logger (once per process; later
+    calls only change the level). Returns the root logger.
+    """
+    global _listener, _queue_handler
+    root = logging.getLogger()
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    with _configure_lock:
+        root.setLevel(level)
+        if _listener is not None:
+            return root
+
+        if os.environ.get("LOG_FORMAT", "json").lower() == "text":
+            formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        else:
+            formatter = JsonFormatter()
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=int(os.environ.get("LOG_QUEUE_SIZE", "10000")))
+        _queue_handler = DroppingQueueHandler(log_queue)
+        _queue_handler.addFilter(SamplingFilter(float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))))
+        root.handlers = [_queue_handler]
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+    return root
+
+def shutdown_logging():
+    """Flushes queued records and stops the writer thread (call before a CLI exits)."""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+def dropped_records():
+    """Number of records dropped because the log queue was full."""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
@@ -0,0 +1,108 @@
+# benchmarks/bench_chat.py
+#
+# /chat throughput and latency under concurrent load, fully offline:
+#   - OpenAI is replaced by the deterministic fake in benchmarks/fake_openai.py
+#     (one tool call, then an answer), with a configurable per-call latency
+#   - requests go straight into the ASGI app through httpx's ASGITransport
+#   - the tools read a SQLite/FTS5 search replica of a synthetic corpus
+#     (--tools replica, default) or a seeded MySQL database (--tools mysql)
+#
+# Run from the repository root:
+#   python -m benchmarks.bench_chat --requests 500 --concurrency 50 --llm-latency-ms 300
+#   python -m benchmarks.bench_chat --tools mysql --database fedreg_bench --skip-seed
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import AGENCIES, RARE_WORDS, build_sqlite_replica, summarize
+
+def questions(count, distinct, seed=11):
+    """``count`` questions drawn from ``distinct`` templates, so repeats exercise the caches."""
+    rng = random.Random(seed)
+    pool = [f"What {rng.choice(RARE_WORDS)} rules did the {rng.choice(AGENCIES)} publish?" for _ in range(distinct)]
+    return [rng.choice(pool) for _ in range(count)]
+
+async def run_load(app, prompts, concurrency):
+    """Sends every prompt to /chat with ``concurrency`` requests in flight; returns (latencies ms, stage totals, errors, seconds)."""
+    import httpx
+    latencies, stage_totals, errors = [], {}, 0
+    next_prompt = iter(prompts)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120) as client:
+        async def worker():
+            nonlocal errors
+            for prompt in next_prompt: # Shared iterator: each prompt is sent once
+                started = time.perf_counter()
+                response = await client.post("/chat", data={"query": prompt})
+                latencies.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+                for stage, ms in response.json().get("timings_ms", {}).items():
+                    stage_totals[stage] = stage_totals.get(stage, 0.0) + ms
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, stage_totals, errors, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline /chat load test with a fake OpenAI client.")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--distinct", type=int, default=100, help="Distinct questions in the request mix.")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="Simulated latency of each OpenAI call.")
+    parser.add_argument("--rows", type=int, default=20_000, help="Synthetic corpus size.")
+    parser.add_argument("--tools", choices=("replica", "mysql"), default="replica")
+    parser.add_argument("--database", help="Scratch MySQL database for --tools mysql (overrides DB_NAME).")
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse an already seeded MySQL corpus.")
+    parser.add_argument("--response-cache", action="store_true", help="Keep the response cache on (off by default).")
+    args = parser.parse_args()
+    if args.tools == "mysql" and not args.database:
+        parser.error("--database is required for --tools mysql")
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    with tempfile.TemporaryDirectory(prefix="rag_bench_") as workdir:
+        # Settings read at import time of the app modules
+        os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark") # Never used: the client is replaced below
+        os.environ["LOG_LEVEL"] = os.environ.get("LOG_LEVEL", "WARNING")
+        os.environ["RESPONSE_CACHE_BACKEND"] = "memory" if args.response_cache else "off"
+        os.environ["SESSION_STORE"] = "memory"
+        os.environ["DATA_GENERATION_FILE"] = os.path.join(workdir, "data_generation")
+        os.environ["SEARCH_BACKEND"] = args.tools
+        os.environ["SEARCH_REPLICA_PATH"] = os.path.join(workdir, "search_replica.sqlite3")
+        if args.database:
+            os.environ["DB_NAME"] = args.database
+
+        import agent
+        import main as app_module
+        from benchmarks.fake_openai import install
+        install(agent, args.llm_latency_ms / 1000)
+
+        if args.tools == "replica":
+            build_sqlite_replica(os.environ["SEARCH_REPLICA_PATH"], args.rows)
+        elif not args.skip_seed:
+            from benchmarks.common import seed_mysql
+            from data_pipeline import ensure_schema
+            from db_pool import pooled_connection
+            with pooled_connection() as conn:
+                ensure_schema(conn)
+                seed_mysql(conn, args.rows)
+
+        prompts = questions(args.requests, args.distinct)
+        latencies, stage_totals, errors, seconds = asyncio.run(run_load(app_module.app, prompts, args.concurrency))
+
+    print(f"{len(latencies)} requests, concurrency {args.concurrency}, LLM latency {args.llm_latency_ms:.0f} ms, "
+          f"tools={args.tools}: {len(latencies) / seconds:.1f} req/s, {errors} errors")
+    summarize("/chat", latencies)
+    ok = max(1, len(latencies) - errors)
+    print("Mean server-side time per stage: " + ", ".join(
+        f"{stage}={total / ok:.1f} ms" for stage, total in sorted(stage_totals.items(), key=lambda item: -item[1])))
+
+if __name__ == "__main__":
+    main()
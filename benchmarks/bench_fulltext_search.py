@@ -0,0 +1,61 @@
+# benchmarks/bench_fulltext_search.py
+#
+# Compares the legacy LIKE '%query%' scan with the FULLTEXT index path of
+# agent_tools.search_federal_documents on a synthetic corpus.
+#
+# Run from the repository root against a SCRATCH database (rows are written
+# into its federal_documents table):
+#   python -m benchmarks.bench_fulltext_search --database fedreg_bench --rows 100000
+
+import argparse
+import os
+import time
+
+from benchmarks.common import AGENCIES, RARE_WORDS, seed_mysql as seed_corpus, summarize
+
+def time_searches(search_fn, queries, repeats, **kwargs):
+    """Runs every query ``repeats`` times and returns latencies in milliseconds."""
+    latencies = []
+    for _ in range(repeats):
+        for q in queries:
+            started = time.perf_counter()
+            search_fn(**q, **kwargs)
+            latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LIKE vs FULLTEXT search paths.")
+    parser.add_argument("--database", required=True, help="Scratch MySQL database to seed (overrides DB_NAME).")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse an already seeded corpus.")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    os.environ["DB_NAME"] = args.database # Must be set before the pool is created
+    os.environ["SEARCH_CACHE_MAX_ENTRIES"] = "0" # Measure the database, not the result cache
+
+    from db_pool import pooled_connection
+    from data_pipeline import ensure_schema
+    from agent_tools import search_federal_documents
+
+    with pooled_connection() as conn:
+        ensure_schema(conn)
+        if not args.skip_seed:
+            print(f"Seeding {args.rows} synthetic documents into {args.database}.federal_documents ...")
+            started = time.perf_counter()
+            seed_corpus(conn, args.rows)
+            print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+    keyword_queries = [{"query": word, "limit": 10} for word in RARE_WORDS]
+    agency_queries = [{"agency": name, "limit": 10} for name in AGENCIES]
+
+    print()
+    summarize("keyword / LIKE", time_searches(search_federal_documents, keyword_queries, args.repeats, search_mode="like"))
+    summarize("keyword / FULLTEXT", time_searches(search_federal_documents, keyword_queries, args.repeats, search_mode="fulltext"))
+    summarize("agency / LIKE '%x%'", time_searches(search_federal_documents, agency_queries, args.repeats, search_mode="like"))
+    summarize("agency / indexed prefix", time_searches(search_federal_documents, agency_queries, args.repeats, search_mode="fulltext"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# benchmarks/bench_ingest.py
+#
+# Ingest throughput of the data pipeline against a local, in-process stand-in
+# for the Federal Register API that serves a synthetic corpus (no network).
+#   --target index  fetch -> process -> vector index only; needs no database
+#   --target mysql  the full streaming pipeline (run_streaming_pipeline) into a
+#                   SCRATCH MySQL database, run twice: a cold load, then an
+#                   incremental re-run where every document is unchanged
+#
+# Run from the repository root:
+#   python -m benchmarks.bench_ingest --target index --rows 20000
+#   python -m benchmarks.bench_ingest --target mysql --database fedreg_bench --rows 20000
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.common import CORPUS_DAYS, CORPUS_START, synthetic_api_documents
+
+class FakeFederalRegisterAPI:
+    """
+    Serves documents.json with the API's paging and date conditions from a
+    list of synthetic API documents, on 127.0.0.1 and a free port.
+
+    ``fault``, if given, is called with each request's query parameters and
+    may inject a failure: return "drop" to close the connection without a
+    response, or (status, headers) to answer with that error status.
+    """
+
+    def __init__(self, documents, latency_seconds=0.0, fault=None):
+        self.by_date = {}
+        for doc in documents:
+            self.by_date.setdefault(doc["publication_date"], []).append(doc)
+        self.latency_seconds = latency_seconds
+        self.fault = fault
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                fault = api.fault(params) if api.fault else None
+                if fault == "drop":
+                    self.close_connection = True
+                    return
+                if fault:
+                    status, headers = fault
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = json.dumps(api.page(params)).encode("utf-8")
+                if api.latency_seconds:
+                    time.sleep(api.latency_seconds)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass # Keep benchmark output readable
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/v1/documents.json"
+
+    def page(self, params):
+        start = params.get("conditions[publication_date][gte]", "0000-00-00")
+        end = params.get("conditions[publication_date][lte]", "9999-99-99")
+        per_page = int(params.get("per_page", 20))
+        page = int(params.get("page", 1))
+        matching = [doc for day in sorted(self.by_date) if start <= day <= end for doc in self.by_date[day]]
+        total_pages = max(1, -(-len(matching) // per_page))
+        return {"count": len(matching), "total_pages": total_pages,
+                "results": matching[(page - 1) * per_page:page * per_page]}
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        return False
+
+CORPUS_END = (CORPUS_START + timedelta(days=CORPUS_DAYS - 1)).isoformat()
+
+def bench_index(args, api):
+    from data_pipeline import iter_federal_register_pages, iter_processed_documents, stream_in_background
+    from vector_index import VectorIndex
+    index = VectorIndex(os.environ["VECTOR_INDEX_DIR"])
+    started = time.perf_counter()
+    pages = stream_in_background(iter_federal_register_pages(CORPUS_START.isoformat(), CORPUS_END, max_workers=args.workers,
+                                                            per_page=args.per_page, base_url=api.url), 4)
+    batch, rows = [], 0
+    for doc in iter_processed_documents(pages):
+        batch.append(doc)
+        if len(batch) >= 1000:
+            rows += index.upsert(batch)
+            batch = []
+    rows += index.upsert(batch)
+    index.save()
+    seconds = time.perf_counter() - started
+    print(f"fetch + process + index: {rows} documents in {seconds:.2f}s ({rows / seconds:,.0f} docs/sec)")
+
+def bench_mysql(args, api):
+    os.environ["DB_NAME"] = args.database # Must be set before the pool is created
+    from db_pool import pooled_connection
+    from data_pipeline import ensure_schema, run_streaming_pipeline
+    with pooled_connection() as conn:
+        ensure_schema(conn)
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM document_agencies")
+        cursor.execute("DELETE FROM federal_documents")
+        cursor.execute("DELETE FROM stats_month_type")
+        cursor.execute("DELETE FROM stats_agency_month_type")
+        conn.commit()
+        cursor.close()
+    for label in ("cold load", "unchanged re-run"):
+        stats = run_streaming_pipeline(start_date=CORPUS_START.isoformat(), end_date=CORPUS_END, batch_size=args.batch_size,
+                                       full_text=False, max_workers=args.workers, per_page=args.per_page, base_url=api.url)
+        print(f"{label:<18} {stats['rows']} rows in {stats['seconds']}s ({stats['rows_per_sec']} rows/sec): "
+              f"{stats['written']} written, {stats['unchanged']} unchanged, {stats['failed_batches']} failed batches")
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline ingest throughput against a local fake Federal Register API.")
+    parser.add_argument("--target", choices=("index", "mysql"), default="index")
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent page fetches.")
+    parser.add_argument("--per-page", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows per upsert batch (mysql target).")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="Simulated API response time per page.")
+    parser.add_argument("--database", help="Scratch MySQL database for the mysql target (overrides DB_NAME).")
+    args = parser.parse_args()
+    if args.target == "mysql" and not args.database:
+        parser.error("--database is required for the mysql target")
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    with tempfile.TemporaryDirectory(prefix="rag_bench_") as workdir:
+        # Keep every artefact the pipeline writes out of the working tree
+        os.environ["VECTOR_INDEX_DIR"] = os.path.join(workdir, "vector_index")
+        os.environ["FULL_TEXT_CACHE_DIR"] = os.path.join(workdir, "fulltext_cache")
+        os.environ["DATA_GENERATION_FILE"] = os.path.join(workdir, "data_generation")
+
+        documents = list(synthetic_api_documents(args.rows))
+        with FakeFederalRegisterAPI(documents, args.api_latency_ms / 1000) as api:
+            if args.target == "index":
+                bench_index(args, api)
+            else:
+                bench_mysql(args, api)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# benchmarks/bench_search.py
+#
+# Search latency percentiles on a synthetic corpus, for one or more backends:
+#   mysql   - agent_tools.search_federal_documents against a SCRATCH MySQL
+#             database (rows are written into its federal_documents table),
+#             with the result cache off and then on
+#   replica - the same tool with SEARCH_BACKEND=replica, over a SQLite/FTS5
+#             search replica of the corpus (see replica.py)
+#   vector  - VectorIndex cosine search over the corpus (hashing embedder)
+#
+# Run from the repository root; replica and vector need no server or network:
+#   python -m benchmarks.bench_search --backends replica,vector --rows 50000
+#   python -m benchmarks.bench_search --backends mysql --database fedreg_bench
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import AGENCIES, RARE_WORDS, CORPUS_START, build_sqlite_replica, seed_mysql, synthetic_documents, summarize
+
+def query_mix(count, seed=7):
+    """A deterministic mix of keyword, keyword + agency, date-range and agency-only searches."""
+    rng = random.Random(seed)
+    queries = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            queries.append({"query": rng.choice(RARE_WORDS)})
+        elif kind == 1:
+            queries.append({"query": f"{rng.choice(RARE_WORDS)} {rng.choice(RARE_WORDS)}", "agency": rng.choice(AGENCIES)})
+        elif kind == 2:
+            month = rng.randrange(1, 12)
+            queries.append({"query": rng.choice(RARE_WORDS), "start_date": CORPUS_START.replace(month=month).isoformat(),
+                            "end_date": CORPUS_START.replace(month=month + 1).isoformat()})
+        else:
+            queries.append({"agency": rng.choice(AGENCIES)})
+    return queries
+
+def time_calls(fn, queries, repeats):
+    """Runs every query ``repeats`` times and returns latencies in milliseconds."""
+    latencies = []
+    for _ in range(repeats):
+        for q in queries:
+            started = time.perf_counter()
+            fn(**q)
+            latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+def bench_mysql(args, queries):
+    os.environ["DB_NAME"] = args.database # Must be set before the pool is created
+    from db_pool import pooled_connection
+    from data_pipeline import ensure_schema
+    import agent_tools
+
+    with pooled_connection() as conn:
+        ensure_schema(conn)
+        if not args.skip_seed:
+            print(f"Seeding {args.rows} documents into {args.database}.federal_documents ...")
+            seed_mysql(conn, args.rows)
+
+    cache = agent_tools.search_cache
+    agent_tools.search_cache = None
+    summarize("mysql / no cache", time_calls(agent_tools.search_federal_documents, queries, args.repeats))
+    if cache is not None:
+        cache.clear()
+        agent_tools.search_cache = cache
+        summarize("mysql / result cache", time_calls(agent_tools.search_federal_documents, queries, args.repeats))
+
+def bench_replica(args, queries, workdir):
+    import agent_tools
+    os.environ["SEARCH_REPLICA_PATH"] = os.path.join(workdir, "search_replica.sqlite3")
+    started = time.perf_counter()
+    build_sqlite_replica(os.environ["SEARCH_REPLICA_PATH"], args.rows)
+    print(f"Built search replica in {time.perf_counter() - started:.1f}s")
+
+    backend, cache = agent_tools.SEARCH_BACKEND, agent_tools.search_cache
+    agent_tools.SEARCH_BACKEND, agent_tools.search_cache = "replica", None
+    try:
+        summarize("replica (sqlite fts5)", time_calls(agent_tools.search_federal_documents, queries, args.repeats))
+    finally:
+        agent_tools.SEARCH_BACKEND, agent_tools.search_cache = backend, cache
+
+def bench_vector(args, queries, workdir):
+    from vector_index import VectorIndex
+    index = VectorIndex(os.path.join(workdir, "vector_index"))
+    started = time.perf_counter()
+    batch = []
+    for doc in synthetic_documents(args.rows):
+        batch.append(doc)
+        if len(batch) >= 2000:
+            index.upsert(batch)
+            batch = []
+    index.upsert(batch)
+    index.save()
+    print(f"Built vector index of {index.count} documents in {time.perf_counter() - started:.1f}s")
+
+    def search(query=None, agency=None, start_date=None, end_date=None):
+        return index.search([query or agency], top_k=10, agency=agency, start_date=start_date, end_date=end_date)
+    summarize("vector (hashing)", time_calls(search, queries, args.repeats))
+
+def main():
+    parser = argparse.ArgumentParser(description="Search latency percentiles on a synthetic corpus.")
+    parser.add_argument("--backends", default="replica,vector", help="Comma-separated: mysql, replica, vector.")
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=200, help="Distinct queries in the mix.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--database", help="Scratch MySQL database for the mysql backend (overrides DB_NAME).")
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse an already seeded MySQL corpus.")
+    args = parser.parse_args()
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    if "mysql" in backends and not args.database:
+        parser.error("--database is required for the mysql backend")
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    queries = query_mix(args.queries)
+
+    with tempfile.TemporaryDirectory(prefix="rag_bench_") as workdir:
+        for backend in backends:
+            if backend == "mysql":
+                bench_mysql(args, queries)
+            elif backend == "replica":
+                bench_replica(args, queries, workdir)
+            elif backend == "vector":
+                bench_vector(args, queries, workdir)
+            else:
+                parser.error(f"unknown backend {backend}")
+
+if __name__ == "__main__":
+    main()
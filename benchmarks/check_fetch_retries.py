@@ -0,0 +1,115 @@
+# benchmarks/check_fetch_retries.py
+#
+# Checks the fetcher's failure handling (data_pipeline.iter_federal_register_pages
+# and _get_with_retries) against the local fake Federal Register API from
+# bench_ingest, with faults injected per request:
+#   transient   every page first answers 429 (one with Retry-After: 1), then
+#               503, then drops the connection, then succeeds: nothing is lost
+#   persistent  one window's first page always answers 503: the page is
+#               retried, then counted in failed_pages, and the other windows
+#               still arrive
+#   not found   one page answers 404: not retried, counted in failed_pages
+#
+# Run from the repository root (no network or database needed):
+#   python -m benchmarks.check_fetch_retries
+
+import argparse
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from benchmarks.bench_ingest import CORPUS_END, FakeFederalRegisterAPI
+from benchmarks.common import CORPUS_START, synthetic_api_documents
+
+RETRY_KWARGS = {"max_retries": 4, "backoff_base": 0.01}
+FIRST_WINDOW_END = (CORPUS_START + timedelta(days=29)).isoformat() # FETCH_WINDOW_DAYS=30
+
+class FaultPlan:
+    """Records every request per (window start, page) and decides which fault, if any, to inject."""
+
+    def __init__(self, decide):
+        self.decide = decide
+        self.lock = threading.Lock()
+        self.requests = defaultdict(list) # (window start, page) -> request times
+
+    def __call__(self, params):
+        key = (params["conditions[publication_date][gte]"], int(params.get("page", 1)))
+        with self.lock:
+            self.requests[key].append(time.monotonic())
+            attempt = len(self.requests[key])
+        return self.decide(key, attempt)
+
+def fetch(documents, plan, per_page):
+    from data_pipeline import iter_federal_register_pages
+    stats = {}
+    fetched = set()
+    with FakeFederalRegisterAPI(documents, fault=plan) as api:
+        for page in iter_federal_register_pages(CORPUS_START.isoformat(), CORPUS_END, max_workers=4, per_page=per_page,
+                                                base_url=api.url, stats=stats, retry_kwargs=RETRY_KWARGS):
+            fetched.update(doc["document_number"] for doc in page)
+    return fetched, stats.get("failed_pages", 0)
+
+def transient(key, attempt):
+    if attempt == 1:
+        retry_after = "1" if key == (CORPUS_START.isoformat(), 1) else "0"
+        return 429, {"Retry-After": retry_after}
+    if attempt == 2:
+        return 503, {}
+    if attempt == 3:
+        return "drop"
+    return None
+
+def persistent(key, attempt):
+    return (503, {}) if key == (CORPUS_START.isoformat(), 1) else None
+
+def not_found(key, attempt):
+    return (404, {}) if key == (CORPUS_START.isoformat(), 2) else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Fault-injection checks for the Federal Register fetcher.")
+    parser.add_argument("--rows", type=int, default=3000)
+    parser.add_argument("--per-page", type=int, default=100, help="Small pages so every window has several.")
+    args = parser.parse_args()
+
+    documents = list(synthetic_api_documents(args.rows))
+    everything = {doc["document_number"] for doc in documents}
+    first_window = {doc["document_number"] for doc in documents if doc["publication_date"] <= FIRST_WINDOW_END}
+    failures = []
+
+    def check(name, condition, detail):
+        print(f"{'ok  ' if condition else 'FAIL'} {name}: {detail}")
+        if not condition:
+            failures.append(name)
+
+    plan = FaultPlan(transient)
+    fetched, failed_pages = fetch(documents, plan, args.per_page)
+    check("transient: all documents", fetched == everything, f"{len(fetched)}/{len(everything)} fetched")
+    check("transient: no failed pages", failed_pages == 0, f"failed_pages={failed_pages}")
+    attempts = {len(times) for times in plan.requests.values()}
+    check("transient: 4 requests per page", attempts == {4}, f"requests per page {sorted(attempts)}")
+    times = plan.requests[(CORPUS_START.isoformat(), 1)]
+    check("transient: Retry-After honoured", times[1] - times[0] >= 1.0, f"waited {times[1] - times[0]:.2f}s after 429")
+
+    plan = FaultPlan(persistent)
+    fetched, failed_pages = fetch(documents, plan, args.per_page)
+    check("persistent: page counted as failed", failed_pages == 1, f"failed_pages={failed_pages}")
+    check("persistent: retried", len(plan.requests[(CORPUS_START.isoformat(), 1)]) == RETRY_KWARGS["max_retries"] + 1,
+          f"{len(plan.requests[(CORPUS_START.isoformat(), 1)])} requests")
+    check("persistent: other windows fetched", fetched == everything - first_window,
+          f"{len(fetched)} fetched, {len(first_window)} in the lost window")
+
+    plan = FaultPlan(not_found)
+    fetched, failed_pages = fetch(documents, plan, args.per_page)
+    check("not found: page counted as failed", failed_pages == 1, f"failed_pages={failed_pages}")
+    check("not found: not retried", len(plan.requests[(CORPUS_START.isoformat(), 2)]) == 1,
+          f"{len(plan.requests[(CORPUS_START.isoformat(), 2)])} requests")
+    check("not found: only that page missing", len(everything - fetched) == args.per_page,
+          f"{len(everything - fetched)} documents missing")
+
+    if failures:
+        raise SystemExit(f"{len(failures)} check(s) failed")
+    print("All fetch retry checks passed.")
+
+if __name__ == "__main__":
+    main()
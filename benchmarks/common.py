@@ -0,0 +1,107 @@
+# benchmarks/common.py
+#
+# Shared pieces of the benchmark suite: a deterministic synthetic corpus,
+# loaders for MySQL and the SQLite search replica, and latency summaries.
+# Nothing here touches the network.
+
+import random
+import statistics
+from datetime import date, timedelta
+
+# Words used to build synthetic titles/abstracts. A few rare terms are mixed in
+# so queries have realistic selectivity.
+COMMON_WORDS = (
+    "rule notice proposed final federal register agency public comment period "
+    "regulation program standard requirement review action amendment policy "
+    "safety environmental health energy transportation financial reporting"
+).split()
+RARE_WORDS = ["emissions", "pipeline", "pesticide", "broadband", "fisheries", "aviation", "medicare", "tariff"]
+AGENCIES = [
+    "Environmental Protection Agency", "Department of Energy", "Federal Aviation Administration",
+    "Food and Drug Administration", "Department of Agriculture", "Securities and Exchange Commission",
+    "Federal Communications Commission", "National Oceanic and Atmospheric Administration",
+]
+DOCUMENT_TYPES = ["Rule", "Proposed Rule", "Notice", "Presidential Document"]
+CORPUS_START = date(2025, 1, 1)
+CORPUS_DAYS = 365
+
+def _synthetic_text(rng, words):
+    text = [rng.choice(COMMON_WORDS) for _ in range(words)]
+    text[rng.randrange(words)] = rng.choice(RARE_WORDS)
+    return " ".join(text)
+
+def synthetic_api_documents(rows, seed=42, prefix="BENCH"):
+    """
+    Yields ``rows`` documents shaped like Federal Register API results, so
+    they go through data_pipeline.process_document_data like real ones.
+    The same seed always yields the same corpus.
+    """
+    rng = random.Random(seed)
+    for i in range(rows):
+        number = f"{prefix}-{i:07d}"
+        yield {
+            "document_number": number,
+            "title": _synthetic_text(rng, 10),
+            "agencies": [{"name": rng.choice(AGENCIES)}],
+            "type": rng.choice(DOCUMENT_TYPES),
+            "publication_date": (CORPUS_START + timedelta(days=rng.randrange(CORPUS_DAYS))).isoformat(),
+            "html_url": f"https://example.invalid/{number}",
+            "abstract": _synthetic_text(rng, 120),
+            "full_text_xml_url": None,
+        }
+
+def synthetic_documents(rows, seed=42, prefix="BENCH"):
+    """Yields ``rows`` processed documents (federal_documents row dicts)."""
+    from data_pipeline import process_document_data
+    for doc in synthetic_api_documents(rows, seed, prefix):
+        yield process_document_data(doc)
+
+def seed_mysql(conn, rows, batch_size=2000, seed=42):
+    """
+    Replaces the contents of federal_documents (and its agency links) with
+    ``rows`` synthetic documents, then rebuilds the stats tables.
+    """
+    from data_pipeline import UPSERT_DOCUMENT_SQL, _document_values, _write_agency_links, rebuild_document_stats
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM document_agencies")
+    cursor.execute("DELETE FROM federal_documents")
+
+    def write(batch):
+        cursor.executemany(UPSERT_DOCUMENT_SQL, [_document_values(doc) for doc in batch])
+        _write_agency_links(cursor, batch)
+        conn.commit()
+
+    batch = []
+    for doc in synthetic_documents(rows, seed):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            write(batch)
+            batch = []
+    if batch:
+        write(batch)
+    cursor.close()
+    rebuild_document_stats(conn)
+
+def build_sqlite_replica(path, rows, seed=42):
+    """
+    Publishes ``rows`` synthetic documents as a search replica (see
+    replica.py) at ``path``, for benchmarks that must run without a MySQL
+    server. Returns the replica's row counts.
+    """
+    from replica import ReplicaWriter
+    writer = ReplicaWriter(path)
+    writer.add_documents(synthetic_documents(rows, seed))
+    return writer.publish()
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def summarize(label, latencies):
+    """Prints n, p50/p95/p99 and mean of a list of millisecond latencies."""
+    latencies = sorted(latencies)
+    print(f"{label:<32} n={len(latencies):<6} p50={statistics.median(latencies):8.2f} ms  "
+          f"p95={percentile(latencies, 0.95):8.2f} ms  p99={percentile(latencies, 0.99):8.2f} ms  "
+          f"mean={statistics.fmean(latencies):8.2f} ms")
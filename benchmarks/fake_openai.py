@@ -0,0 +1,141 @@
+# benchmarks/fake_openai.py
+#
+# Deterministic stand-in for the OpenAI chat completions API, so the agent
+# loop can be benchmarked offline. It behaves like a well-behaved model:
+# the first call of a question requests one search_federal_documents tool
+# call built from the question's keywords; once tool results are in the
+# history it answers with a short summary of them. Token usage is estimated
+# from message sizes, so budgets and token metrics behave realistically.
+# An optional fixed latency models the network/inference time of a real call.
+
+import asyncio
+import json
+import time
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+STOP_WORDS = {"the", "a", "an", "of", "for", "in", "on", "to", "and", "or", "what", "which", "are", "is", "me", "show", "find", "about"}
+
+def _field(message, name):
+    return message.get(name) if isinstance(message, dict) else getattr(message, name, None)
+
+def _keywords(text, count=3):
+    words = [word.strip("?.,!").lower() for word in (text or "").split()]
+    words = [word for word in words if word and word not in STOP_WORDS]
+    return " ".join(sorted(words, key=len, reverse=True)[:count])
+
+def _estimate_tokens(messages):
+    return sum(len(str(_field(message, "content") or "")) for message in messages) // 4 + 8 * len(messages)
+
+def _plan(messages, tools):
+    """Returns ("tool", arguments) or ("answer", text) for the given history."""
+    last_user = max(i for i, message in enumerate(messages) if _field(message, "role") == "user")
+    tool_results = [message for message in messages[last_user:] if _field(message, "role") == "tool"]
+    if tools and not tool_results:
+        return "tool", {"query": _keywords(_field(messages[last_user], "content")), "limit": 5}
+    titles = []
+    for message in tool_results:
+        try:
+            payload = json.loads(message["content"])
+        except (TypeError, ValueError):
+            continue
+        if isinstance(payload, dict):
+            payload = payload.get("results", [])
+        titles.extend(str(doc.get("title", ""))[:60] for doc in payload if isinstance(doc, dict))
+    if not titles:
+        return "answer", "I could not find any matching federal documents."
+    return "answer", f"I found {len(titles)} relevant documents, including: " + "; ".join(titles[:3]) + "."
+
+def _completion(kind, value, messages, call_number):
+    prompt_tokens = _estimate_tokens(messages)
+    if kind == "tool":
+        message = {"role": "assistant", "content": None, "tool_calls": [{
+            "id": f"call_{call_number}", "type": "function",
+            "function": {"name": "search_federal_documents", "arguments": json.dumps(value)},
+        }]}
+        finish_reason, completion_tokens = "tool_calls", 20
+    else:
+        message = {"role": "assistant", "content": value}
+        finish_reason, completion_tokens = "stop", len(value) // 4 + 1
+    return ChatCompletion.model_validate({
+        "id": f"fake-{call_number}", "object": "chat.completion", "created": int(time.time()), "model": "fake",
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    })
+
+def _chunks(completion):
+    """Splits a completion into streaming chunks: tool calls in two fragments, text word by word, then usage."""
+    base = {"id": completion.id, "object": "chat.completion.chunk", "created": completion.created, "model": "fake"}
+    message = completion.choices[0].message
+    if message.tool_calls:
+        call = message.tool_calls[0]
+        arguments = call.function.arguments
+        middle = len(arguments) // 2
+        yield ChatCompletionChunk.model_validate(dict(base, choices=[{"index": 0, "delta": {"tool_calls": [
+            {"index": 0, "id": call.id, "type": "function", "function": {"name": call.function.name, "arguments": arguments[:middle]}}]}}]))
+        yield ChatCompletionChunk.model_validate(dict(base, choices=[{"index": 0, "delta": {"tool_calls": [
+            {"index": 0, "function": {"arguments": arguments[middle:]}}]}}]))
+    else:
+        for word in message.content.split(" "):
+            yield ChatCompletionChunk.model_validate(dict(base, choices=[{"index": 0, "delta": {"content": word + " "}}]))
+    yield ChatCompletionChunk.model_validate(dict(base, choices=[], usage=completion.usage.model_dump()))
+
+
+class _Completions:
+    def __init__(self, latency_seconds):
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+
+    def _respond(self, messages, tools):
+        self.calls += 1
+        kind, value = _plan(messages, tools)
+        return _completion(kind, value, messages, self.calls)
+
+
+class FakeCompletions(_Completions):
+    def create(self, model=None, messages=(), tools=None, stream=False, **kwargs):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        completion = self._respond(list(messages), tools)
+        return _chunks(completion) if stream else completion
+
+
+class AsyncFakeCompletions(_Completions):
+    async def create(self, model=None, messages=(), tools=None, stream=False, **kwargs):
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        completion = self._respond(list(messages), tools)
+        if not stream:
+            return completion
+
+        async def stream_chunks():
+            for chunk in _chunks(completion):
+                yield chunk
+        return stream_chunks()
+
+
+class _Chat:
+    def __init__(self, completions):
+        self.completions = completions
+
+
+class FakeOpenAI:
+    """Drop-in for openai.OpenAI as far as agent.py uses it."""
+
+    def __init__(self, latency_seconds=0.0):
+        self.chat = _Chat(FakeCompletions(latency_seconds))
+
+
+class AsyncFakeOpenAI:
+    """Drop-in for openai.AsyncOpenAI as far as agent.py uses it."""
+
+    def __init__(self, latency_seconds=0.0):
+        self.chat = _Chat(AsyncFakeCompletions(latency_seconds))
+
+
+def install(agent_module, latency_seconds=0.0):
+    """Replaces agent.client and agent.async_client with fakes; returns (sync, async) fakes."""
+    agent_module.client = FakeOpenAI(latency_seconds)
+    agent_module.async_client = AsyncFakeOpenAI(latency_seconds)
+    return agent_module.client, agent_module.async_client
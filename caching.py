@@ -0,0 +1,421 @@
+# caching.py
+
+import copy
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+
+# --- Data Generation Counter ---
+# A single integer stored in a small file that data_pipeline.py bumps after
+# every ingest that changed data. Caches tag entries with the generation they
+# were computed under and treat entries from an older generation as misses,
+# so the API processes (separate from the pipeline) drop stale answers without
+# any messaging between them.
+# The path comes from DATA_GENERATION_FILE, read on every use (like the DB
+# settings in db_pool.py) so the pipeline and the API agree on it however
+# their .env was loaded; the default is anchored to this directory, not the
+# working directory.
+DEFAULT_DATA_GENERATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data_generation")
+
+_generation_lock = threading.Lock()
+_generation_cache = {"path": None, "mtime": None, "value": 0}
+
+def get_data_generation_path():
+    return os.environ.get("DATA_GENERATION_FILE") or DEFAULT_DATA_GENERATION_FILE
+
+def current_data_generation():
+    """Returns the current data generation (0 if the pipeline never bumped it)."""
+    path = get_data_generation_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+    with _generation_lock:
+        # Re-read the file only when it changed; a stat is all a lookup costs
+        if (path, mtime) != (_generation_cache["path"], _generation_cache["mtime"]):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    _generation_cache["value"] = int(f.read().strip() or 0)
+                _generation_cache["path"], _generation_cache["mtime"] = path, mtime
+            except (OSError, ValueError):
+                pass
+        return _generation_cache["value"]
+
+def bump_data_generation():
+    """Increments the data generation (atomically replacing the file) and returns the new value."""
+    path = get_data_generation_path()
+    new_value = current_data_generation() + 1
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(new_value))
+    os.replace(tmp_path, path)
+    return new_value
+
+
+# --- Query Normalisation ---
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+
+def normalize_query(text):
+    """Lowercases, strips punctuation and collapses whitespace so trivial rewordings share a key."""
+    return " ".join(_PUNCTUATION_RE.sub(" ", (text or "").lower()).split())
+
+# Questions whose meaning depends on the day they are asked ("rules from last
+# week"); matched against normalised text
+_RELATIVE_DATE_RE = re.compile(
+    r"\b(today|tonight|tomorrow|yesterday|ago|(?:this|last|past|previous|next|current) (?:\d+ )?"
+    r"(?:days?|weeks?|months?|quarters?|years?))\b"
+)
+
+def is_relative_date_query(normalized):
+    return _RELATIVE_DATE_RE.search(normalized) is not None
+
+
+# --- Cache Backends ---
+# Backends store entries as dicts: {"value", "generation", "expires_at", "embedding"}
+# and evict the least recently used entry once max_entries is exceeded.
+
+class InMemoryCacheBackend:
+    """Process-local LRU backend built on an OrderedDict."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key) # Mark as most recently used
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def embeddings(self, generation):
+        """Returns [(key, embedding)] for live entries of ``generation`` that have an embedding."""
+        now = time.time()
+        with self._lock:
+            return [(key, entry["embedding"]) for key, entry in self._entries.items()
+                    if entry["embedding"] is not None and entry["generation"] == generation and entry["expires_at"] > now]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCacheBackend:
+    """
+    SQLite-file backend, shared by every worker process on the host and
+    surviving restarts. Each thread gets its own connection; WAL mode lets
+    readers proceed while another process writes.
+    """
+
+    def __init__(self, path="response_cache.sqlite3", max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, generation INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL, last_access REAL NOT NULL, embedding BLOB)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache_entries (last_access)")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute("SELECT value, generation, expires_at, embedding FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE cache_entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        conn.commit()
+        return {
+            "value": json.loads(row[0]),
+            "generation": row[1],
+            "expires_at": row[2],
+            "embedding": np.frombuffer(row[3], dtype=np.float32) if row[3] is not None else None,
+        }
+
+    def set(self, key, entry):
+        conn = self._connection()
+        embedding = entry["embedding"].astype(np.float32).tobytes() if entry["embedding"] is not None else None
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, generation, expires_at, last_access, embedding) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, json.dumps(entry["value"]), entry["generation"], entry["expires_at"], time.time(), embedding),
+        )
+        # Evict least recently used rows beyond the size bound
+        conn.execute(
+            "DELETE FROM cache_entries WHERE key IN ("
+            " SELECT key FROM cache_entries ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        conn.commit()
+
+    def delete(self, key):
+        conn = self._connection()
+        conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+        conn.commit()
+
+    def embeddings(self, generation):
+        rows = self._connection().execute(
+            "SELECT key, embedding FROM cache_entries WHERE generation = ? AND expires_at > ? AND embedding IS NOT NULL",
+            (generation, time.time()),
+        ).fetchall()
+        return [(key, np.frombuffer(blob, dtype=np.float32)) for key, blob in rows]
+
+    def clear(self):
+        conn = self._connection()
+        conn.execute("DELETE FROM cache_entries")
+        conn.commit()
+
+
+# --- Response Cache ---
+class ResponseCache:
+    """
+    Caches final agent answers keyed on the normalised question.
+
+    Lookups first try the exact normalised key; if ``similarity_threshold`` is
+    set, a miss then falls back to the most similar cached question (cosine
+    similarity of embeddings) of the current data generation. Entries expire
+    after ``ttl_seconds`` and when the data generation changes. Questions with
+    a relative date ("last week") are keyed on the day as well, so they are
+    answered again once that day is over.
+    """
+
+    def __init__(self, backend, ttl_seconds=3600, similarity_threshold=None, embedder=None):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.embedder = embedder
+        if similarity_threshold and embedder is None:
+            from vector_index import get_embedder
+            self.embedder = get_embedder()
+        self._lock = threading.Lock()
+        self._metrics = {"lookups": 0, "exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "latency_saved_seconds": 0.0}
+
+    @staticmethod
+    def _key(normalized, today=None):
+        if is_relative_date_query(normalized):
+            # "|" never survives normalize_query, so it cannot clash with a question
+            return f"{normalized}|{(today or date.today()).isoformat()}"
+        return normalized
+
+    @staticmethod
+    def _current_key(key, today):
+        """False for a day-keyed entry from another day (see _key)."""
+        _, separator, day = key.partition("|")
+        return not separator or day == today.isoformat()
+
+    def lookup(self, query):
+        """
+        Returns (value, match_type) where match_type is "exact" or "semantic",
+        or (None, None) on a miss.
+        """
+        normalized = normalize_query(query)
+        generation = current_data_generation()
+        today = date.today()
+        with self._lock:
+            self._metrics["lookups"] += 1
+
+        entry = self._live_entry(self._key(normalized, today), generation)
+        match_type = "exact" if entry is not None else None
+
+        if entry is None and self.similarity_threshold:
+            candidates = [(key, vector) for key, vector in self.backend.embeddings(generation) if self._current_key(key, today)]
+            if candidates:
+                query_vector = self.embedder.embed([normalized])[0]
+                keys, vectors = zip(*candidates)
+                scores = np.vstack(vectors) @ query_vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    entry = self._live_entry(keys[best], generation)
+                    match_type = "semantic" if entry is not None else None
+
+        with self._lock:
+            if entry is None:
+                self._metrics["misses"] += 1
+                return None, None
+            self._metrics[f"{match_type}_hits"] += 1
+            self._metrics["latency_saved_seconds"] += entry["value"].get("latency_seconds", 0.0)
+        return entry["value"], match_type
+
+    def _live_entry(self, key, generation):
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        if entry["generation"] != generation or entry["expires_at"] <= time.time():
+            self.backend.delete(key) # Stale: data was re-ingested or TTL passed
+            return None
+        return entry
+
+    def store(self, query, response, latency_seconds):
+        """Caches ``response`` for ``query``; ``latency_seconds`` is what a future hit saves."""
+        normalized = normalize_query(query)
+        if not normalized:
+            return
+        embedding = self.embedder.embed([normalized])[0] if self.similarity_threshold else None
+        self.backend.set(self._key(normalized), {
+            "value": {"response": response, "latency_seconds": latency_seconds},
+            "generation": current_data_generation(),
+            "expires_at": time.time() + self.ttl_seconds,
+            "embedding": embedding,
+        })
+        with self._lock:
+            self._metrics["stores"] += 1
+
+    def stats(self):
+        """Returns counters plus hit rate and total latency saved by hits."""
+        with self._lock:
+            snapshot = dict(self._metrics)
+        hits = snapshot["exact_hits"] + snapshot["semantic_hits"]
+        snapshot["hit_rate"] = round(hits / snapshot["lookups"], 4) if snapshot["lookups"] else 0.0
+        snapshot["latency_saved_seconds"] = round(snapshot["latency_saved_seconds"], 3)
+        return snapshot
+
+
+# --- Tool Result Cache ---
+class _Flight:
+    """One in-progress computation that concurrent callers of the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    """
+    In-process LRU + TTL cache for tool results, with single-flight
+    de-duplication: when several threads ask for the same missing key at once,
+    one computes it and the others wait for its result instead of repeating
+    the work. A waiter that has not seen the result after ``wait_timeout``
+    seconds computes it itself rather than hang on a stuck call. Entries are
+    tagged with the data generation, so an ingest invalidates them. Callers
+    always receive their own deep copy, so mutating a result never changes
+    what is cached.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=300, wait_timeout=None):
+        self.backend = InMemoryCacheBackend(max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.wait_timeout = wait_timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._metrics = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0, "wait_timeouts": 0}
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached value for ``key`` or calls ``compute()`` once to
+        produce it. Exceptions raised by ``compute`` are not cached; they are
+        re-raised in the computing thread and in every thread that waited on it.
+        """
+        generation = current_data_generation()
+        entry = self.backend.get(key)
+        if entry is not None and entry["generation"] == generation and entry["expires_at"] > time.time():
+            with self._lock:
+                self._metrics["hits"] += 1
+            return copy.deepcopy(entry["value"])
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._metrics["misses"] += 1
+            else:
+                self._metrics["coalesced"] += 1
+
+        if not leader:
+            if flight.done.wait(self.wait_timeout):
+                if flight.error is not None:
+                    raise flight.error
+                return copy.deepcopy(flight.value)
+            with self._lock:
+                self._metrics["wait_timeouts"] += 1
+            return compute() # The leader still owns the flight and caches its result
+
+        try:
+            value = compute()
+            flight.value = copy.deepcopy(value)
+            self.backend.set(key, {
+                "value": flight.value,
+                "generation": generation,
+                "expires_at": time.time() + self.ttl_seconds,
+                "embedding": None,
+            })
+            return value
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._metrics["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._metrics)
+        lookups = snapshot["hits"] + snapshot["misses"] + snapshot["coalesced"]
+        served = snapshot["hits"] + snapshot["coalesced"] - snapshot["wait_timeouts"]
+        snapshot["hit_rate"] = round(served / lookups, 4) if lookups else 0.0
+        return snapshot
+
+
+def create_response_cache():
+    """
+    Builds the response cache from environment variables, or returns None when
+    RESPONSE_CACHE_BACKEND=off.
+
+        RESPONSE_CACHE_BACKEND      memory (default) | sqlite | off
+        RESPONSE_CACHE_TTL          seconds, default 3600
+        RESPONSE_CACHE_MAX_ENTRIES  default 1000
+        RESPONSE_CACHE_PATH         SQLite file, default response_cache.sqlite3
+        RESPONSE_CACHE_SIMILARITY   cosine threshold for semantic hits, e.g. 0.95 (unset = exact only)
+    """
+    backend_name = os.environ.get("RESPONSE_CACHE_BACKEND", "memory").lower()
+    if backend_name == "off":
+        return None
+    max_entries = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    if backend_name == "sqlite":
+        backend = SQLiteCacheBackend(os.environ.get("RESPONSE_CACHE_PATH", "response_cache.sqlite3"), max_entries)
+    elif backend_name == "memory":
+        backend = InMemoryCacheBackend(max_entries)
+    else:
+        raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {backend_name}")
+    similarity = os.environ.get("RESPONSE_CACHE_SIMILARITY")
+    return ResponseCache(
+        backend,
+        ttl_seconds=float(os.environ.get("RESPONSE_CACHE_TTL", "3600")),
+        similarity_threshold=float(similarity) if similarity else None,
+    )
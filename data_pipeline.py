@@ -1,170 +1,1057 @@
 # data_pipeline.py
 
+import argparse
+import hashlib
+import inspect
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
 import requests
+import queue
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timedelta
-import mysql.connector
 from mysql.connector import Error
-import os # <--- Added import for os to read environment variables
-
-# --- Database Connection Function (Copied from agent_tools.py best practice) ---
-def create_db_connection():
-    connection = None
-    # Read credentials from environment variables
-    db_host = os.environ.get("DB_HOST", "localhost")
-    db_name = os.environ.get("DB_NAME")
-    db_user = os.environ.get("DB_USER")
-    db_password = os.environ.get("DB_PASSWORD")
-    db_port = os.environ.get("DB_PORT", "3306")
-
-    if not all([db_host, db_name, db_user]):
-         print("Warning: DB_HOST, DB_NAME, or DB_USER not found in environment variables for data_pipeline. Check .env file.")
-         # db_password can be empty for some local setups
 
+# Shared, bounded connection pool (replaces the copy of create_db_connection
+# that used to live in this file)
+from db_pool import pooled_connection, PoolError
+from vector_index import VectorIndex
+from fulltext import FullTextCache, iter_paragraphs, chunk_paragraphs
+from caching import bump_data_generation
+from replica import build_replica, get_replica_path
+
+logger = logging.getLogger(__name__)
+
+# --- Schema / Migration Step ---
+# Base tables. Existing deployments already have federal_documents;
+# CREATE TABLE IF NOT EXISTS leaves their definition alone and only the
+# missing columns and indexes below are added.
+FEDERAL_DOCUMENTS_DDL = """
+CREATE TABLE IF NOT EXISTS federal_documents (
+    document_number VARCHAR(64) NOT NULL PRIMARY KEY,
+    title TEXT,
+    agency VARCHAR(512),
+    publication_date DATE,
+    document_url VARCHAR(512),
+    content MEDIUMTEXT,
+    content_hash CHAR(64),
+    document_type VARCHAR(64),
+    full_text_failures INT NOT NULL DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+# One row per sync job holding its high-water mark (the newest publication
+# date that has been fully ingested).
+SYNC_STATE_DDL = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    watermark DATE NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+# Overlapping passages of each document's full text (see fulltext.py),
+# searched by agent_tools.search_document_passages.
+DOCUMENT_CHUNKS_DDL = """
+CREATE TABLE IF NOT EXISTS document_chunks (
+    document_number VARCHAR(64) NOT NULL,
+    chunk_index INT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (document_number, chunk_index),
+    FULLTEXT INDEX ft_chunk_content (content)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+# Normalized agency dimension. A document can list several agencies; each
+# (document, agency) pair is a row of document_agencies, which repeats the
+# document's publication_date so idx_agency_date can serve an agency filter
+# together with a date range without touching federal_documents.
+AGENCIES_DDL = """
+CREATE TABLE IF NOT EXISTS agencies (
+    agency_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    UNIQUE KEY uq_agency_name (name)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+DOCUMENT_AGENCIES_DDL = """
+CREATE TABLE IF NOT EXISTS document_agencies (
+    document_number VARCHAR(64) NOT NULL,
+    agency_id INT NOT NULL,
+    publication_date DATE,
+    PRIMARY KEY (document_number, agency_id),
+    INDEX idx_agency_date (agency_id, publication_date)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+# Pre-aggregated document counts for agent_tools.document_stats, kept in step
+# with federal_documents by _write_batch (one delta per batch). Months are
+# 'YYYY-MM'; documents without a type count under ''. stats_month_type counts
+# every document once; stats_agency_month_type counts it once per agency.
+STATS_MONTH_TYPE_DDL = """
+CREATE TABLE IF NOT EXISTS stats_month_type (
+    month CHAR(7) NOT NULL,
+    document_type VARCHAR(64) NOT NULL,
+    documents INT NOT NULL,
+    PRIMARY KEY (month, document_type)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+STATS_AGENCY_MONTH_TYPE_DDL = """
+CREATE TABLE IF NOT EXISTS stats_agency_month_type (
+    agency_id INT NOT NULL,
+    month CHAR(7) NOT NULL,
+    document_type VARCHAR(64) NOT NULL,
+    documents INT NOT NULL,
+    PRIMARY KEY (agency_id, month, document_type),
+    INDEX idx_month (month)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+SCHEMA_TABLES = [FEDERAL_DOCUMENTS_DDL, SYNC_STATE_DDL, DOCUMENT_CHUNKS_DDL, AGENCIES_DDL, DOCUMENT_AGENCIES_DDL,
+                 STATS_MONTH_TYPE_DDL, STATS_AGENCY_MONTH_TYPE_DDL]
+
+# Table -> column name -> ALTER statement, for columns added after the
+# table was first created.
+SCHEMA_COLUMNS = {
+    "federal_documents": {
+        # sha256 of the stored fields; lets re-ingest skip unchanged rows
+        "content_hash": "ALTER TABLE federal_documents ADD COLUMN content_hash CHAR(64)",
+        # The API's "type" (Rule, Proposed Rule, Notice, Presidential Document)
+        "document_type": "ALTER TABLE federal_documents ADD COLUMN document_type VARCHAR(64)",
+        # Consecutive syncs whose full-text stage failed for the document; see record_full_text_failures
+        "full_text_failures": "ALTER TABLE federal_documents ADD COLUMN full_text_failures INT NOT NULL DEFAULT 0",
+    },
+}
+
+# Table -> index name -> ALTER statement. agent_tools.search_federal_documents
+# relies on ft_title_content for MATCH ... AGAINST; its agency filter goes
+# through document_agencies.idx_agency_date. The agency index uses a prefix
+# length so it also works when the column was created as TEXT.
+SCHEMA_INDEXES = {
+    "federal_documents": {
+        "ft_title_content": "ALTER TABLE federal_documents ADD FULLTEXT INDEX ft_title_content (title, content)",
+        "idx_agency": "ALTER TABLE federal_documents ADD INDEX idx_agency (agency(191))",
+        "idx_publication_date": "ALTER TABLE federal_documents ADD INDEX idx_publication_date (publication_date)",
+    },
+}
+
+def ensure_schema(connection):
+    """
+    Creates the pipeline's tables if needed and adds any missing columns and
+    indexes. Safe to run on every pipeline start: existing columns and indexes
+    are detected through information_schema and skipped.
+    """
+    cursor = connection.cursor()
     try:
-        print(f"Pipeline attempting to connect to DB: mysql://{db_user}@{db_host}:{db_port}/{db_name}")
-        connection = mysql.connector.connect(
-            host=db_host,
-            port=int(db_port),
-            database=db_name,
-            user=db_user,
-            password=db_password
+        for ddl in SCHEMA_TABLES:
+            cursor.execute(ddl)
+
+        for table, columns in SCHEMA_COLUMNS.items():
+            cursor.execute(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = DATABASE() AND table_name = %s", (table,)
+            )
+            existing = {row[0].lower() for row in cursor.fetchall()}
+            for column_name, ddl in columns.items():
+                if column_name not in existing:
+                    logger.info("Adding column %s to %s", column_name, table)
+                    cursor.execute(ddl)
+
+        for table, indexes in SCHEMA_INDEXES.items():
+            cursor.execute(
+                "SELECT DISTINCT index_name FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = %s", (table,)
+            )
+            existing = {row[0] for row in cursor.fetchall()}
+            for index_name, ddl in indexes.items():
+                if index_name in existing:
+                    continue
+                # Building a FULLTEXT index over an existing corpus can take a while
+                logger.info("Creating index %s on %s", index_name, table)
+                cursor.execute(ddl)
+
+        cursor.execute("SELECT 1 FROM document_agencies LIMIT 1")
+        if not cursor.fetchall():
+            _backfill_agency_links(cursor)
+        cursor.execute("SELECT 1 FROM stats_month_type LIMIT 1")
+        if not cursor.fetchall():
+            _rebuild_document_stats(cursor)
+        connection.commit()
+    finally:
+        cursor.close()
+
+def _backfill_agency_links(cursor, batch_size=2000):
+    """
+    Fills the empty agency tables from the agency strings of rows ingested
+    before they existed. Names are recovered by splitting on ", " (how
+    process_document_data joins them); a document's links are rewritten from
+    the API's agencies array the next time its content changes.
+    """
+    cursor.execute(
+        "SELECT document_number, agency, publication_date FROM federal_documents "
+        "WHERE agency IS NOT NULL AND agency <> ''"
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return
+    logger.info("Backfilling agency links for %d documents", len(rows))
+    for start in range(0, len(rows), batch_size):
+        _write_agency_links(cursor, [
+            {'document_number': number, 'agency_names': agency.split(", "), 'publication_date': publication_date}
+            for number, agency, publication_date in rows[start:start + batch_size]
+        ])
+
+# --- Sync State (High-Water Mark) ---
+SYNC_NAME = "federal_register"
+# Documents can be corrected after publication, so incremental runs re-read a
+# few days before the watermark; content hashes make the overlap cheap.
+DEFAULT_SYNC_LOOKBACK_DAYS = 7
+
+def get_sync_watermark(connection, name=SYNC_NAME):
+    """Returns the stored watermark as a YYYY-MM-DD string, or None if never synced."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT watermark FROM sync_state WHERE name = %s", (name,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return row[0].isoformat() if row else None
+
+def set_sync_watermark(connection, watermark, name=SYNC_NAME):
+    """Stores ``watermark`` (YYYY-MM-DD) for ``name``; never moves it backwards."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "INSERT INTO sync_state (name, watermark) VALUES (%s, %s) "
+            "ON DUPLICATE KEY UPDATE watermark = GREATEST(watermark, VALUES(watermark))",
+            (name, watermark),
         )
-        # This print statement will confirm connection success from this specific function
-        # It was already in your log, so the previous run must have used a similar connection.
-        # We are making it explicit here for clarity and robustness.
-        print("Pipeline MySQL Database connection successful!")
-        return connection
-    except ValueError as verr:
-        print(f"Error in pipeline DB connection: DB_PORT '{db_port}' is not a valid integer. {verr}")
-        return None
-    except Error as err:
-        print(f"Error in pipeline DB connection: '{err}'")
-        print(f"Pipeline attempted connection details: host={db_host}, port={db_port}, user={db_user}, database={db_name}")
-        return None
+        connection.commit()
+    finally:
+        cursor.close()
+
+# --- API Fetching Functions ---
+FEDERAL_REGISTER_API_URL = "https://www.federalregister.gov/api/v1/documents.json"
+DEFAULT_START_DATE = '2025-01-01'
+# The API stops paginating after this many results for a single query, so
+# date windows that match more are split in half and fetched separately.
+MAX_RESULTS_PER_QUERY = 10000
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def create_http_session(pool_size=8):
+    """
+    Returns a requests.Session whose connection pool is sized for the fetcher's
+    worker count, so concurrent page requests reuse keep-alive connections.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def _get_with_retries(session, url, params=None, stream=False, max_retries=5, backoff_base=1.0, backoff_cap=30.0, timeout=30):
+    """
+    GETs ``url`` and returns the successful response, retrying on 429/5xx and
+    on connection errors with exponential backoff and full jitter. A
+    Retry-After header from the server takes precedence over the computed delay.
+    """
+    for attempt in range(max_retries + 1):
+        retry_after = None
+        try:
+            response = session.get(url, params=params, timeout=timeout, stream=stream)
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status() # Other 4xx errors are not worth retrying
+                return response
+            response.close()
+            error = requests.exceptions.HTTPError(f"HTTP {response.status_code}", response=response)
+            retry_after = response.headers.get("Retry-After")
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+
+        if attempt == max_retries:
+            raise error
+        delay = random.uniform(0, min(backoff_cap, backoff_base * (2 ** attempt)))
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        logger.warning("Request for %s (page %s) failed (%s); retrying in %.1fs (attempt %d/%d)",
+                       url, (params or {}).get('page', '-'), error, delay, attempt + 1, max_retries)
+        time.sleep(delay)
 
-# --- API Fetching Function (Modified for 2025 data) ---
-def fetch_federal_register_data(): # Removed date_filter argument as it was not used
-    base_url = "https://www.federalregister.gov/api/v1/documents.json"
-    
-    # MODIFIED: Fetch documents for the year 2025 up to the current date
-    start_date_str = '2025-01-01'
-    # Ensure current_date is also in YYYY-MM-DD for consistency if comparing
-    current_date_obj = datetime.now()
-    # If current_date_obj is before 2025-01-01, this would fetch nothing.
-    # If current_date_obj is within 2025, it fetches up to current_date_obj.
-    # If current_date_obj is after 2025, it will fetch all of 2025.
-    
-    # For the specific requirement "only the 2025 dataset" when running IN 2025:
-    # We want from Jan 1, 2025 up to the current date of 2025.
-    # If the script were run in 2026, and you only wanted 2025 data, end_date_str would be '2025-12-31'
-    
-    end_date_str = current_date_obj.strftime('%Y-%m-%d')
-    
-    # If today's date is past 2025, and you ONLY want 2025 data, you'd use:
-    # if current_date_obj.year > 2025:
-    #    end_date_str = '2025-12-31'
-
-    print(f"Fetching documents from {start_date_str} to {end_date_str}")
-
-    params = {
-        'conditions[publication_date][gte]': start_date_str,
-        'conditions[publication_date][lte]': end_date_str,
-        'per_page': 1000, # API might limit this, common values are 50, 100, or 1000
+def _get_json(session, url, params, **retry_kwargs):
+    """GETs ``url`` with retries (see _get_with_retries) and returns the decoded JSON body."""
+    return _get_with_retries(session, url, params, **retry_kwargs).json()
+
+def _date_windows(start_date_str, end_date_str, window_days):
+    """Splits [start, end] into consecutive, non-overlapping windows of ``window_days``."""
+    start = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+    windows = []
+    while start <= end:
+        window_end = min(end, start + timedelta(days=window_days - 1))
+        windows.append((start.isoformat(), window_end.isoformat()))
+        start = window_end + timedelta(days=1)
+    return windows
+
+def _window_params(window_start, window_end, per_page, page):
+    return {
+        'conditions[publication_date][gte]': window_start,
+        'conditions[publication_date][lte]': window_end,
+        'per_page': per_page, # The API caps this at 1000
+        'page': page,
         # You can add more conditions here if needed, e.g., for specific document types
         # 'conditions[type][]': 'RULE',
-        # 'conditions[type][]': 'EXECUTIVE ORDER', # Check API for exact filter key
     }
-    
+
+def iter_federal_register_pages(start_date=None, end_date=None, max_workers=None, window_days=None,
+                                per_page=1000, base_url=None, session=None, stats=None, retry_kwargs=None):
+    """
+    Fetches Federal Register documents concurrently and yields each page's
+    list of raw documents as soon as it arrives (pages are not in order).
+
+    The date range is sliced into windows. For every window the first page is
+    fetched to learn ``total_pages``; the remaining pages are then fanned out
+    across at most ``max_workers`` threads sharing one pooled HTTP session,
+    with at most ``2 * max_workers`` pages requested but not yet consumed.
+    A window whose result count exceeds the API's pagination cap is split in
+    half instead of being truncated. Each page request is retried as
+    described in _get_with_retries(), tuned by ``retry_kwargs``.
+
+    A page that still fails after its retries is skipped and counted in
+    ``stats["failed_pages"]`` (when a ``stats`` dict is passed); a failed
+    first page loses its whole window, so callers must not treat the range
+    as fetched unless that count is 0.
+    """
+    start_date = start_date or DEFAULT_START_DATE
+    end_date = end_date or datetime.now().strftime('%Y-%m-%d')
+    max_workers = int(max_workers or os.environ.get("FETCH_MAX_WORKERS", "4"))
+    window_days = int(window_days or os.environ.get("FETCH_WINDOW_DAYS", "30"))
+    base_url = base_url or os.environ.get("FEDERAL_REGISTER_API_URL", FEDERAL_REGISTER_API_URL)
+    own_session = session is None
+    session = session or create_http_session(pool_size=max_workers)
+
+    logger.info("Fetching documents from %s to %s with %d workers", start_date, end_date, max_workers)
+
+    def fetch(window, page):
+        return _get_json(session, base_url, _window_params(window[0], window[1], per_page, page), **(retry_kwargs or {}))
+
+    # Pages waiting to be requested. Only a bounded number are in flight at a
+    # time, so a slow consumer applies backpressure all the way to the network
+    # instead of letting completed pages pile up in memory.
+    todo = deque((window, 1) for window in _date_windows(start_date, end_date, window_days))
+    max_in_flight = max_workers * 2
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch") as executor:
+            pending = {}
+            try:
+                while todo or pending:
+                    while todo and len(pending) < max_in_flight:
+                        task = todo.popleft()
+                        pending[executor.submit(fetch, *task)] = task
+
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        window, page = pending.pop(future)
+                        try:
+                            data = future.result()
+                        except (requests.exceptions.RequestException, ValueError) as e: # ValueError includes JSONDecodeError
+                            logger.error("Error fetching page %s of %s..%s: %s", page, window[0], window[1], e)
+                            if stats is not None:
+                                stats["failed_pages"] = stats.get("failed_pages", 0) + 1
+                            continue
+
+                        if page == 1:
+                            count = data.get('count') or 0
+                            if count > MAX_RESULTS_PER_QUERY and window[0] != window[1]:
+                                # Too many results to page through; split the window and start over on each half
+                                logger.info("%s..%s has %d documents; splitting into smaller windows", window[0], window[1], count)
+                                todo.extendleft((half, 1) for half in reversed(_split_window(window)))
+                                continue
+                            total_pages = data.get('total_pages') or 1
+                            todo.extendleft((window, next_page) for next_page in range(total_pages, 1, -1))
+
+                        documents = data.get('results', [])
+                        if documents:
+                            yield documents
+            finally:
+                # Only non-empty when the consumer stopped early: skip the pages not started yet
+                for future in pending:
+                    future.cancel()
+    finally:
+        if own_session:
+            session.close()
+
+def _split_window(window):
+    start = datetime.strptime(window[0], '%Y-%m-%d').date()
+    end = datetime.strptime(window[1], '%Y-%m-%d').date()
+    middle = start + (end - start) // 2
+    return (window[0], middle.isoformat()), ((middle + timedelta(days=1)).isoformat(), window[1])
+
+def fetch_federal_register_data(start_date=None, end_date=None, **kwargs):
+    """
+    Fetches every document published between ``start_date`` (default
+    2025-01-01) and ``end_date`` (default today) and returns them as one list.
+    See iter_federal_register_pages() for the concurrency options.
+    """
     all_documents = []
-    page = 1
-    max_pages = 10 # Safety break for development to avoid too many API calls accidentally
-    
-    while True:
-        if page > max_pages: # Safety break
-            print(f"Reached max_pages limit ({max_pages}). Stopping fetch.")
-            break
-            
-        params['page'] = page
-        try:
-            print(f"Fetching page {page} with params: {params}")
-            response = requests.get(base_url, params=params, timeout=30) # Added timeout
-            response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
-            data = response.json()
-            
-            current_page_documents = data.get('results', [])
-            if not current_page_documents:
-                print("No more documents found on this page or subsequent pages.")
-                break # No more documents
-            
-            all_documents.extend(current_page_documents)
-            print(f"Fetched {len(current_page_documents)} documents from page {page}. Total so far: {len(all_documents)}")
-
-            # Check if there are more pages - API dependent logic
-            # The example API has 'count' and 'total_pages' or 'next_page_url'
-            # Simple check: if results are less than per_page, it's likely the last page
-            if len(current_page_documents) < params['per_page']:
-                print("Fetched less than 'per_page' documents, assuming last page.")
-                break
-            
-            # More robust check if API provides total_pages or next_page_url
-            if 'total_pages' in data and page >= data['total_pages']:
-                 print("Reached total_pages reported by API.")
-                 break
-            if 'next_page_url' in data and not data['next_page_url']: # If next_page_url is null/empty
-                 print("API indicates no next page.")
-                 break
-
-            page += 1
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching data from API: {e}")
-            break # Stop fetching on error
-        except ValueError as e: # Includes JSONDecodeError
-            print(f"Error decoding JSON response from API: {e}")
-            break
-            
+    for documents in iter_federal_register_pages(start_date, end_date, **kwargs):
+        all_documents.extend(documents)
+    logger.info("Fetched %d documents in total", len(all_documents))
     return all_documents
 
 # --- Data Processing Function (Assumed mostly correct from your snippet) ---
 def process_document_data(document_json):
     # Extract relevant fields. Adjust based on actual API response structure.
     # Ensure all keys accessed with .get() to avoid KeyErrors if a field is missing.
-    return {
+    agency_names = [agency.get('name') for agency in document_json.get('agencies', []) if agency.get('name')]
+    document = {
         'document_number': document_json.get('document_number'),
         'title': document_json.get('title'),
-        'agency': ", ".join([agency.get('name', '') for agency in document_json.get('agencies', []) if agency.get('name')]), # Example for multiple agencies
+        'agency': ", ".join(agency_names), # Display string; the names are normalized into agencies/document_agencies
+        'agency_names': agency_names, # Not stored in federal_documents; written as document_agencies links
         'publication_date': document_json.get('publication_date'),
+        'document_type': document_json.get('type'),
         'document_url': document_json.get('html_url'), # Assuming html_url is the link
-        'content': document_json.get('abstract') or document_json.get('full_text_xml_url') # Prefer abstract, fallback or decide strategy
-        # Consider fetching full text if abstract is not enough and a full_text_xml_url is provided
+        # Only real text goes into content. Documents without an abstract get
+        # the lead of their full text filled in by the full-text stage.
+        'content': document_json.get('abstract'),
+        'full_text_xml_url': document_json.get('full_text_xml_url'), # Not stored; consumed by the full-text stage
     }
+    document['content_hash'] = document_content_hash(document)
+    return document
 
-# --- Database Insertion Function (Assumed mostly correct from your snippet) ---
-def insert_document(connection, document_data):
-    # Using document_number as PRIMARY KEY, so ON DUPLICATE KEY UPDATE is good
-    query = """
-    INSERT INTO federal_documents (document_number, title, agency, publication_date, document_url, content)
-    VALUES (%s, %s, %s, %s, %s, %s)
+# Fields that make up a stored row; a change in any of them changes the hash.
+HASHED_FIELDS = ('title', 'agency', 'publication_date', 'document_url', 'content', 'document_type')
+
+def document_content_hash(document_data):
+    """Stable sha256 over the stored fields of a processed document."""
+    payload = json.dumps([document_data.get(field) for field in HASHED_FIELDS], ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# --- Database Insertion Functions ---
+# Using document_number as PRIMARY KEY, so ON DUPLICATE KEY UPDATE is good.
+# No trailing semicolon: mysql-connector only rewrites executemany() into a
+# single multi-row INSERT when the statement ends with the VALUES/UPDATE clause.
+UPSERT_DOCUMENT_SQL = """
+    INSERT INTO federal_documents (document_number, title, agency, publication_date, document_url, content, content_hash, document_type)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
     ON DUPLICATE KEY UPDATE
-    title = VALUES(title), agency = VALUES(agency), publication_date = VALUES(publication_date), document_url = VALUES(document_url), content = VALUES(content);
-    """
-    values = (
+    title = VALUES(title), agency = VALUES(agency), publication_date = VALUES(publication_date), document_url = VALUES(document_url), content = VALUES(content), content_hash = VALUES(content_hash), document_type = VALUES(document_type)
+"""
+
+def _document_values(document_data, store_hash=True):
+    return (
         document_data.get('document_number'),
         document_data.get('title'),
         document_data.get('agency'),
         document_data.get('publication_date'),
         document_data.get('document_url'),
-        document_data.get('content')
+        document_data.get('content'),
+        (document_data.get('content_hash') or document_content_hash(document_data)) if store_hash else None,
+        document_data.get('document_type')
     )
+
+def insert_document(connection, document_data):
+    """Upserts a single document and commits. Prefer upsert_documents() for bulk loads."""
     try:
         cursor = connection.cursor()
-        cursor.execute(query, values)
+        numbers = [document_data.get('document_number')]
+        before = _stats_snapshot(cursor, numbers)
+        cursor.execute(UPSERT_DOCUMENT_SQL, _document_values(document_data))
+        _write_agency_links(cursor, [document_data])
+        _apply_stats_delta(cursor, before, _stats_snapshot(cursor, numbers))
         connection.commit()
-        # print(f"Record inserted/updated: {document_data.get('document_number')}") # Keep this commented if too verbose
+        cursor.close()
     except Error as err:
-        print(f"Database Error: '{err}' while inserting data for {document_data.get('document_number')}")
+        logger.error("Database error while inserting %s: %s", document_data.get('document_number'), err)
+    except Exception:
+        logger.exception("Unexpected error during DB insert of %s", document_data.get('document_number'))
+
+def _changed_documents(cursor, batch):
+    """Drops documents whose stored content_hash already matches (one indexed lookup per batch)."""
+    numbers = [doc['document_number'] for doc in batch]
+    placeholders = ", ".join(["%s"] * len(numbers))
+    cursor.execute(f"SELECT document_number, content_hash FROM federal_documents WHERE document_number IN ({placeholders})", numbers)
+    stored = dict(cursor.fetchall())
+    return [doc for doc in batch if stored.get(doc['document_number']) != (doc.get('content_hash') or document_content_hash(doc))]
+
+def _agency_names(document_data):
+    names = document_data.get('agency_names')
+    if names is None: # Documents processed without the list (e.g. older callers)
+        names = (document_data.get('agency') or "").split(", ")
+    return [name.strip()[:255] for name in names if name and name.strip()]
+
+def _write_agency_links(cursor, documents):
+    """
+    Replaces the document_agencies rows of ``documents``, adding any agency
+    names not yet in agencies. Runs on the caller's transaction.
+    """
+    names = sorted({name for doc in documents for name in _agency_names(doc)})
+    agency_ids = {}
+    if names:
+        cursor.executemany("INSERT IGNORE INTO agencies (name) VALUES (%s)", [(name,) for name in names])
+        placeholders = ", ".join(["%s"] * len(names))
+        cursor.execute(f"SELECT agency_id, name FROM agencies WHERE name IN ({placeholders})", names)
+        # The column collation is case-insensitive, so look names up the same way
+        agency_ids = {name.casefold(): agency_id for agency_id, name in cursor.fetchall()}
+
+    numbers = [doc['document_number'] for doc in documents]
+    placeholders = ", ".join(["%s"] * len(numbers))
+    cursor.execute(f"DELETE FROM document_agencies WHERE document_number IN ({placeholders})", numbers)
+
+    links = {}
+    for doc in documents:
+        for name in _agency_names(doc):
+            agency_id = agency_ids.get(name.casefold())
+            if agency_id is not None:
+                links[(doc['document_number'], agency_id)] = doc.get('publication_date')
+    if links:
+        cursor.executemany(
+            "INSERT INTO document_agencies (document_number, agency_id, publication_date) VALUES (%s, %s, %s)",
+            [(number, agency_id, publication_date) for (number, agency_id), publication_date in links.items()]
+        )
+
+# --- Aggregate Stats ---
+# The stats tables are maintained by difference: the facets (month, type and
+# agencies) of the documents a batch touches are read before and after the
+# write, and only the net change is added to the counters. Inserts, updates
+# that move a document between months/types/agencies, and re-writes of
+# identical facets are all handled the same way.
+def _stats_snapshot(cursor, numbers):
+    """Returns (month/type counts, agency/month/type counts) of the given stored documents."""
+    totals, by_agency = Counter(), Counter()
+    placeholders = ", ".join(["%s"] * len(numbers))
+    cursor.execute(
+        "SELECT d.document_number, d.publication_date, d.document_type, da.agency_id FROM federal_documents d"
+        " LEFT JOIN document_agencies da ON da.document_number = d.document_number"
+        f" WHERE d.document_number IN ({placeholders}) AND d.publication_date IS NOT NULL", numbers
+    )
+    seen = set()
+    for number, publication_date, document_type, agency_id in cursor.fetchall():
+        key = (str(publication_date)[:7], document_type or "")
+        if number not in seen:
+            seen.add(number)
+            totals[key] += 1
+        if agency_id is not None:
+            by_agency[(agency_id,) + key] += 1
+    return totals, by_agency
+
+def _apply_stats_delta(cursor, before, after):
+    """Adds the difference between two _stats_snapshot() results to the stats tables."""
+    for table, columns, old, new in (
+        ("stats_month_type", "month, document_type", before[0], after[0]),
+        ("stats_agency_month_type", "agency_id, month, document_type", before[1], after[1]),
+    ):
+        delta = [key + (new[key] - old[key],) for key in set(old) | set(new) if new[key] != old[key]]
+        if not delta:
+            continue
+        placeholders = ", ".join(["%s"] * (len(delta[0])))
+        cursor.executemany(
+            f"INSERT INTO {table} ({columns}, documents) VALUES ({placeholders})"
+            " ON DUPLICATE KEY UPDATE documents = documents + VALUES(documents)", delta
+        )
+        if any(row[-1] < 0 for row in delta):
+            cursor.execute(f"DELETE FROM {table} WHERE documents <= 0")
+
+def _rebuild_document_stats(cursor):
+    """Recomputes both stats tables from federal_documents and document_agencies."""
+    cursor.execute("DELETE FROM stats_month_type")
+    cursor.execute("DELETE FROM stats_agency_month_type")
+    cursor.execute(
+        "INSERT INTO stats_month_type (month, document_type, documents)"
+        " SELECT LEFT(publication_date, 7), COALESCE(document_type, ''), COUNT(*) FROM federal_documents"
+        " WHERE publication_date IS NOT NULL GROUP BY 1, 2"
+    )
+    cursor.execute(
+        "INSERT INTO stats_agency_month_type (agency_id, month, document_type, documents)"
+        " SELECT da.agency_id, LEFT(d.publication_date, 7), COALESCE(d.document_type, ''), COUNT(*)"
+        " FROM document_agencies da JOIN federal_documents d ON d.document_number = da.document_number"
+        " WHERE d.publication_date IS NOT NULL GROUP BY 1, 2, 3"
+    )
+
+def rebuild_document_stats(connection):
+    """Recomputes the stats tables from scratch (e.g. after editing federal_documents by hand)."""
+    cursor = connection.cursor()
+    try:
+        _rebuild_document_stats(cursor)
+        connection.commit()
+    finally:
+        cursor.close()
+
+def _write_batch(connection, batch, store_hashes=True):
+    """
+    Writes the changed documents of one batch, with their agency links and
+    the matching change to the stats tables, in a single transaction and
+    returns them (unchanged rows are not rewritten). With ``store_hashes``
+    False their content_hash is left NULL (see commit_content_hashes).
+    """
+    cursor = connection.cursor()
+    try:
+        changed = _changed_documents(cursor, batch)
+        if changed:
+            numbers = [doc['document_number'] for doc in changed]
+            before = _stats_snapshot(cursor, numbers)
+            cursor.executemany(UPSERT_DOCUMENT_SQL, [_document_values(doc, store_hashes) for doc in changed])
+            _write_agency_links(cursor, changed)
+            _apply_stats_delta(cursor, before, _stats_snapshot(cursor, numbers))
+        connection.commit()
+        return changed
+    finally:
+        cursor.close()
+
+def _batched(iterable, size):
+    """Yields lists of up to ``size`` items from any iterable (including generators)."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def upsert_documents(documents, batch_size=None, max_retries=3, retry_backoff=1.0, on_batch=None, store_hashes=True):
+    """
+    Bulk-upserts processed documents: one multi-row INSERT ... ON DUPLICATE KEY
+    UPDATE and one commit per batch instead of per row. Documents whose
+    content_hash matches the stored row are skipped.
+
+    A batch that fails is rolled back and retried on a fresh pooled connection
+    (with linear backoff) up to ``max_retries`` times; earlier batches stay
+    committed and later batches still run.
+
+    Args:
+        documents (iterable): Processed document dicts (see process_document_data).
+        batch_size (int, optional): Rows per batch. Defaults to INGEST_BATCH_SIZE or 500.
+        max_retries (int): Retries per failed batch before it is counted as failed.
+        retry_backoff (float): Seconds to wait before the first retry; grows per attempt.
+        on_batch (callable, optional): Called with the changed documents of each
+            batch after it is committed, outside the retry loop: a failure
+            there is the callback's to handle and never rewrites the batch.
+        store_hashes (bool): Store each row's content_hash with it. False leaves
+            it NULL, for callers that commit it once the derived stages are
+            persisted (see commit_content_hashes).
+
+    Returns:
+        dict: rows, written, unchanged, batches, failed_batches, failed_rows,
+              seconds and rows_per_sec.
+    """
+    batch_size = int(batch_size or os.environ.get("INGEST_BATCH_SIZE", "500"))
+    stats = {"rows": 0, "written": 0, "unchanged": 0, "batches": 0, "failed_batches": 0, "failed_rows": 0}
+    started = time.perf_counter()
+
+    for batch in _batched(documents, batch_size):
+        changed = None
+        for attempt in range(max_retries + 1):
+            try:
+                with pooled_connection() as conn:
+                    changed = _write_batch(conn, batch, store_hashes)
+                stats["rows"] += len(batch)
+                stats["written"] += len(changed)
+                stats["unchanged"] += len(batch) - len(changed)
+                stats["batches"] += 1
+                break
+            except (Error, PoolError) as err:
+                # The pool discards the connection that raised, so a retry gets a fresh one
+                if attempt < max_retries:
+                    logger.warning("Batch of %d rows failed (attempt %d/%d): %s. Retrying...", len(batch), attempt + 1, max_retries + 1, err)
+                    time.sleep(retry_backoff * (attempt + 1))
+                else:
+                    logger.error("Batch of %d rows failed after %d attempts: %s. Skipping it.", len(batch), max_retries + 1, err)
+                    stats["failed_batches"] += 1
+                    stats["failed_rows"] += len(batch)
+        if on_batch is not None and changed:
+            on_batch(changed)
+
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    stats["rows_per_sec"] = round(stats["rows"] / stats["seconds"], 1) if stats["seconds"] > 0 else 0.0
+    return stats
+
+
+# --- Full-Text Stage ---
+# Downloads each changed document's full-text XML (through the disk cache),
+# parses it incrementally and stores overlapping chunks in document_chunks.
+LEAD_TEXT_CHARS = 2000 # Full-text lead stored as content when there is no abstract
+DEFAULT_FULL_TEXT_MAX_ATTEMPTS = 5 # Syncs a failing full text is retried before it stops holding the watermark
+
+def _download_full_text(session, url, cache):
+    """Returns a local path for ``url``, downloading it (streamed) on a cache miss."""
+    path = cache.get(url)
+    if path:
+        return path
+    response = _get_with_retries(session, url, stream=True, timeout=60)
+    try:
+        return cache.store(url, response.iter_content(chunk_size=64 * 1024))
+    finally:
+        response.close()
+
+def _chunk_full_text(session, cache, doc):
+    path = _download_full_text(session, doc['full_text_xml_url'], cache)
+    return list(chunk_paragraphs(iter_paragraphs(path),
+                                 chunk_words=int(os.environ.get("CHUNK_WORDS", "200")),
+                                 overlap_words=int(os.environ.get("CHUNK_OVERLAP_WORDS", "40"))))
+
+def _retry_db_write(write, description, max_retries=3, retry_backoff=1.0):
+    """
+    Runs ``write(connection)`` on a pooled connection, retrying like
+    upsert_documents does. Returns True once it committed, False if every
+    attempt failed.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            with pooled_connection() as conn:
+                write(conn)
+            return True
+        except (Error, PoolError) as err:
+            if attempt < max_retries:
+                logger.warning("%s failed (attempt %d/%d): %s. Retrying...", description, attempt + 1, max_retries + 1, err)
+                time.sleep(retry_backoff * (attempt + 1))
+            else:
+                logger.error("%s failed after %d attempts: %s", description, max_retries + 1, err)
+    return False
+
+def run_full_text_stage(documents, session, cache, max_workers=None, max_retries=3, retry_backoff=1.0):
+    """
+    Chunks the full text of ``documents`` (those with a full_text_xml_url)
+    concurrently and replaces their rows in document_chunks in one transaction
+    (retried like an upsert batch). Documents without an abstract also get
+    their full-text lead stored as content, in the database and in the passed
+    dicts (so the vector index embeds real text).
+
+    Returns (chunks written, document numbers whose full text could not be
+    downloaded, parsed or stored). The caller must make the failed ones count
+    as changed on the next sync (see record_full_text_failures), since their
+    rows are already committed.
+    """
+    candidates = [doc for doc in documents if doc.get('full_text_xml_url')]
+    if not candidates:
+        return 0, []
+    max_workers = int(max_workers or os.environ.get("FULL_TEXT_WORKERS", "8"))
+
+    chunks_by_doc = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fulltext") as executor:
+        futures = {executor.submit(_chunk_full_text, session, cache, doc): doc for doc in candidates}
+        for future in futures:
+            doc = futures[future]
+            try:
+                chunks_by_doc[doc['document_number']] = future.result()
+            except Exception as e: # One bad document (404, malformed XML, ...) must not sink the batch
+                logger.warning("Could not process full text for %s: %s", doc['document_number'], e)
+                failed.append(doc['document_number'])
+    if not chunks_by_doc:
+        return 0, failed
+
+    content_updates = []
+    for doc in candidates:
+        chunks = chunks_by_doc.get(doc['document_number'])
+        if chunks and not doc.get('content'):
+            content_updates.append((" ".join(chunk['content'] for chunk in chunks[:3])[:LEAD_TEXT_CHARS], doc['document_number']))
+    rows = [(number, chunk['chunk_index'], chunk['content']) for number, chunks in chunks_by_doc.items() for chunk in chunks]
+
+    def write(conn):
+        cursor = conn.cursor()
+        try:
+            numbers = list(chunks_by_doc)
+            placeholders = ", ".join(["%s"] * len(numbers))
+            # Replace rather than upsert: a revised document may have fewer chunks
+            cursor.execute(f"DELETE FROM document_chunks WHERE document_number IN ({placeholders})", numbers)
+            if rows:
+                cursor.executemany("INSERT INTO document_chunks (document_number, chunk_index, content) VALUES (%s, %s, %s)", rows)
+            if content_updates:
+                # content_hash is left alone: it describes the API data, not derived text
+                cursor.executemany("UPDATE federal_documents SET content = %s WHERE document_number = %s", content_updates)
+            cursor.execute(f"UPDATE federal_documents SET full_text_failures = 0 "
+                           f"WHERE document_number IN ({placeholders}) AND full_text_failures > 0", numbers)
+            conn.commit()
+        finally:
+            cursor.close()
+
+    if not _retry_db_write(write, f"Storing full text of {len(chunks_by_doc)} documents", max_retries, retry_backoff):
+        return 0, failed + list(chunks_by_doc)
+    leads = {number: content for content, number in content_updates}
+    for doc in candidates:
+        if doc['document_number'] in leads:
+            doc['content'] = leads[doc['document_number']]
+    return len(rows), failed
+
+def record_full_text_failures(documents, max_attempts=None, max_retries=3, retry_backoff=1.0):
+    """
+    Counts a failed full-text attempt for each of ``documents`` and clears the
+    content_hash of those still under ``max_attempts`` (default:
+    FULL_TEXT_MAX_ATTEMPTS) so the next sync treats them as changed and runs
+    the full-text stage again. Documents that reached the limit get their
+    current hash back and are given up on, so a permanently broken full text
+    (a 404, say) cannot hold the sync watermark forever.
+
+    Returns the given-up document numbers, or None if the update failed.
+    """
+    if not documents:
+        return []
+    hashes = {doc['document_number']: doc.get('content_hash') or document_content_hash(doc) for doc in documents}
+    max_attempts = int(max_attempts or os.environ.get("FULL_TEXT_MAX_ATTEMPTS", DEFAULT_FULL_TEXT_MAX_ATTEMPTS))
+    given_up = []
+    def write(conn):
+        cursor = conn.cursor()
+        try:
+            numbers = list(hashes)
+            placeholders = ", ".join(["%s"] * len(numbers))
+            cursor.execute(f"UPDATE federal_documents SET full_text_failures = full_text_failures + 1 "
+                           f"WHERE document_number IN ({placeholders})", numbers)
+            cursor.execute(f"UPDATE federal_documents SET content_hash = NULL "
+                           f"WHERE document_number IN ({placeholders}) AND full_text_failures < %s", numbers + [max_attempts])
+            cursor.execute(f"SELECT document_number FROM federal_documents "
+                           f"WHERE document_number IN ({placeholders}) AND full_text_failures >= %s", numbers + [max_attempts])
+            given_up[:] = [row[0] for row in cursor.fetchall()]
+            if given_up:
+                cursor.executemany("UPDATE federal_documents SET content_hash = %s WHERE document_number = %s",
+                                   [(hashes[number], number) for number in given_up])
+            conn.commit()
+        finally:
+            cursor.close()
+    if not _retry_db_write(write, f"Recording full-text failures of {len(documents)} documents", max_retries, retry_backoff):
+        return None
+    return given_up
+
+def commit_content_hashes(hashes, max_retries=3, retry_backoff=1.0, batch_size=1000):
+    """
+    Stores ``hashes`` (document_number -> content_hash) for rows written
+    without one (upsert_documents(store_hashes=False)). Until then those rows
+    count as changed, so a sync that dies before its derived stages are
+    persisted reprocesses them. Returns True on success.
+    """
+    items = list(hashes.items())
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        def write(conn):
+            cursor = conn.cursor()
+            try:
+                cursor.executemany("UPDATE federal_documents SET content_hash = %s WHERE document_number = %s",
+                                   [(content_hash, number) for number, content_hash in chunk])
+                conn.commit()
+            finally:
+                cursor.close()
+        if not _retry_db_write(write, f"Storing content hashes of {len(chunk)} documents", max_retries, retry_backoff):
+            return False
+    return True
+
+
+# --- Streaming Pipeline ---
+# fetch (thread pool) -> bounded queue -> process_document_data -> batched upsert
+#                                                               -> vector index
+# The fetcher runs in a background thread and blocks when the queue is full,
+# so memory is bounded by roughly (queue size + in-flight pages) * per_page
+# documents no matter how long the backfill is, and database writes overlap
+# with network I/O instead of waiting for the whole fetch to finish.
+
+DEFAULT_INDEX_CHECKPOINT_DOCS = 5000 # Changed documents between vector index saves
+
+_STREAM_DONE = object()
+
+class _StreamError:
+    """Carries an exception from the producer thread to the consumer."""
+    def __init__(self, error):
+        self.error = error
+
+def _put_unless_stopped(out_queue, item, stop_event):
+    """put() with a timeout so a cancelled consumer does not leave the producer blocked forever."""
+    while not stop_event.is_set():
+        try:
+            out_queue.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _produce_into(source, out_queue, stop_event):
+    try:
+        for item in source:
+            if not _put_unless_stopped(out_queue, item, stop_event):
+                return
     except Exception as e:
-        print(f"An unexpected error occurred during DB insert: {e} for {document_data.get('document_number')}")
+        _put_unless_stopped(out_queue, _StreamError(e), stop_event)
+    finally:
+        _put_unless_stopped(out_queue, _STREAM_DONE, stop_event)
+        if inspect.isgenerator(source):
+            # Runs the generator's own cleanup (e.g. the fetcher's executor and HTTP session)
+            source.close()
+
+def stream_in_background(source, queue_size):
+    """
+    Drains the iterable ``source`` on a background thread through a bounded
+    queue and yields its items. The producer blocks while the queue is full.
+    """
+    out_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    producer = threading.Thread(target=_produce_into, args=(source, out_queue, stop_event), name="pipeline-producer", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = out_queue.get()
+            if item is _STREAM_DONE:
+                break
+            if isinstance(item, _StreamError):
+                raise item.error
+            yield item
+    finally:
+        stop_event.set()
+
+def iter_processed_documents(pages):
+    """Flattens raw API pages into processed documents, skipping ones without a document_number."""
+    for page in pages:
+        for doc in page:
+            if doc.get('document_number'): # Ensure there's a document number before processing
+                yield process_document_data(doc)
+            else:
+                logger.warning("Skipping document without document_number: %s", doc.get('title', 'N/A'))
+
+def _track_max_date(documents, stats):
+    """Passes documents through while recording the newest publication_date in ``stats``."""
+    for doc in documents:
+        published = doc.get('publication_date')
+        if published and (stats.get("max_publication_date") or "") < published:
+            stats["max_publication_date"] = published
+        yield doc
+
+def _replica_enabled():
+    # On by default wherever the API reads from the replica (a shared .env)
+    default = "1" if os.environ.get("SEARCH_BACKEND", "mysql").lower() == "replica" else "0"
+    return os.environ.get("BUILD_SEARCH_REPLICA", default) == "1"
+
+def publish_search_replica():
+    """
+    Rebuilds the SQLite search replica from MySQL and swaps it in (see
+    replica.py). Returns its row counts, or None if the build failed; the
+    previous replica then stays in place.
+    """
+    try:
+        with pooled_connection() as conn:
+            return build_replica(conn)
+    except (PoolError, Error, OSError, sqlite3.Error) as err:
+        logger.error("Could not build the search replica; keeping the previous one: %s", err)
+        return None
+
+def run_streaming_pipeline(start_date=None, end_date=None, batch_size=None, queue_size=None, full_text=True, replica=None, **fetch_kwargs):
+    """
+    Runs fetch -> process -> upsert as a stream. For every committed batch the
+    changed documents then go through the full-text stage (unless
+    ``full_text`` is False) and into the vector index, which is saved every
+    INDEX_CHECKPOINT_DOCS documents; their content hashes are stored after
+    each save. When anything changed
+    (or no replica exists yet) the SQLite search replica is rebuilt, if
+    ``replica`` is True (default: BUILD_SEARCH_REPLICA, on when
+    SEARCH_BACKEND=replica). Returns the upsert stats (see upsert_documents)
+    plus "max_publication_date", "chunks", "failed_full_text" (documents
+    whose full text must be retried), "abandoned_full_text" (documents given
+    up on after FULL_TEXT_MAX_ATTEMPTS failed syncs), "failed_pages" (API
+    pages lost after retries) and "replica".
+    """
+    queue_size = int(queue_size or os.environ.get("INGEST_QUEUE_PAGES", "4"))
+    seen = {"max_publication_date": None, "chunks": 0, "failed_full_text": 0, "abandoned_full_text": 0, "failed_pages": 0}
+    pages = stream_in_background(iter_federal_register_pages(start_date, end_date, stats=seen, **fetch_kwargs), queue_size)
+    index = VectorIndex(os.environ.get("VECTOR_INDEX_DIR", "vector_index"))
+
+    session = create_http_session(pool_size=int(os.environ.get("FULL_TEXT_WORKERS", "8")))
+    cache = FullTextCache()
+    checkpoint_docs = int(os.environ.get("INDEX_CHECKPOINT_DOCS", DEFAULT_INDEX_CHECKPOINT_DOCS))
+    # Rows are written without their content_hash; it is stored only once the
+    # vector index holding them is saved, so a crash in between leaves them
+    # marked as changed instead of missing from the on-disk index
+    pending_hashes = {}
+
+    def checkpoint():
+        index.save()
+        if not commit_content_hashes(pending_hashes):
+            logger.warning("%d documents keep a NULL content hash and will be reprocessed next sync", len(pending_hashes))
+        pending_hashes.clear()
+
+    def on_batch(changed):
+        retry = set()
+        if full_text:
+            chunks, failed = run_full_text_stage(changed, session, cache)
+            seen["chunks"] += chunks
+            if failed:
+                failed = set(failed)
+                given_up = record_full_text_failures([doc for doc in changed if doc['document_number'] in failed])
+                if given_up is None:
+                    retry = failed
+                else:
+                    retry = failed - set(given_up)
+                    seen["abandoned_full_text"] += len(given_up)
+                    if given_up:
+                        logger.error("Giving up on the full text of %d documents after repeated failures: %s",
+                                     len(given_up), ", ".join(given_up[:20]))
+                # Their hash stays NULL, so they are picked up again next sync
+                seen["failed_full_text"] += len(retry)
+        index.upsert(changed)
+        for doc in changed:
+            if doc['document_number'] not in retry:
+                pending_hashes[doc['document_number']] = doc.get('content_hash') or document_content_hash(doc)
+        if len(pending_hashes) >= checkpoint_docs:
+            checkpoint()
+
+    documents = _track_max_date(iter_processed_documents(pages), seen)
+    try:
+        stats = upsert_documents(documents, batch_size=batch_size, on_batch=on_batch, store_hashes=False)
+    finally:
+        session.close()
+    stats.update(seen)
+    checkpoint()
+    logger.info("Vector index now holds %d documents", index.count)
+    changed = stats["written"] or seen["chunks"]
+    replica = _replica_enabled() if replica is None else replica
+    stats["replica"] = None
+    if replica and (changed or not os.path.exists(get_replica_path())):
+        # Published before the generation bump, so answers are recomputed against it
+        stats["replica"] = publish_search_replica()
+    if changed:
+        # Cached agent answers may be out of date now; the API drops them on next lookup
+        stats["data_generation"] = bump_data_generation()
+    return stats
+
+def _sync_complete(stats):
+    return stats["failed_batches"] == 0 and stats.get("failed_full_text", 0) == 0 and stats.get("failed_pages", 0) == 0
+
+def run_incremental_sync(full=False, lookback_days=None, **pipeline_kwargs):
+    """
+    Fetches only what changed since the last successful run.
+
+    The stored watermark (newest fully ingested publication date) minus a
+    lookback window becomes the fetch start date; unchanged documents in the
+    overlap are skipped by their content hash. The watermark only advances
+    when every API page was fetched and every batch and full text written,
+    so a failed run is retried next time. A document whose full text keeps
+    failing stops holding it back after FULL_TEXT_MAX_ATTEMPTS syncs.
+    With ``full=True`` (or no watermark yet) the whole range since
+    DEFAULT_START_DATE is re-synced.
+    """
+    lookback_days = int(lookback_days if lookback_days is not None else os.environ.get("SYNC_LOOKBACK_DAYS", DEFAULT_SYNC_LOOKBACK_DAYS))
+    with pooled_connection() as conn:
+        watermark = None if full else get_sync_watermark(conn)
+
+    if watermark:
+        start = datetime.strptime(watermark, '%Y-%m-%d') - timedelta(days=lookback_days)
+        start_date = max(start.strftime('%Y-%m-%d'), DEFAULT_START_DATE)
+        logger.info("Incremental sync from %s (watermark %s, lookback %d days)", start_date, watermark, lookback_days)
+    else:
+        start_date = DEFAULT_START_DATE
+        logger.info("Full sync from %s", start_date)
+
+    stats = run_streaming_pipeline(start_date=start_date, **pipeline_kwargs)
+
+    if _sync_complete(stats) and stats.get("max_publication_date"):
+        with pooled_connection() as conn:
+            set_sync_watermark(conn, stats["max_publication_date"])
+        logger.info("Sync watermark advanced to %s", stats['max_publication_date'])
+    elif not _sync_complete(stats):
+        logger.warning("Some pages, batches or full texts failed; sync watermark left unchanged so they are retried next run")
+    return stats
 
 
 # --- Main Execution Block ---
@@ -173,31 +1060,41 @@ if __name__ == "__main__":
     # This is important if DB credentials are ONLY in .env
     from dotenv import load_dotenv
     load_dotenv()
-    
-    conn = create_db_connection() # Uses the function defined in this file
-    
-    if conn:
-        print("Starting data pipeline to fetch Federal Register documents for 2025...")
-        # Fetch data for 2025 (Jan 1, 2025 up to current date in 2025)
-        raw_data = fetch_federal_register_data()
-        
-        if raw_data:
-            print(f"Fetched a total of {len(raw_data)} documents from the API.")
-            inserted_count = 0
-            for doc in raw_data:
-                if doc.get('document_number'): # Ensure there's a document number before processing
-                    processed_doc = process_document_data(doc)
-                    insert_document(conn, processed_doc)
-                    inserted_count +=1
-                else:
-                    print(f"Skipping document due to missing document_number: {doc.get('title', 'N/A')}")
-            print(f"Attempted to insert/update {inserted_count} documents.")
-        else:
-            print("No documents fetched from the API. Check API parameters or connection.")
-            
-        if conn.is_connected():
-            conn.close()
-            print("Pipeline database connection closed.")
-        print("Data pipeline finished.")
-    else:
-        print("Data pipeline could not connect to the database. Aborting.")
\ No newline at end of file
+    from app_logging import configure_logging, shutdown_logging
+    configure_logging()
+
+    parser = argparse.ArgumentParser(description="Sync Federal Register documents into MySQL.")
+    parser.add_argument("--full", action="store_true", help=f"Ignore the sync watermark and re-sync everything since {DEFAULT_START_DATE}.")
+    parser.add_argument("--no-full-text", action="store_true", help="Skip downloading and chunking full-text XML.")
+    parser.add_argument("--rebuild-stats", action="store_true", help="Recompute the document_stats aggregate tables before syncing.")
+    parser.add_argument("--build-replica", action="store_true", help="Rebuild the SQLite search replica after syncing, even if nothing changed.")
+    args = parser.parse_args()
+
+    try:
+        with pooled_connection() as conn:
+            ensure_schema(conn)
+            if args.rebuild_stats:
+                rebuild_document_stats(conn)
+    except (PoolError, Error) as err:
+        shutdown_logging()
+        print(f"Data pipeline could not prepare the database. Aborting. ({err})")
+        raise SystemExit(1)
+
+    print("Starting data pipeline to fetch Federal Register documents...")
+    # Incremental by default: only documents newer than the stored watermark
+    # (plus a short lookback) are fetched, and unchanged rows are not rewritten
+    stats = run_incremental_sync(full=args.full, full_text=not args.no_full_text)
+    if args.build_replica and stats["replica"] is None:
+        stats["replica"] = publish_search_replica()
+    shutdown_logging() # Flush queued log records before the summary
+    if stats["failed_pages"]:
+        print(f"{stats['failed_pages']} API pages could not be fetched; the sync watermark was not advanced.")
+    print(f"Processed {stats['rows']} documents in {stats['batches']} batches "
+          f"({stats['seconds']}s, {stats['rows_per_sec']} rows/sec): {stats['written']} written, "
+          f"{stats['unchanged']} unchanged, {stats['failed_rows']} rows in {stats['failed_batches']} failed batches; "
+          f"{stats['chunks']} full-text chunks stored ({stats['failed_full_text']} documents failed, "
+          f"{stats['abandoned_full_text']} given up on).")
+    if stats["replica"]:
+        print(f"Search replica published with {stats['replica']['federal_documents']} documents "
+              f"in {stats['replica']['seconds']}s.")
+    print("Data pipeline finished.")
@@ -0,0 +1,317 @@
+# db_pool.py
+
+import logging
+import os # For reading environment variables
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import Error
+
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# --- Database Connection Function ---
+# This is the single place that knows how to open a raw MySQL connection.
+# agent_tools.py and data_pipeline.py used to carry their own copies of it;
+# both now go through the shared pool below instead.
+def create_db_connection():
+    """
+    Creates a database connection using credentials from environment variables.
+    Returns the connection object or None if connection fails.
+    """
+    # Provide defaults for host and port if not set in .env
+    db_host = os.environ.get("DB_HOST", "localhost")
+    db_name = os.environ.get("DB_NAME")
+    db_user = os.environ.get("DB_USER")
+    db_password = os.environ.get("DB_PASSWORD")
+    db_port = os.environ.get("DB_PORT", "3306") # Default MySQL port
+
+    # Basic check if essential variables were loaded
+    if not all([db_host, db_name, db_user]): # db_password can be empty for some local setups
+        logger.critical("DB_HOST, DB_NAME, or DB_USER not found in environment variables. Check .env file and ensure main.py loads it.")
+        return None
+
+    try:
+        logger.debug("Opening new DB connection: mysql://%s@%s:%s/%s", db_user, db_host, db_port, db_name)
+        return mysql.connector.connect(
+            host=db_host,
+            port=int(db_port),    # Ensure port is an integer
+            database=db_name,
+            user=db_user,
+            password=db_password
+        )
+    except ValueError as verr: # Handles error if DB_PORT is not a valid number
+        logger.error("DB_PORT %r is not a valid integer: %s", db_port, verr)
+        return None
+    except Error as err:
+        # Log connection details attempted (excluding password for security in logs)
+        logger.error("Error connecting to DB: %s (host=%s, port=%s, user=%s, database=%s)", err, db_host, db_port, db_user, db_name)
+        return None
+    except Exception:
+        logger.exception("Unexpected error in create_db_connection")
+        return None
+
+
+# --- Pool Errors ---
+class PoolError(Exception):
+    """Raised when the pool cannot hand out a usable connection."""
+
+
+class PoolTimeoutError(PoolError):
+    """Raised when no connection became available within the checkout timeout."""
+
+
+# --- Connection Pool ---
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of MySQL connections.
+
+    Connections are opened lazily up to ``max_size``. Idle connections are
+    kept on a LIFO stack so the most recently used (and therefore warmest)
+    connection is handed out first, while connections that sat idle longer
+    than ``max_idle_seconds`` or lived longer than ``max_lifetime_seconds``
+    are closed and replaced. A connection that has not been used for
+    ``health_check_after_seconds`` is pinged before it is handed out.
+    """
+
+    def __init__(self, connect_fn=create_db_connection, max_size=10, checkout_timeout=5.0,
+                 max_idle_seconds=300.0, max_lifetime_seconds=3600.0, health_check_after_seconds=30.0):
+        self._connect_fn = connect_fn
+        self.max_size = max(1, int(max_size))
+        self.checkout_timeout = checkout_timeout
+        self.max_idle_seconds = max_idle_seconds
+        self.max_lifetime_seconds = max_lifetime_seconds
+        self.health_check_after_seconds = health_check_after_seconds
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = deque() # Entries are [connection, created_at, last_used_at]
+        self._created_at = {} # id(connection) -> creation timestamp, for checked-out connections
+        self._size = 0 # Open connections, idle + checked out
+        self._closed = False
+
+        # Counters exposed through stats()
+        self._metrics = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "connect_failures": 0,
+            "checkouts": 0,
+            "checkout_timeouts": 0,
+            "health_check_failures": 0,
+            "recycled_idle": 0,
+            "recycled_lifetime": 0,
+            "discarded": 0,
+            "wait_seconds_total": 0.0,
+        }
+
+    # --- Checkout / Return ---
+    def acquire(self, timeout=None):
+        """
+        Checks out a connection, waiting up to ``timeout`` seconds (defaults to
+        the pool's checkout timeout) for one to become available.
+
+        Raises:
+            PoolTimeoutError: If the pool stayed exhausted for the whole timeout.
+            PoolError: If the pool is closed or a new connection could not be opened.
+        """
+        timeout = self.checkout_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            with self._available:
+                idle = self._checkout_idle_locked(started, deadline, timeout)
+            if idle is None:
+                break # A slot was reserved for a new connection
+            conn, created_at, needs_ping = idle
+            if not needs_ping:
+                return conn
+            # Ping outside the lock: a slow or dead server must not stall
+            # every other thread waiting for a connection. Until then the
+            # connection is neither idle nor checked out, but still counted
+            # in the pool size, so no one else can get it.
+            healthy = self._is_healthy(conn)
+            with self._available:
+                if healthy:
+                    self._checked_out_locked(conn, created_at, started)
+                    return conn
+                self._discard_locked(conn, "health_check_failures", close=False)
+                self._available.notify()
+            self._close_quietly(conn)
+
+        # Open the new connection outside the lock; the handshake is the slow part.
+        conn = self._connect_fn()
+        with self._available:
+            if conn is None:
+                self._size -= 1
+                self._metrics["connect_failures"] += 1
+                self._available.notify()
+                raise PoolError("Could not open a new database connection.")
+            self._metrics["connections_created"] += 1
+            self._checked_out_locked(conn, time.monotonic(), started)
+        return conn
+
+    def release(self, conn, discard=False):
+        """
+        Returns a connection to the pool. Pass ``discard=True`` when the
+        connection may be broken so it is closed instead of reused.
+        """
+        if conn is None:
+            return
+        if not discard:
+            try:
+                # End any implicit transaction so the next borrower does not
+                # read from a stale REPEATABLE READ snapshot.
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._available:
+            created_at = self._created_at.pop(id(conn), time.monotonic())
+            if discard or self._closed:
+                self._discard_locked(conn, "discarded" if discard else None)
+            else:
+                self._idle.append([conn, created_at, time.monotonic()])
+            self._available.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Context manager that checks out a connection and always returns it.
+        Connections that raised a database error are discarded rather than reused.
+        """
+        with span("db.connect"): # Pool wait plus, if needed, opening a connection
+            conn = self.acquire(timeout)
+        discard = False
+        try:
+            yield conn
+        except Error:
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    # --- Maintenance ---
+    def close(self):
+        """Closes every idle connection and refuses further checkouts."""
+        with self._available:
+            self._closed = True
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                self._discard_locked(conn, None)
+            self._available.notify_all()
+
+    def stats(self):
+        """Returns a snapshot of the pool's gauges and counters."""
+        with self._lock:
+            snapshot = dict(self._metrics)
+            snapshot.update({
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+            })
+        return snapshot
+
+    # --- Internal helpers (call with the lock held) ---
+    def _checkout_idle_locked(self, started, deadline, timeout):
+        """
+        Waits for an idle connection or a free slot. Returns (connection,
+        created_at, needs_ping) for an idle connection - already checked out
+        unless it needs a health check first - or None once a slot for a new
+        connection has been reserved.
+        """
+        while True:
+            if self._closed:
+                raise PoolError("Connection pool is closed.")
+
+            if self._idle:
+                conn, created_at, last_used = self._idle.pop()
+                now = time.monotonic()
+                if now - last_used > self.max_idle_seconds:
+                    self._discard_locked(conn, "recycled_idle")
+                    continue
+                if now - created_at > self.max_lifetime_seconds:
+                    self._discard_locked(conn, "recycled_lifetime")
+                    continue
+                if now - last_used > self.health_check_after_seconds:
+                    return conn, created_at, True
+                self._checked_out_locked(conn, created_at, started)
+                return conn, created_at, False
+
+            if self._size < self.max_size:
+                # Reserve the slot before releasing the lock to connect,
+                # so concurrent callers cannot overshoot max_size.
+                self._size += 1
+                return None
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._metrics["checkout_timeouts"] += 1
+                raise PoolTimeoutError(
+                    f"Timed out after {timeout:.1f}s waiting for a database connection "
+                    f"(pool size {self.max_size}, all in use)."
+                )
+            self._available.wait(remaining)
+
+    def _checked_out_locked(self, conn, created_at, started):
+        self._created_at[id(conn)] = created_at
+        self._metrics["checkouts"] += 1
+        self._metrics["wait_seconds_total"] += time.monotonic() - started
+
+    def _discard_locked(self, conn, reason, close=True):
+        self._size -= 1
+        if reason:
+            self._metrics[reason] += 1
+        self._metrics["connections_closed"] += 1
+        if close:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass # The connection is going away either way
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+
+# --- Shared Pool ---
+# One pool per process, configured from environment variables the first time
+# it is needed (after main.py / the pipeline have loaded .env).
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    max_size=int(os.environ.get("DB_POOL_SIZE", "10")),
+                    checkout_timeout=float(os.environ.get("DB_POOL_TIMEOUT", "5")),
+                    max_idle_seconds=float(os.environ.get("DB_POOL_MAX_IDLE", "300")),
+                    max_lifetime_seconds=float(os.environ.get("DB_POOL_RECYCLE", "3600")),
+                    health_check_after_seconds=float(os.environ.get("DB_POOL_PING_AFTER", "30")),
+                )
+    return _pool
+
+def pooled_connection(timeout=None):
+    """Shorthand for ``get_pool().connection(timeout)``."""
+    return get_pool().connection(timeout)
+
+def pool_stats():
+    """Returns metrics for the shared pool (empty if it was never created)."""
+    return _pool.stats() if _pool is not None else {}
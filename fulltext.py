@@ -0,0 +1,99 @@
+# fulltext.py
+
+import hashlib
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+
+# --- Disk Cache ---
+class FullTextCache:
+    """
+    Stores downloaded full-text XML files on disk, keyed by a hash of their
+    URL, so re-runs and retries never download the same document twice.
+    Files are written to a temporary name and renamed into place, so a crashed
+    download never leaves a truncated entry behind.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.environ.get("FULL_TEXT_CACHE_DIR", "fulltext_cache")
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, url):
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        # Two-level fan-out keeps directories small for a full year of documents
+        return os.path.join(self.directory, digest[:2], digest + ".xml")
+
+    def get(self, url):
+        """Returns the cached file path for ``url`` or None."""
+        path = self.path_for(url)
+        return path if os.path.exists(path) else None
+
+    def store(self, url, chunks):
+        """Writes an iterable of byte chunks for ``url`` atomically and returns the path."""
+        path = self.path_for(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+
+# --- Streaming XML Parsing ---
+# Block-level elements of the Federal Register document XML that carry prose.
+# Each one becomes a paragraph; table cells, footnote markers etc. are skipped.
+BLOCK_TAGS = {"HD", "P", "FP", "PSPACE", "LI", "NOTE", "SIG", "AMDPAR", "SECTNO", "SUBJECT"}
+
+def iter_paragraphs(xml_path):
+    """
+    Yields the text of each prose block in a full-text XML file, parsing it
+    incrementally with iterparse and clearing elements as they are consumed,
+    so memory stays flat even for very large rules.
+    """
+    depth = 0 # How many open block elements we are inside (nested blocks are emitted by their outermost one)
+    for event, elem in ET.iterparse(xml_path, events=("start", "end")):
+        if elem.tag not in BLOCK_TAGS:
+            if event == "end" and depth == 0:
+                elem.clear()
+            continue
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            text = " ".join("".join(elem.itertext()).split())
+            if text:
+                yield text
+            elem.clear()
+
+
+# --- Chunking ---
+def chunk_paragraphs(paragraphs, chunk_words=200, overlap_words=40):
+    """
+    Splits a stream of paragraphs into overlapping chunks of about
+    ``chunk_words`` words; consecutive chunks share ``overlap_words`` words so a
+    passage cut at a boundary is still found whole in one of them.
+
+    Yields:
+        dict: {"chunk_index": int, "content": str}
+    """
+    if overlap_words >= chunk_words:
+        raise ValueError("overlap_words must be smaller than chunk_words")
+    step = chunk_words - overlap_words
+    window = []
+    chunk_index = 0
+    for paragraph in paragraphs:
+        window.extend(paragraph.split())
+        while len(window) >= chunk_words:
+            yield {"chunk_index": chunk_index, "content": " ".join(window[:chunk_words])}
+            chunk_index += 1
+            window = window[step:]
+    # Emit the tail unless it is entirely contained in the previous chunk
+    if window and (chunk_index == 0 or len(window) > overlap_words):
+        yield {"chunk_index": chunk_index, "content": " ".join(window)}
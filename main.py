@@ -4,16 +4,76 @@
 from dotenv import load_dotenv
 load_dotenv()
 
+# Structured, queued logging for every module (see app_logging.py)
+from app_logging import configure_logging
+configure_logging()
+
+import asyncio
+import json
+import logging
+import time
 from fastapi import FastAPI, Form
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 import uvicorn # Keep uvicorn import if you plan to run from here, though running via terminal is standard
 
-# Import the run_conversation function from your separate agent.py file
-from agent import run_conversation
+# Import the async conversation function from your separate agent.py file.
+# It awaits OpenAI and offloads tool calls to a thread pool, so this worker
+# keeps serving other requests while one chat waits on the LLM or the DB.
+from agent import run_conversation_async, stream_conversation, response_cache, SYSTEM_PROMPT, _run_blocking
+from agent_tools import search_cache
+from sessions import create_session_store, new_session_id, compact_history
+from db_pool import pool_stats
+from telemetry import trace, span, record_span, summarize_trace, register_collector, render_metrics
 
 # Create the FastAPI application instance
 # This must be at the top level of the script for Uvicorn to find it
 app = FastAPI()
+logger = logging.getLogger(__name__)
+
+# Conversations are kept server-side, keyed by a session id the browser sends
+# back with each message, so follow-up questions have context. The store may
+# be a database, so the endpoints call these helpers through _run_blocking.
+session_store = create_session_store()
+
+def _load_session(session_id):
+    """Returns (session_id, history) for a known session, or a fresh session."""
+    history = session_store.get(session_id) if session_id else None
+    if history is None:
+        return new_session_id(), [{"role": "system", "content": SYSTEM_PROMPT}]
+    return session_id, history
+
+def _save_session(session_id, history):
+    session_store.save(session_id, compact_history(history))
+
+# --- Metrics Collectors ---
+# Values owned by other components, read when /metrics is scraped
+def _collect_pool_metrics():
+    stats = pool_stats()
+    if not stats:
+        return []
+    gauges = [("size", "Open connections"), ("idle", "Idle connections"), ("in_use", "Checked-out connections"), ("max_size", "Pool size limit")]
+    counters = [key for key in stats if key not in dict(gauges)]
+    return (
+        [(f"rag_db_pool_{key}", "gauge", help_text, [({}, stats[key])]) for key, help_text in gauges]
+        + [(f"rag_db_pool_{key}" + ("" if key.endswith("_total") else "_total"), "counter", f"Pool counter {key}", [({}, stats[key])]) for key in counters]
+    )
+
+def _collect_cache_metrics():
+    metrics = []
+    for cache_name, cache in (("response", response_cache), ("search", search_cache)):
+        if cache is None:
+            continue
+        for key, value in cache.stats().items():
+            if key == "hit_rate":
+                metrics.append((f"rag_{cache_name}_cache_hit_rate", "gauge", f"{cache_name} cache hit rate", [({}, value)]))
+            elif key == "latency_saved_seconds":
+                metrics.append((f"rag_{cache_name}_cache_latency_saved_seconds_total", "counter", "Time saved by cache hits", [({}, value)]))
+            else:
+                metrics.append((f"rag_{cache_name}_cache_{key}_total", "counter", f"{cache_name} cache {key}", [({}, value)]))
+    return metrics
+
+register_collector(_collect_pool_metrics)
+register_collector(_collect_cache_metrics)
 
 # --- Basic HTML for the UI ---
 # This multi-line string contains the HTML, CSS, and JavaScript for the chat interface.
@@ -85,6 +145,8 @@ html_content = """
     </div>
 
     <script>
+        let sessionId = null; // Assigned by the server on the first message
+
         async function sendMessage() {
             const userInput = document.getElementById('user_input');
             const chatbox = document.getElementById('chatbox');
@@ -109,31 +171,68 @@ html_content = """
             chatbox.scrollTop = chatbox.scrollHeight; // Scroll to the bottom
 
 
-            // Send query to FastAPI backend using the /chat endpoint
+            // Send query to FastAPI backend using the streaming /chat/stream endpoint.
+            // The answer is rendered token by token as Server-Sent Events arrive.
+            let agentMessageDiv = null;
+            let answer = '';
             try {
-                const response = await fetch('/chat', {
+                const response = await fetch('/chat/stream', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/x-www-form-urlencoded', // Form data format
                     },
-                    body: new URLSearchParams({ 'query': query }) // Send query as form data
+                    // Send query (and the session, once we have one) as form data
+                    body: new URLSearchParams(sessionId ? { 'query': query, 'session_id': sessionId } : { 'query': query })
                 });
 
-                // Remove the "Thinking..." message
-                chatbox.removeChild(thinkingMessageDiv);
-
-
                 if (!response.ok) {
                      throw new Error(`HTTP error! status: ${response.status}`);
                 }
 
-                const data = await response.json(); // Assuming backend returns JSON like {"response": "..."}
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+
+                    // SSE events are separated by a blank line
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                        const rawEvent = buffer.slice(0, boundary);
+                        buffer = buffer.slice(boundary + 2);
+                        if (!rawEvent.startsWith('data: ')) continue;
+                        const event = JSON.parse(rawEvent.slice(6));
 
-                // Display agent response
-                const agentMessageDiv = document.createElement('div');
-                agentMessageDiv.classList.add('message', 'agent');
-                agentMessageDiv.textContent = 'Agent: ' + data.response; // Access the response field
-                chatbox.appendChild(agentMessageDiv);
+                        if (event.type === 'session') {
+                            sessionId = event.session_id;
+                        } else if (event.type === 'tool_call') {
+                            thinkingMessageDiv.textContent = 'Agent: Searching (' + event.name + ')...';
+                        } else if (event.type === 'tool_result') {
+                            thinkingMessageDiv.textContent = 'Agent: Found ' + event.results + ' result(s), writing answer...';
+                        } else if (event.type === 'delta') {
+                            if (!agentMessageDiv) {
+                                // First token: replace the "Thinking..." message with the answer
+                                chatbox.removeChild(thinkingMessageDiv);
+                                agentMessageDiv = document.createElement('div');
+                                agentMessageDiv.classList.add('message', 'agent');
+                                chatbox.appendChild(agentMessageDiv);
+                            }
+                            answer += event.content;
+                            agentMessageDiv.textContent = 'Agent: ' + answer;
+                            chatbox.scrollTop = chatbox.scrollHeight;
+                        } else if (event.type === 'error') {
+                            throw new Error(event.message);
+                        }
+                    }
+                }
+
+                // Remove the "Thinking..." message if no token ever arrived
+                if (!agentMessageDiv && thinkingMessageDiv.parentNode) {
+                    chatbox.removeChild(thinkingMessageDiv);
+                }
 
             } catch (error) {
                 // Remove the "Thinking..." message if it's still there
@@ -171,21 +270,95 @@ async def get_ui():
     return html_content
 
 @app.post("/chat")
-async def chat_with_agent(query: str = Form(...)):
+async def chat_with_agent(query: str = Form(...), session_id: str = Form(None)):
     """
     Receives user query via POST request and sends it to the agent.
-    Returns the agent's response.
+    Returns the agent's response and the session id to send with the next message.
     """
-    print(f"Received query: {query}") # Optional: Log received query
+    # Only sizes are logged at INFO; the text itself may contain personal data
+    logger.info("Received query", extra={"query_chars": len(query), "session_id": session_id})
+    logger.debug("Query text: %s", query)
 
-    # Call the run_conversation function from your agent.py
+    # Call the async conversation function from your agent.py
     # This is where the user query is passed to the LLM and tools are used.
-    agent_response = run_conversation(query)
+    # Everything below is traced: LLM calls, tool rounds, DB connect/execute/
+    # fetch/serialize, so a slow request shows where its time went.
+    with trace() as spans:
+        with span("request", endpoint="/chat"):
+            session_id, history = await _run_blocking(_load_session, session_id)
+            result = await run_conversation_async(query, history, return_details=True)
+            await _run_blocking(_save_session, session_id, history)
+    agent_response = result["response"]
+    timings = summarize_trace(spans)
+
+    logger.debug("Agent response: %s", agent_response)
+    logger.info("Request trace", extra={"endpoint": "/chat", "timings_ms": timings})
+
+    # Return the agent's response as JSON, with per-step timings of the agent loop
+    return {
+        "response": agent_response,
+        "steps": result["steps"],
+        "total_ms": result["total_ms"],
+        "stop_reason": result["stop_reason"],
+        "cache": result["cache"],
+        "session_id": session_id,
+        "timings_ms": timings, # Total milliseconds per traced stage
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latency histograms, token and error counters, pool and cache stats."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    Cache metrics: the response cache (lookups, hits by match type, hit rate,
+    latency saved) and the search result cache (hits, misses, coalesced calls).
+    """
+    return {
+        "responses": dict(response_cache.stats(), enabled=True) if response_cache is not None else {"enabled": False},
+        "search_results": dict(search_cache.stats(), enabled=True) if search_cache is not None else {"enabled": False},
+    }
+
+@app.post("/chat/stream")
+async def chat_with_agent_stream(query: str = Form(...), session_id: str = Form(None)):
+    """
+    Streams the conversation as Server-Sent Events: a "session" event with
+    the session id first, then tool progress events, then answer tokens as
+    the model produces them.
+    """
+    logger.info("Received streaming query", extra={"query_chars": len(query), "session_id": session_id})
+    session_id, history = await _run_blocking(_load_session, session_id)
 
-    print(f"Agent response: {agent_response}") # Optional: Log agent response
+    async def event_stream():
+        # A span cannot stay open across yields, so the request is timed by hand
+        started = time.perf_counter()
+        saved = False
+        try:
+            yield f"data: {json.dumps({'type': 'session', 'session_id': session_id})}\n\n"
+            async for event in stream_conversation(query, history):
+                if event["type"] == "done":
+                    # Saved before the last event goes out, so a client that disconnects now keeps its turn
+                    await _run_blocking(_save_session, session_id, history)
+                    saved = True
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            try:
+                if not saved:
+                    # Disconnected or failed mid-turn: keep at least the question (compaction drops
+                    # unfinished tool traffic). Shielded: on a disconnect this generator is being
+                    # cancelled, and the save must still run to completion.
+                    await asyncio.shield(_run_blocking(_save_session, session_id, history))
+            finally:
+                record_span("request", time.perf_counter() - started, endpoint="/chat/stream")
 
-    # Return the agent's response as JSON
-    return {"response": agent_response}
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # --- How to Run the FastAPI App ---
 # To run this application, save the code as main.py and run the command:
@@ -0,0 +1,340 @@
+# query_router.py
+#
+# Deterministic fast path for first questions. Most traffic is a plain
+# search ("EPA rules on pesticides from last week") whose tool arguments are
+# obvious, yet the agent spends a whole LLM round trip just to have the model
+# write them. route_query() parses the question locally: agency names (from
+# the ingested agencies table), date ranges and keywords. When it is
+# confident it returns the search_federal_documents call to run directly;
+# otherwise None, and the model decides as before.
+
+import calendar
+import logging
+import os
+import re
+import threading
+import time
+from datetime import date, timedelta
+
+from caching import current_data_generation
+from telemetry import counter
+
+logger = logging.getLogger(__name__)
+
+ROUTER_ENABLED = os.environ.get("QUERY_ROUTER", "on").lower() not in ("0", "off", "false", "no")
+# A route needs at least two of the three signals below to reach the default
+ROUTER_MIN_CONFIDENCE = float(os.environ.get("ROUTER_MIN_CONFIDENCE", "0.6"))
+AGENCY_CATALOG_TTL = float(os.environ.get("ROUTER_AGENCY_TTL", "600"))
+
+AGENCY_WEIGHT = 0.4
+DATE_WEIGHT = 0.3
+KEYWORDS_WEIGHT = 0.3
+MAX_KEYWORDS = 5 # More than this reads like a description, not a search
+MAX_QUERY_WORDS = 25
+
+ROUTER_DECISIONS = counter("rag_router_decisions_total", "Fast-path router decisions (routed/fallback).")
+
+# Questions the search tool cannot answer by itself; the model handles them
+COMPLEX_MARKERS = re.compile(
+    r"\b(how many|count|number of|compare|comparison|versus|vs\.?|difference|differ|why|explain|"
+    r"summari[sz]e|trend|each|per|most|least|average|earlier|above|that one|those)\b",
+    re.IGNORECASE,
+)
+STOP_WORDS = {
+    "a", "about", "all", "an", "and", "any", "are", "as", "at", "be", "by", "can", "could", "did", "do", "does",
+    "find", "for", "from", "get", "give", "has", "have", "i", "in", "is", "it", "its", "know", "list", "look", "may", "me", "need", "of",
+    "on", "or", "please", "regarding", "related", "search", "see", "show", "some", "tell", "that", "the", "their", "there", "to",
+    "up", "was", "were", "what", "when", "where", "which", "want", "who", "with", "would", "you", "concerning", "since", "between", "during", "until", "before", "after", "through",
+}
+# Words that describe the corpus itself rather than a topic
+GENERIC_WORDS = {
+    "document", "documents", "rule", "rules", "notice", "notices", "regulation", "regulations", "publication",
+    "publications", "publish", "published", "issue", "issued", "federal", "register", "recent", "recently",
+    "latest", "new", "agency", "agencies", "department",
+}
+# Small talk. Without an agency, a question needs a keyword outside these
+# lists to count as a search ("how are you doing today" is not one)
+CONVERSATION_WORDS = {
+    "also", "am", "anything", "been", "being", "bye", "cool", "day", "doing", "done", "evening", "everything", "fine",
+    "going", "good", "goodbye", "great", "hello", "help", "helped", "helpful", "helps", "her", "here", "hey", "hi",
+    "him", "his", "how", "hows", "if", "im", "just", "let", "lets", "morning", "my", "nice", "no", "not", "nothing",
+    "now", "ok", "okay", "our", "she", "should", "so", "something", "sure", "thank", "thanks", "then", "these", "they",
+    "thing", "things", "this", "those", "too", "us", "very", "we", "well", "whats", "will", "yeah", "yes", "your",
+    "youre",
+}
+ACRONYM_SKIP = {"of", "and", "the", "for", "on", "in", "to", "&"}
+
+MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+# Abbreviations, and "may" (usually a verb), are only dates with a day or a year next to them
+SHORT_MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_abbr) if name}
+SHORT_MONTHS.update({"sept": 9, "may": 5})
+MONTHS.update(SHORT_MONTHS)
+_MONTH_NAMES = "|".join(sorted(MONTHS, key=len, reverse=True))
+_ISO = r"(\d{4}-\d{2}-\d{2})"
+
+def _normalize(text):
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+
+# --- Agency Catalog ---
+class AgencyCatalog:
+    """
+    Agency names from the agencies table, indexed for matching inside free
+    text: full names, "Department of X" for names listed as "X Department",
+    and acronyms of multi-word names. Reloaded after AGENCY_CATALOG_TTL
+    seconds or when the pipeline bumps the data generation.
+    """
+
+    def __init__(self, loader=None, ttl_seconds=AGENCY_CATALOG_TTL):
+        self.loader = loader or _load_agency_names
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._generation = None
+        self.phrases = {} # normalized phrase -> agency name
+        self.acronyms = {} # ACRONYM -> set of agency names
+
+    def refresh_if_stale(self):
+        generation = current_data_generation()
+        with self._lock:
+            if (self._loaded_at is not None and generation == self._generation
+                    and time.monotonic() - self._loaded_at < self.ttl_seconds):
+                return
+            try:
+                names = self.loader()
+            except Exception:
+                logger.exception("Could not load agency names for the query router")
+                names = None
+            self._loaded_at = time.monotonic()
+            self._generation = generation
+            if names is not None:
+                self._index(names)
+
+    def _index(self, names):
+        phrases, acronyms = {}, {}
+        for name in names:
+            normalized = _normalize(name)
+            if not normalized:
+                continue
+            phrases[normalized] = name
+            words = normalized.split()
+            if len(words) >= 2 and words[-1] == "department":
+                phrases["department of " + " ".join(words[:-1])] = name
+            initials = [word[0] for word in words if word not in ACRONYM_SKIP]
+            if len(initials) >= 2:
+                acronyms.setdefault("".join(initials).upper(), set()).add(name)
+        self.phrases, self.acronyms = phrases, acronyms
+        logger.debug("Query router knows %d agencies", len(names))
+
+    def match(self, text):
+        """Returns (agency names found in ``text``, spans of the matched text to drop from keywords)."""
+        padded = f" {_normalize(text)} "
+        found = {}
+        for phrase, name in self.phrases.items():
+            if f" {phrase} " in padded:
+                found[phrase] = name
+        # A phrase inside a longer matched phrase ("Energy" in "Federal Energy ...") is not a match of its own
+        names, spans = set(), []
+        for phrase, name in found.items():
+            if not any(phrase != other and f" {phrase} " in f" {other} " for other in found):
+                names.add(name)
+                spans.append(phrase)
+        for token in re.findall(r"\b[A-Z]{2,6}\b", text): # Acronyms only count when written in capitals
+            candidates = self.acronyms.get(token)
+            if candidates:
+                names.add(frozenset(candidates) if len(candidates) > 1 else next(iter(candidates)))
+                spans.append(token.lower())
+        return names, spans
+
+def _load_agency_names():
+    # Imported here: agent_tools pulls in the database drivers
+    from agent_tools import tool_connection, _dict_cursor
+    with tool_connection() as conn:
+        cursor = _dict_cursor(conn)
+        try:
+            cursor.execute("SELECT name FROM agencies")
+            return [row["name"] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+agency_catalog = AgencyCatalog()
+
+
+# --- Date Ranges ---
+def _month_range(year, month):
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+def _shift_months(day, months):
+    month_index = day.year * 12 + day.month - 1 - months
+    year, month = divmod(month_index, 12)
+    return date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+def _relative_range(unit, amount, today):
+    if unit.startswith("day"):
+        return today - timedelta(days=amount), today
+    if unit.startswith("week"):
+        return today - timedelta(weeks=amount), today
+    if unit.startswith("month"):
+        return _shift_months(today, amount), today
+    return date(today.year - amount, today.month, min(today.day, 28)), today
+
+def _named_range(phrase, today):
+    monday = today - timedelta(days=today.weekday())
+    first_of_month = today.replace(day=1)
+    previous_month_end = first_of_month - timedelta(days=1)
+    return {
+        "today": (today, today),
+        "yesterday": (today - timedelta(days=1),) * 2,
+        "this week": (monday, today),
+        "last week": (monday - timedelta(days=7), monday - timedelta(days=1)),
+        "past week": (today - timedelta(days=7), today),
+        "this month": (first_of_month, today),
+        "last month": (previous_month_end.replace(day=1), previous_month_end),
+        "past month": (_shift_months(today, 1), today),
+        "this year": (date(today.year, 1, 1), today),
+        "last year": (date(today.year - 1, 1, 1), date(today.year - 1, 12, 31)),
+        "past year": (_shift_months(today, 12), today),
+    }[phrase]
+
+_NAMED_RE = re.compile(r"\b(today|yesterday|(?:this|last|past) (?:week|month|year))\b", re.IGNORECASE)
+_RELATIVE_RE = re.compile(r"\b(?:last|past|previous) (\d{1,3}) (days?|weeks?|months?|years?)\b", re.IGNORECASE)
+_BETWEEN_RE = re.compile(rf"\b(?:between|from) {_ISO} (?:and|to|until|through) {_ISO}\b", re.IGNORECASE)
+_SINCE_ISO_RE = re.compile(rf"\b(since|after|from|before|until|on) {_ISO}\b", re.IGNORECASE)
+# "March 2025", "in March", "since Sept 2024", "on Mar 5"; a month needs a day, a
+# year or a leading preposition, an abbreviation a day or a year
+_MONTH_RE = re.compile(
+    rf"\b(?:(in|during|for|of|since|from|before|until|on) )?({_MONTH_NAMES})\.?"
+    rf"(?: (\d{{1,2}})(?:st|nd|rd|th)?\b)?(?:,? (\d{{4}}))?\b", re.IGNORECASE
+)
+_YEAR_RE = re.compile(r"\b(in|during|for|since|from|before|until) (\d{4})\b", re.IGNORECASE)
+
+def parse_date_range(text, today=None):
+    """
+    Returns (start_date, end_date, matched_text) for the first date range
+    found in ``text`` (ISO strings; either bound may be None), or (None,
+    None, None).
+    """
+    today = today or date.today()
+    match = _BETWEEN_RE.search(text)
+    if match:
+        return match.group(1), match.group(2), match.group(0)
+    match = _SINCE_ISO_RE.search(text)
+    if match:
+        word, day = match.group(1).lower(), match.group(2)
+        if word == "on":
+            return day, day, match.group(0)
+        return (day, None, match.group(0)) if word in ("since", "after", "from") else (None, day, match.group(0))
+    match = _RELATIVE_RE.search(text)
+    if match:
+        start, end = _relative_range(match.group(2).lower(), int(match.group(1)), today)
+        return start.isoformat(), end.isoformat(), match.group(0)
+    match = _NAMED_RE.search(text)
+    if match:
+        start, end = _named_range(match.group(1).lower(), today)
+        return start.isoformat(), end.isoformat(), match.group(0)
+    for match in _MONTH_RE.finditer(text):
+        preposition, month_name, day, year = match.group(1), match.group(2).lower(), match.group(3), match.group(4)
+        if not day and not year and (not preposition or month_name in SHORT_MONTHS):
+            continue
+        month = MONTHS[month_name]
+        preposition = (preposition or "").lower()
+        if day:
+            if year:
+                year = int(year)
+            else: # The most recent such day
+                year = today.year if (month, int(day)) <= (today.month, today.day) else today.year - 1
+            if int(day) > calendar.monthrange(year, month)[1]:
+                continue
+            start = end = date(year, month, int(day))
+        else:
+            if year:
+                year = int(year)
+            else: # The most recent such month
+                year = today.year if month <= today.month else today.year - 1
+            start, end = _month_range(year, month)
+        if preposition in ("since", "from"):
+            return start.isoformat(), None, match.group(0)
+        if preposition in ("before", "until"):
+            return None, (start - timedelta(days=1)).isoformat(), match.group(0)
+        return start.isoformat(), end.isoformat(), match.group(0)
+    match = _YEAR_RE.search(text)
+    if match:
+        preposition, year = match.group(1).lower(), int(match.group(2))
+        if preposition in ("since", "from"):
+            return date(year, 1, 1).isoformat(), None, match.group(0)
+        if preposition in ("before", "until"):
+            return None, date(year - 1, 12, 31).isoformat(), match.group(0)
+        return date(year, 1, 1).isoformat(), date(year, 12, 31).isoformat(), match.group(0)
+    return None, None, None
+
+
+# --- Routing ---
+def _keywords(text, removed_spans):
+    normalized = f" {_normalize(text)} "
+    for span_text in removed_spans:
+        normalized = normalized.replace(f" {_normalize(span_text)} ", " ")
+    keywords = []
+    for word in normalized.split():
+        if (word in STOP_WORDS or word in GENERIC_WORDS or word in CONVERSATION_WORDS or word.isdigit()
+                or len(word) < 2 or word in keywords):
+            continue
+        keywords.append(word)
+    return keywords
+
+def parse_query(text, catalog=None, today=None):
+    """
+    Extracts search arguments from a question. Returns a dict with the
+    search_federal_documents arguments found ("agency", "start_date",
+    "end_date", "query"), plus "confidence" (0..1) and "reasons" (why a
+    route would be unsafe, if any). A date alone is not a search: without
+    an agency or a topic keyword the question is left to the model.
+    """
+    catalog = catalog or agency_catalog
+    parsed = {"confidence": 0.0, "reasons": []}
+    if COMPLEX_MARKERS.search(text):
+        parsed["reasons"].append("complex")
+    if len(text.split()) > MAX_QUERY_WORDS:
+        parsed["reasons"].append("long")
+
+    catalog.refresh_if_stale()
+    agencies, removed = catalog.match(text)
+    if len(agencies) == 1 and isinstance(next(iter(agencies)), str):
+        parsed["agency"] = next(iter(agencies))
+        parsed["confidence"] += AGENCY_WEIGHT
+    elif agencies:
+        parsed["reasons"].append("ambiguous_agency") # Several agencies, or an acronym shared by several
+
+    start_date, end_date, date_text = parse_date_range(text, today)
+    if date_text:
+        removed.append(date_text)
+        parsed["start_date"], parsed["end_date"] = start_date, end_date
+        parsed["confidence"] += DATE_WEIGHT
+
+    keywords = _keywords(text, removed)
+    if keywords:
+        parsed["query"] = " ".join(keywords[:MAX_KEYWORDS])
+        if len(keywords) <= MAX_KEYWORDS:
+            parsed["confidence"] += KEYWORDS_WEIGHT
+        else:
+            parsed["reasons"].append("many_keywords")
+    if not keywords and "agency" not in parsed:
+        parsed["reasons"].append("no_topic")
+    parsed["confidence"] = round(parsed["confidence"], 2)
+    return parsed
+
+def route_query(text, catalog=None, today=None):
+    """
+    Returns {"name": "search_federal_documents", "arguments": {...},
+    "confidence": ...} when ``text`` can be answered by one search with
+    locally parsed arguments, or None to let the model plan the tool calls.
+    """
+    if not ROUTER_ENABLED or not text or not text.strip():
+        return None
+    parsed = parse_query(text, catalog, today)
+    if parsed["reasons"] or parsed["confidence"] < ROUTER_MIN_CONFIDENCE:
+        ROUTER_DECISIONS.inc(outcome="fallback")
+        logger.debug("Router fell back (confidence %.2f, reasons %s)", parsed["confidence"], parsed["reasons"])
+        return None
+    arguments = {key: parsed[key] for key in ("query", "agency", "start_date", "end_date") if parsed.get(key)}
+    ROUTER_DECISIONS.inc(outcome="routed")
+    return {"name": "search_federal_documents", "arguments": arguments, "confidence": parsed["confidence"]}
@@ -0,0 +1,243 @@
+# replica.py
+#
+# Embedded, read-only SQLite copy of the tables the agent tools read
+# (documents, agencies and their links, full-text chunks and the stats
+# tables), with FTS5 indexes standing in for MySQL's FULLTEXT indexes.
+#
+# The pipeline builds a new file next to the live one after each ingest and
+# swaps it in with os.replace(), which is atomic: readers see either the old
+# or the new replica, never a half-written one. API workers select it with
+# SEARCH_BACKEND=replica and then search in-process, without a network round
+# trip to MySQL; connections notice the swap and reopen on their next use.
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+REPLICA_PATH = "search_replica.sqlite3"
+
+# Same tables and columns as the MySQL schema in data_pipeline.py. The FTS5
+# tables are contentless (content='') and keyed by the rowid of the table
+# they index; their columns are prefixed so joins stay unambiguous.
+REPLICA_SCHEMA = """
+CREATE TABLE federal_documents (
+    document_number TEXT NOT NULL PRIMARY KEY,
+    title TEXT,
+    agency TEXT,
+    publication_date TEXT,
+    document_url TEXT,
+    content TEXT,
+    document_type TEXT COLLATE NOCASE
+);
+CREATE INDEX idx_publication_date ON federal_documents (publication_date, document_number);
+CREATE TABLE agencies (
+    agency_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL COLLATE NOCASE UNIQUE
+);
+CREATE TABLE document_agencies (
+    document_number TEXT NOT NULL,
+    agency_id INTEGER NOT NULL,
+    publication_date TEXT,
+    PRIMARY KEY (document_number, agency_id)
+) WITHOUT ROWID;
+CREATE INDEX idx_agency_date ON document_agencies (agency_id, publication_date);
+CREATE TABLE document_chunks (
+    document_number TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (document_number, chunk_index)
+);
+CREATE TABLE stats_month_type (
+    month TEXT NOT NULL,
+    document_type TEXT NOT NULL COLLATE NOCASE,
+    documents INTEGER NOT NULL,
+    PRIMARY KEY (month, document_type)
+);
+CREATE TABLE stats_agency_month_type (
+    agency_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    document_type TEXT NOT NULL COLLATE NOCASE,
+    documents INTEGER NOT NULL,
+    PRIMARY KEY (agency_id, month, document_type)
+);
+CREATE VIRTUAL TABLE documents_fts USING fts5(fts_title, fts_content, content='');
+CREATE VIRTUAL TABLE chunks_fts USING fts5(fts_content, content='');
+"""
+
+# MySQL table -> columns copied by build_replica()
+COPIED_TABLES = {
+    "federal_documents": ("document_number", "title", "agency", "publication_date", "document_url", "content", "document_type"),
+    "agencies": ("agency_id", "name"),
+    "document_agencies": ("document_number", "agency_id", "publication_date"),
+    "document_chunks": ("document_number", "chunk_index", "content"),
+}
+
+
+class ReplicaUnavailable(Exception):
+    """Raised when the replica file does not exist (the pipeline has not built one yet)."""
+
+
+def get_replica_path():
+    return os.environ.get("SEARCH_REPLICA_PATH", REPLICA_PATH)
+
+def _sqlite_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()[:10]
+    return value
+
+
+class ReplicaWriter:
+    """
+    Writes a new replica into ``path + ".tmp"`` and publishes it over
+    ``path`` in one atomic rename. Rows come either from MySQL
+    (build_replica) or straight from processed documents (add_documents),
+    which is how tests and benchmarks get a replica without a MySQL server.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_replica_path()
+        self.tmp_path = self.path + ".tmp"
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path) # Left over from an interrupted build
+        self.conn = sqlite3.connect(self.tmp_path)
+        # Nothing reads the file before publish(), so skip journaling and fsyncs
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.executescript(REPLICA_SCHEMA)
+
+    def copy_rows(self, table, columns, rows):
+        """Inserts an iterable of row tuples into ``table``; returns the row count."""
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(tuple(_sqlite_value(value) for value in row))
+            if len(batch) >= 2000:
+                self.conn.executemany(sql, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.conn.executemany(sql, batch)
+            count += len(batch)
+        return count
+
+    def add_documents(self, documents):
+        """Inserts processed documents (see data_pipeline.process_document_data) with their agency links."""
+        count = 0
+        for doc in documents:
+            number = doc["document_number"]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO federal_documents VALUES (?, ?, ?, ?, ?, ?, ?)",
+                tuple(_sqlite_value(doc.get(column)) for column in COPIED_TABLES["federal_documents"])
+            )
+            for name in doc.get("agency_names") or []:
+                self.conn.execute("INSERT OR IGNORE INTO agencies (name) VALUES (?)", (name,))
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO document_agencies SELECT ?, agency_id, ? FROM agencies WHERE name = ?",
+                    (number, _sqlite_value(doc.get("publication_date")), name)
+                )
+            count += 1
+        return count
+
+    def publish(self):
+        """Builds the FTS and stats tables, then atomically replaces the live replica; returns row counts."""
+        conn = self.conn
+        conn.execute("INSERT INTO documents_fts (rowid, fts_title, fts_content) SELECT rowid, title, content FROM federal_documents")
+        conn.execute("INSERT INTO chunks_fts (rowid, fts_content) SELECT rowid, content FROM document_chunks")
+        # Same aggregates data_pipeline keeps in MySQL, recomputed in one pass
+        conn.execute(
+            "INSERT INTO stats_month_type (month, document_type, documents)"
+            " SELECT substr(publication_date, 1, 7), COALESCE(document_type, ''), COUNT(*) FROM federal_documents"
+            " WHERE publication_date IS NOT NULL GROUP BY 1, 2"
+        )
+        conn.execute(
+            "INSERT INTO stats_agency_month_type (agency_id, month, document_type, documents)"
+            " SELECT da.agency_id, substr(d.publication_date, 1, 7), COALESCE(d.document_type, ''), COUNT(*)"
+            " FROM document_agencies da JOIN federal_documents d ON d.document_number = da.document_number"
+            " WHERE d.publication_date IS NOT NULL GROUP BY 1, 2, 3"
+        )
+        conn.execute("INSERT INTO documents_fts (documents_fts) VALUES ('optimize')")
+        conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('optimize')")
+        conn.execute("ANALYZE")
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ("federal_documents", "document_agencies", "document_chunks")}
+        conn.commit()
+        conn.close()
+        os.replace(self.tmp_path, self.path)
+        return counts
+
+    def discard(self):
+        self.conn.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def build_replica(connection, path=None, batch_size=2000):
+    """
+    Copies the search tables from MySQL into a fresh replica file and swaps
+    it in. Rows are streamed in batches of ``batch_size``. Returns row counts
+    plus "seconds".
+    """
+    started = time.perf_counter()
+    writer = ReplicaWriter(path)
+    try:
+        for table, columns in COPIED_TABLES.items():
+            cursor = connection.cursor()
+            try:
+                cursor.execute(f"SELECT {', '.join(columns)} FROM {table}")
+                writer.copy_rows(table, columns, _fetch_in_batches(cursor, batch_size))
+            finally:
+                cursor.close()
+        counts = writer.publish()
+    except BaseException:
+        writer.discard()
+        raise
+    counts["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info("Published search replica %s with %d documents in %.1fs",
+                writer.path, counts["federal_documents"], counts["seconds"])
+    return counts
+
+def _fetch_in_batches(cursor, batch_size):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+# --- Read Side ---
+# One read-only connection per thread. Each checkout compares the file's
+# identity with the one the connection was opened on and reopens after a
+# swap; the old file stays readable until its last connection closes.
+_local = threading.local()
+
+def _dict_row(cursor, row):
+    # Rows shaped like mysql-connector's dictionary cursors
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+def _file_identity(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise ReplicaUnavailable(f"Search replica {path} does not exist; run data_pipeline.py to build it") from None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+@contextmanager
+def replica_connection():
+    """Yields this thread's read-only connection to the current replica file."""
+    path = get_replica_path()
+    identity = _file_identity(path)
+    cached = getattr(_local, "replica", None)
+    if cached is None or cached[0] != (path, identity):
+        if cached is not None:
+            cached[1].close()
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        conn.row_factory = _dict_row
+        _local.replica = cached = ((path, identity), conn)
+    yield cached[1]
@@ -0,0 +1,180 @@
+# sessions.py
+
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# --- History Compaction ---
+# Sessions keep the conversation so follow-up questions have context, but the
+# whole history is re-sent to OpenAI on every turn. Before a history is stored
+# it is compacted:
+#   1. Tool traffic of finished turns (assistant tool-call requests and the raw
+#      tool results) is dropped; the assistant's final answer already carries
+#      what the user saw, and tool payloads are by far the largest messages.
+#   2. The oldest user/assistant exchanges are dropped until the estimated
+#      size fits SESSION_HISTORY_TOKENS. System messages and the latest
+#      exchange are always kept.
+SESSION_HISTORY_TOKENS = int(os.environ.get("SESSION_HISTORY_TOKENS", "3000"))
+
+def _field(message, name):
+    return message.get(name) if isinstance(message, dict) else getattr(message, name, None)
+
+def _estimate_tokens(message):
+    """Rough token count (about four characters per token), good enough for budgeting."""
+    content = _field(message, "content") or ""
+    return len(content) // 4 + 4 # Per-message overhead of role and separators
+
+def message_to_dict(message):
+    """Converts an SDK message object to a plain JSON-serialisable dict."""
+    if isinstance(message, dict):
+        return message
+    if hasattr(message, "model_dump"):
+        return message.model_dump(exclude_none=True)
+    return {"role": message.role, "content": message.content}
+
+def compact_history(history, max_tokens=None):
+    """
+    Returns a compacted copy of ``history`` (see above). Only call this
+    between turns: dropping tool traffic mid-turn would orphan tool results.
+    """
+    max_tokens = SESSION_HISTORY_TOKENS if max_tokens is None else max_tokens
+    system = [message for message in history if _field(message, "role") == "system"]
+    exchanges = [
+        message for message in history
+        if _field(message, "role") in ("user", "assistant") and not _field(message, "tool_calls")
+    ]
+
+    budget = max_tokens - sum(_estimate_tokens(message) for message in system)
+    kept = []
+    # Walk back from the newest message; stop at the first one that no longer
+    # fits, but never drop the latest exchange (the last user message onward)
+    last_user = max((i for i, message in enumerate(exchanges) if _field(message, "role") == "user"), default=0)
+    for position in range(len(exchanges) - 1, -1, -1):
+        cost = _estimate_tokens(exchanges[position])
+        if cost > budget and position < last_user:
+            break
+        budget -= cost
+        kept.append(exchanges[position])
+    kept.reverse()
+    # A history should not open with an orphaned assistant answer
+    while kept and _field(kept[0], "role") == "assistant":
+        kept.pop(0)
+    return [message_to_dict(message) for message in system + kept]
+
+
+# --- Session Stores ---
+# A store maps a session id to its (compacted) history. Both stores evict the
+# least recently used sessions beyond max_sessions and expire sessions idle
+# for longer than ttl_seconds.
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
+
+
+class InMemorySessionStore:
+    """Process-local store; sessions are lost on restart and not shared between workers."""
+
+    def __init__(self, max_sessions=1000, ttl_seconds=86400):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict() # session id -> (last used, history)
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Returns a copy of the session's history, or None if unknown or expired."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if entry[0] + self.ttl_seconds <= time.time():
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return list(entry[1])
+
+    def save(self, session_id, history):
+        with self._lock:
+            self._sessions[session_id] = (time.time(), list(history))
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionStore:
+    """SQLite-file store shared by all worker processes on the host and surviving restarts."""
+
+    def __init__(self, path="sessions.sqlite3", max_sessions=10000, ttl_seconds=86400):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY, history TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        row = self._connection().execute(
+            "SELECT history FROM sessions WHERE session_id = ? AND updated_at > ?",
+            (session_id, time.time() - self.ttl_seconds),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session_id, history):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, history, updated_at) VALUES (?, ?, ?)",
+            (session_id, json.dumps([message_to_dict(message) for message in history]), time.time()),
+        )
+        # Drop expired sessions and the least recently used ones beyond the bound
+        conn.execute("DELETE FROM sessions WHERE updated_at <= ?", (time.time() - self.ttl_seconds,))
+        conn.execute(
+            "DELETE FROM sessions WHERE session_id IN ("
+            " SELECT session_id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,),
+        )
+        conn.commit()
+
+    def delete(self, session_id):
+        conn = self._connection()
+        conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        conn.commit()
+
+
+def create_session_store():
+    """
+    Builds the session store from environment variables:
+
+        SESSION_STORE        memory (default) | sqlite
+        SESSION_MAX          sessions kept, default 1000
+        SESSION_TTL          idle seconds before a session expires, default 86400
+        SESSION_DB_PATH      SQLite file, default sessions.sqlite3
+    """
+    name = os.environ.get("SESSION_STORE", "memory").lower()
+    max_sessions = int(os.environ.get("SESSION_MAX", "1000"))
+    ttl_seconds = float(os.environ.get("SESSION_TTL", "86400"))
+    if name == "sqlite":
+        return SQLiteSessionStore(os.environ.get("SESSION_DB_PATH", "sessions.sqlite3"), max_sessions, ttl_seconds)
+    if name == "memory":
+        return InMemorySessionStore(max_sessions, ttl_seconds)
+    raise ValueError(f"Unknown SESSION_STORE: {name}")
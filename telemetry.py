@@ -0,0 +1,206 @@
+# telemetry.py
+
+import bisect
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# --- Metrics ---
+# A small in-process registry rendered in the Prometheus text exposition
+# format by render_metrics() (served at /metrics by main.py). Metrics are
+# per worker process; Prometheus aggregates across workers when scraping.
+
+# Seconds; covers sub-millisecond pool checkouts up to slow multi-round chats
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing value per label set."""
+    type_name = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, with _sum and _count."""
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, series in self._series.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key + (("le", _format_value(float(bound))),), cumulative))
+                samples.append((f"{self.name}_bucket", key + (("le", "+Inf"),), series[-1]))
+                samples.append((f"{self.name}_sum", key, series[-2]))
+                samples.append((f"{self.name}_count", key, series[-1]))
+        return samples
+
+
+_metrics = {}
+_collectors = []
+_registry_lock = threading.Lock()
+
+def counter(name, help_text):
+    """Returns the counter called ``name``, creating it on first use."""
+    return _register(name, lambda: Counter(name, help_text))
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    """Returns the histogram called ``name``, creating it on first use."""
+    return _register(name, lambda: Histogram(name, help_text, buckets))
+
+def _register(name, factory):
+    with _registry_lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = factory()
+        return metric
+
+def register_collector(collect):
+    """
+    Registers a callable evaluated at scrape time for values owned by another
+    component (pool gauges, cache counters). It returns a list of
+    (name, type, help, [(labels dict, value), ...]) tuples.
+    """
+    with _registry_lock:
+        _collectors.append(collect)
+
+def render_metrics():
+    """Renders every metric and collector in the Prometheus text format."""
+    lines = []
+    with _registry_lock:
+        metrics = list(_metrics.values())
+        collectors = list(_collectors)
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+        for name, key, value in metric.samples():
+            lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+    for collect in collectors:
+        for name, type_name, help_text, values in collect():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {type_name}")
+            for labels, value in values:
+                lines.append(f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Standard Metrics ---
+SPAN_SECONDS = histogram("rag_span_seconds", "Duration of traced stages (see telemetry.span).")
+LLM_TOKENS = counter("rag_llm_tokens_total", "OpenAI tokens used, by kind (prompt/completion).")
+ERRORS = counter("rag_errors_total", "Errors by component.")
+
+
+# --- Tracing ---
+# A trace is the list of spans recorded while handling one request. It lives
+# in a context variable, so nested spans find their parent and code further
+# down (the agent loop, tools, the DB layer) records into it without the
+# trace being passed around. Work handed to a thread pool must be submitted
+# with contextvars.copy_context().run (see run_in_context) to stay in the
+# request's trace. Every span is also observed in rag_span_seconds, whether
+# or not a trace is active.
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+@contextmanager
+def trace():
+    """Starts a trace for the enclosed block and yields its span list."""
+    spans = []
+    token = _current_trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times the enclosed block as a span called ``name`` (e.g. "db.execute").
+    The yielded dict may be updated with extra attributes while the span runs.
+    Exceptions are recorded on the span and re-raised.
+    """
+    record = {"name": name, "parent": _current_span.get(), **attributes}
+    token = _current_span.set(name)
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        _current_span.reset(token)
+        record["ms"] = round(elapsed * 1000, 2)
+        SPAN_SECONDS.observe(elapsed, span=name)
+        spans = _current_trace.get()
+        if spans is not None:
+            spans.append(record) # list.append is atomic, so pool threads can share a trace
+
+def record_span(name, seconds, **attributes):
+    """Records an already measured span, for code that cannot hold a context manager open (generators)."""
+    SPAN_SECONDS.observe(seconds, span=name)
+    spans = _current_trace.get()
+    if spans is not None:
+        spans.append({"name": name, "parent": _current_span.get(), **attributes, "ms": round(seconds * 1000, 2)})
+
+def run_in_context(executor, fn, *args, **kwargs):
+    """Submits ``fn(*args, **kwargs)`` to ``executor`` inside a copy of the caller's context (trace included)."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def summarize_trace(spans):
+    """Total milliseconds per span name, e.g. {"llm.call": 812.4, "db.execute": 35.1}."""
+    totals = {}
+    for record in spans:
+        totals[record["name"]] = round(totals.get(record["name"], 0.0) + record["ms"], 2)
+    return totals
@@ -0,0 +1,56 @@
+# tests/conftest.py
+#
+# Shared fixtures. The suite runs offline: the database tools search a small
+# SQLite replica (see replica.py) built from the benchmark corpus, so neither
+# MySQL, the network nor an OpenAI key is needed.
+#
+# Run from the repository root:
+#   python -m pytest -q
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CORPUS_ROWS = 300
+# Identical documents (same text, agency and date), so they tie on every sort
+# key but the document number
+TIE_ROWS = 12
+TIE_WORD = "zephyrine"
+TIE_DATE = "2025-06-01"
+TIE_AGENCY = "Environmental Protection Agency"
+
+@pytest.fixture(autouse=True)
+def data_generation_file(tmp_path, monkeypatch):
+    """Keeps each test's data generation (see caching.py) out of the repository."""
+    path = tmp_path / ".data_generation"
+    monkeypatch.setenv("DATA_GENERATION_FILE", str(path))
+    return path
+
+@pytest.fixture(scope="session")
+def replica_path(tmp_path_factory):
+    from benchmarks.common import synthetic_api_documents, synthetic_documents
+    from data_pipeline import process_document_data
+    from replica import ReplicaWriter
+
+    path = str(tmp_path_factory.mktemp("replica") / "search_replica.sqlite3")
+    writer = ReplicaWriter(path)
+    writer.add_documents(synthetic_documents(CORPUS_ROWS))
+    writer.add_documents(
+        process_document_data(dict(doc, title=f"{TIE_WORD} notice", abstract=f"{TIE_WORD} program",
+                                   publication_date=TIE_DATE, agencies=[{"name": TIE_AGENCY}]))
+        for doc in synthetic_api_documents(TIE_ROWS, prefix="TIE")
+    )
+    writer.publish()
+    return path
+
+@pytest.fixture
+def agent_tools(replica_path, monkeypatch):
+    """agent_tools reading from the test replica, with its result cache off."""
+    import agent_tools
+    monkeypatch.setenv("SEARCH_REPLICA_PATH", replica_path)
+    monkeypatch.setattr(agent_tools, "SEARCH_BACKEND", "replica")
+    monkeypatch.setattr(agent_tools, "search_cache", None)
+    return agent_tools
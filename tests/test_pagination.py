@@ -0,0 +1,87 @@
+# tests/test_pagination.py
+#
+# Keyset pagination of agent_tools.search_federal_documents (next_cursor)
+# against the SQLite replica.
+
+from datetime import date
+
+import pytest
+
+from conftest import TIE_AGENCY, TIE_ROWS, TIE_WORD
+
+def numbers(page):
+    return [doc["document_number"] for doc in page["results"]]
+
+def walk_pages(tools, limit, **arguments):
+    """Follows next_cursor from the first page to the last; returns the pages."""
+    pages = [tools.search_federal_documents(limit=limit, **arguments)]
+    while pages[-1]["next_cursor"]:
+        assert "error" not in pages[-1]
+        pages.append(tools.search_federal_documents(limit=limit, cursor=pages[-1]["next_cursor"], **arguments))
+        assert len(pages) < 500, "cursor does not advance"
+    return pages
+
+def test_cursor_round_trip(agent_tools):
+    relevance = 0.1 + 0.2 # Not exactly representable in a short decimal
+    row = {"page_date": date(2025, 3, 4), "document_number": "2025-01234", "relevance": relevance}
+    cursor = agent_tools._encode_cursor(row, True, "f1")
+    after = agent_tools._decode_cursor(cursor, "f1")
+    assert after == (repr(relevance), "2025-03-04", "2025-01234")
+    assert float(after[0]) == relevance
+
+    cursor = agent_tools._encode_cursor({"page_date": None, "document_number": "X-1"}, False, "f1")
+    assert agent_tools._decode_cursor(cursor, "f1") == (None, None, "X-1")
+
+@pytest.mark.parametrize("cursor", [None, "", "not base64 !", "eyJ4IjogMX0="]) # The last one decodes to {"x": 1}
+def test_missing_or_invalid_cursor_gives_the_first_page(agent_tools, cursor):
+    assert agent_tools._decode_cursor(cursor, "f1") is None
+    first = agent_tools.search_federal_documents(query="pesticide", limit=5)
+    assert numbers(agent_tools.search_federal_documents(query="pesticide", limit=5, cursor=cursor)) == numbers(first)
+
+@pytest.mark.parametrize("arguments", [
+    {"query": "pesticide"},
+    {"query": "pesticide", "search_mode": "like"},
+    {"agency": "Department of Energy", "start_date": "2025-03-01", "end_date": "2025-08-31"},
+    {"query": "safety", "agency": "Environmental Protection Agency"},
+])
+def test_pages_add_up_to_the_whole_result(agent_tools, arguments):
+    everything = numbers(agent_tools.search_federal_documents(limit=10000, **arguments))
+    assert len(everything) > 7 # Several pages below
+    pages = walk_pages(agent_tools, 7, **arguments)
+    assert [number for page in pages for number in numbers(page)] == everything
+    assert all(len(page["results"]) == 7 for page in pages[:-1])
+    assert pages[-1]["next_cursor"] is None
+
+@pytest.mark.parametrize("search_mode", ["fulltext", "like"])
+def test_ties_are_ordered_by_document_number(agent_tools, search_mode):
+    pages = walk_pages(agent_tools, 5, query=TIE_WORD, search_mode=search_mode)
+    found = [number for page in pages for number in numbers(page)]
+    assert len(found) == TIE_ROWS
+    assert found == sorted(found, reverse=True) # Same relevance and date: document_number DESC decides
+
+def test_limit_may_change_between_pages(agent_tools):
+    first = agent_tools.search_federal_documents(query=TIE_WORD, limit=4)
+    rest = agent_tools.search_federal_documents(query=TIE_WORD, limit=100, cursor=first["next_cursor"])
+    assert "error" not in rest
+    assert numbers(first) + numbers(rest) == numbers(agent_tools.search_federal_documents(query=TIE_WORD, limit=100))
+
+def test_rewording_the_query_keeps_the_cursor_valid(agent_tools):
+    first = agent_tools.search_federal_documents(query="pesticide", limit=5)
+    second = agent_tools.search_federal_documents(query="  PESTICIDE ", limit=5, cursor=first["next_cursor"])
+    assert "error" not in second
+    assert not set(numbers(first)) & set(numbers(second))
+
+@pytest.mark.parametrize("changed", [
+    {"query": "emissions"},
+    {"agency": "Department of Energy"},
+    {"start_date": "2025-02-01"},
+    {"end_date": "2025-05-31"},
+    {"search_mode": "like"},
+])
+def test_cursor_from_other_filters_is_rejected(agent_tools, changed):
+    arguments = {"query": TIE_WORD, "agency": TIE_AGENCY, "start_date": "2025-01-01", "end_date": "2025-12-31"}
+    first = agent_tools.search_federal_documents(limit=5, **arguments)
+    assert first["next_cursor"]
+    reused = agent_tools.search_federal_documents(limit=5, cursor=first["next_cursor"], **dict(arguments, **changed))
+    assert reused["error"]
+    assert reused["results"] == [] and reused["next_cursor"] is None
@@ -0,0 +1,107 @@
+# tests/test_query_router.py
+#
+# query_router.parse_query / route_query with a fixed agency list and date.
+
+from datetime import date
+
+import pytest
+
+from query_router import AgencyCatalog, parse_query, route_query
+
+TODAY = date(2026, 10, 15) # A Thursday
+
+@pytest.fixture
+def catalog():
+    return AgencyCatalog(loader=lambda: [
+        "Environmental Protection Agency", "Energy Department", "Federal Energy Regulatory Commission",
+        "Federal Aviation Administration", "Food and Drug Administration", "Federal Deposit Administration",
+    ])
+
+def parse(text, catalog):
+    return parse_query(text, catalog, TODAY)
+
+def test_structured_question(catalog):
+    parsed = parse("EPA rules on pesticides from last week", catalog)
+    assert parsed["agency"] == "Environmental Protection Agency"
+    assert (parsed["start_date"], parsed["end_date"]) == ("2026-10-05", "2026-10-11")
+    assert parsed["query"] == "pesticides"
+    assert parsed["confidence"] == 1.0 and parsed["reasons"] == []
+    assert route_query("EPA rules on pesticides from last week", catalog, TODAY) == {
+        "name": "search_federal_documents",
+        "arguments": {"query": "pesticides", "agency": "Environmental Protection Agency",
+                      "start_date": "2026-10-05", "end_date": "2026-10-11"},
+        "confidence": 1.0,
+    }
+
+def test_agency_names(catalog):
+    # "Department of X" finds an agency listed as "X Department"
+    assert parse("What did the Department of Energy publish about efficiency?", catalog)["agency"] == "Energy Department"
+    # The longest name wins over a name inside it
+    assert parse("Federal Energy Regulatory Commission pipeline orders", catalog)["agency"] == \
+        "Federal Energy Regulatory Commission"
+    # Acronyms only count in capitals
+    assert "agency" not in parse("epa rules on pesticides", catalog)
+
+def test_acronym_of_several_agencies_is_ambiguous(catalog):
+    parsed = parse("FDA notices on labeling", catalog) # Food and Drug / Federal Deposit Administration
+    assert "agency" not in parsed
+    assert "ambiguous_agency" in parsed["reasons"]
+
+@pytest.mark.parametrize("text, start_date, end_date", [
+    ("pesticide rules today", "2026-10-15", "2026-10-15"),
+    ("pesticide rules this month", "2026-10-01", "2026-10-15"),
+    ("pesticide rules in the past 30 days", "2026-09-15", "2026-10-15"),
+    ("pesticide rules between 2025-01-01 and 2025-02-01", "2025-01-01", "2025-02-01"),
+    ("pesticide rules since 2025-03-01", "2025-03-01", None),
+    ("pesticide rules in March 2025", "2025-03-01", "2025-03-31"),
+    ("pesticide rules in March", "2026-03-01", "2026-03-31"),
+    ("pesticide rules in November", "2025-11-01", "2025-11-30"), # The most recent November
+    ("pesticide rules before 2024", None, "2023-12-31"),
+    ("pesticide rules since Dec 2024", "2024-12-01", None),
+    ("pesticide rules on Mar 5", "2026-03-05", "2026-03-05"),
+    ("pesticide rules from May 2025", "2025-05-01", None),
+])
+def test_date_ranges(catalog, text, start_date, end_date):
+    parsed = parse(text, catalog)
+    assert (parsed.get("start_date"), parsed.get("end_date")) == (start_date, end_date)
+    assert parsed["query"] == "pesticide"
+
+@pytest.mark.parametrize("text", [
+    "pesticide rules from dec",
+    "mar pesticide rules",
+    "pesticide rules that may apply",
+    "pesticide rules in may",
+])
+def test_short_month_names_need_a_day_or_year(catalog, text):
+    assert "start_date" not in parse(text, catalog)
+
+@pytest.mark.parametrize("text", [
+    "how are you doing today",
+    "hi, what's new this week?",
+    "good morning",
+    "thanks, that helps",
+])
+def test_small_talk_is_not_routed(catalog, text):
+    parsed = parse(text, catalog)
+    assert "no_topic" in parsed["reasons"]
+    assert route_query(text, catalog, TODAY) is None
+
+def test_agency_and_date_without_keywords_are_enough(catalog):
+    route = route_query("FAA notices from last month", catalog, TODAY)
+    assert route["arguments"] == {"agency": "Federal Aviation Administration",
+                                  "start_date": "2026-09-01", "end_date": "2026-09-30"}
+
+def test_keywords_alone_are_not_enough(catalog):
+    parsed = parse("pesticide drift", catalog)
+    assert parsed["query"] == "pesticide drift" and parsed["confidence"] < 0.6
+    assert route_query("pesticide drift", catalog, TODAY) is None
+
+@pytest.mark.parametrize("text, reason", [
+    ("How many rules did EPA publish last month?", "complex"),
+    ("Compare EPA and FAA rules from last week", "complex"),
+    ("EPA rules on pesticide drift spray buffer zones near schools wetlands last week", "many_keywords"),
+    ("EPA " + "rules " * 30 + "last week", "long"),
+])
+def test_questions_for_the_model(catalog, text, reason):
+    assert reason in parse(text, catalog)["reasons"]
+    assert route_query(text, catalog, TODAY) is None
@@ -0,0 +1,116 @@
+# tests/test_result_cache.py
+#
+# caching.ResultCache: single-flight de-duplication, invalidation by TTL and
+# data generation, and the search cache key of agent_tools.
+
+import threading
+import time
+
+import pytest
+
+from caching import ResultCache, bump_data_generation
+
+def run_together(count, target):
+    """Starts ``count`` threads on ``target`` at once and returns their results (or exceptions)."""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def slow_compute(calls, value, seconds=0.2):
+    def compute():
+        calls.append(1)
+        time.sleep(seconds)
+        return value
+    return compute
+
+def test_concurrent_misses_compute_once():
+    cache = ResultCache()
+    calls = []
+    results = run_together(8, lambda: cache.get_or_compute("key", slow_compute(calls, {"results": [1, 2]})))
+    assert len(calls) == 1
+    assert results == [{"results": [1, 2]}] * 8
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"]) == (1, 7)
+
+def test_callers_get_their_own_copy():
+    cache = ResultCache()
+    first = cache.get_or_compute("key", lambda: {"results": [1]})
+    first["results"].append(2)
+    assert cache.get_or_compute("key", lambda: pytest.fail("should be cached")) == {"results": [1]}
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    cache = ResultCache()
+    calls = []
+
+    def failing():
+        calls.append(1)
+        time.sleep(0.2)
+        raise RuntimeError("database down")
+
+    results = run_together(4, lambda: cache.get_or_compute("key", failing))
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.get_or_compute("key", lambda: "recovered") == "recovered"
+    assert cache.stats()["errors"] == 1
+
+def test_waiter_runs_its_own_query_after_the_wait_timeout():
+    cache = ResultCache(wait_timeout=0.1)
+    leader_calls = []
+    leader = threading.Thread(target=cache.get_or_compute, args=("key", slow_compute(leader_calls, "leader", 1.0)))
+    leader.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    assert cache.get_or_compute("key", lambda: "own") == "own"
+    assert time.monotonic() - started < 0.5
+    leader.join()
+    assert cache.get_or_compute("key", lambda: "recomputed") == "leader" # The leader's result was cached
+    assert cache.stats()["wait_timeouts"] == 1
+
+def test_data_generation_bump_invalidates():
+    cache = ResultCache()
+    assert cache.get_or_compute("key", lambda: "before") == "before"
+    assert cache.get_or_compute("key", lambda: "unused") == "before"
+    bump_data_generation()
+    assert cache.get_or_compute("key", lambda: "after") == "after"
+
+def test_entries_expire_after_the_ttl():
+    cache = ResultCache(ttl_seconds=0.05)
+    assert cache.get_or_compute("key", lambda: "first") == "first"
+    time.sleep(0.1)
+    assert cache.get_or_compute("key", lambda: "second") == "second"
+
+def test_search_cache_key_normalizes_only_indexed_searches(agent_tools):
+    key = agent_tools._search_cache_key
+    assert key("Clean  Air", "EPA", None, None, 10, "fulltext") == key(" clean air ", "epa", None, None, "10", "fulltext")
+    # A LIKE pattern matches the text as given
+    assert key("Clean  Air", "EPA", None, None, 10, "like") != key("clean air", "EPA", None, None, 10, "like")
+
+def test_search_results_are_cached_until_the_data_changes(agent_tools, monkeypatch):
+    monkeypatch.setattr(agent_tools, "search_cache", ResultCache())
+    calls = []
+    run_search = agent_tools._run_search
+
+    def counting(*args, **kwargs):
+        calls.append(1)
+        return run_search(*args, **kwargs)
+
+    monkeypatch.setattr(agent_tools, "_run_search", counting)
+    first = agent_tools.search_federal_documents(query="pesticide", limit=5)
+    assert agent_tools.search_federal_documents(query="Pesticide ", limit=5) == first
+    assert len(calls) == 1
+    bump_data_generation()
+    assert agent_tools.search_federal_documents(query="pesticide", limit=5) == first
+    assert len(calls) == 2
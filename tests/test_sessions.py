@@ -0,0 +1,66 @@
+# tests/test_sessions.py
+#
+# sessions.compact_history: what survives between turns of a stored session.
+
+from sessions import compact_history
+
+SYSTEM = {"role": "system", "content": "You are a helpful assistant."}
+
+def user(text):
+    return {"role": "user", "content": text}
+
+def answer(text):
+    return {"role": "assistant", "content": text}
+
+def tool_round(name="search_federal_documents"):
+    return [
+        {"role": "assistant", "content": None,
+         "tool_calls": [{"id": "call_1", "type": "function", "function": {"name": name, "arguments": "{}"}}]},
+        {"role": "tool", "tool_call_id": "call_1", "name": name, "content": '{"results": []}' * 200},
+    ]
+
+def test_tool_traffic_is_dropped_and_answers_kept():
+    history = [SYSTEM, user("EPA rules?"), *tool_round(), answer("Here are two rules."),
+               user("And FAA?"), *tool_round(), answer("One notice.")]
+    assert compact_history(history, max_tokens=10000) == [
+        SYSTEM, user("EPA rules?"), answer("Here are two rules."), user("And FAA?"), answer("One notice."),
+    ]
+
+def test_input_history_is_not_modified():
+    history = [SYSTEM, user("EPA rules?"), *tool_round(), answer("Here are two rules.")]
+    before = list(history)
+    compact_history(history, max_tokens=10000)
+    assert history == before
+
+def test_oldest_exchanges_go_first_when_over_budget():
+    history = [SYSTEM]
+    for i in range(10):
+        history += [user(f"question {i} " + "x" * 200), answer(f"answer {i} " + "y" * 200)]
+    compacted = compact_history(history, max_tokens=400)
+    assert compacted[0] == SYSTEM
+    assert compacted[-2:] == history[-2:]
+    assert len(compacted) < len(history)
+    kept = compacted[1:]
+    assert kept == history[len(history) - len(kept):] # A contiguous tail, oldest dropped
+    assert kept[0]["role"] == "user" # Never opens with an orphaned answer
+
+def test_latest_exchange_survives_even_over_budget():
+    history = [SYSTEM, user("old question"), answer("old answer"), user("q" * 4000), answer("a" * 4000)]
+    assert compact_history(history, max_tokens=50) == [SYSTEM, user("q" * 4000), answer("a" * 4000)]
+
+def test_unanswered_question_is_kept():
+    # A turn that failed or was disconnected mid-way still keeps the question
+    history = [SYSTEM, user("EPA rules?"), tool_round()[0]]
+    assert compact_history(history, max_tokens=10000) == [SYSTEM, user("EPA rules?")]
+
+def test_sdk_message_objects_become_dicts():
+    class Message:
+        role = "assistant"
+        content = "An answer."
+        tool_calls = None
+
+        def model_dump(self, exclude_none=False):
+            return {"role": self.role, "content": self.content}
+
+    compacted = compact_history([SYSTEM, user("Question?"), Message()], max_tokens=10000)
+    assert compacted == [SYSTEM, user("Question?"), answer("An answer.")]
@@ -0,0 +1,404 @@
+# vector_index.py
+
+import abc
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+# --- Embedders ---
+# An embedder turns a list of texts into an (n, dim) float32 matrix of
+# L2-normalised rows, so a dot product between rows is their cosine similarity.
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+class Embedder(abc.ABC):
+    """Base class for pluggable embedders."""
+    name = "base"
+    dim = 0
+
+    @abc.abstractmethod
+    def embed(self, texts):
+        """Returns an (len(texts), dim) float32 matrix of L2-normalised rows."""
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (matrix / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder(Embedder):
+    """
+    Offline embedder based on the hashing trick: unigrams and bigrams are hashed
+    into ``dim`` signed buckets and weighted with sublinear term frequency
+    (1 + log tf). Needs no network, no vocabulary and no fitting, and the same
+    text always maps to the same vector across processes.
+    """
+    name = "hashing"
+
+    def __init__(self, dim=512):
+        self.dim = int(dim)
+
+    def _features(self, text):
+        tokens = _TOKEN_RE.findall((text or "").lower())
+        features = Counter(tokens)
+        features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+        return features
+
+    def _bucket(self, feature):
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        # Low bits pick the bucket, one high bit picks the sign
+        return value % self.dim, (1.0 if value >> 63 else -1.0)
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, tf in self._features(text).items():
+                bucket, sign = self._bucket(feature)
+                matrix[row, bucket] += sign * (1.0 + math.log(tf))
+        return self._normalize(matrix)
+
+
+class OpenAIEmbedder(Embedder):
+    """Embedder backed by the OpenAI embeddings API (requires network and OPENAI_API_KEY)."""
+    name = "openai"
+
+    def __init__(self, model="text-embedding-3-small", dim=1536, batch_size=256):
+        from openai import OpenAI # Imported lazily so the hashing embedder has no OpenAI dependency
+        self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        self.model = model
+        self.dim = dim
+        self.batch_size = batch_size
+
+    def embed(self, texts):
+        rows = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = [text or " " for text in texts[start:start + self.batch_size]]
+            response = self.client.embeddings.create(model=self.model, input=batch)
+            rows.extend(item.embedding for item in response.data)
+        return self._normalize(np.asarray(rows, dtype=np.float32).reshape(len(texts), self.dim))
+
+
+def get_embedder(name=None):
+    """Returns the embedder selected by ``name`` or the EMBEDDER environment variable."""
+    name = (name or os.environ.get("EMBEDDER", "hashing")).lower()
+    if name == "hashing":
+        return HashingEmbedder(dim=int(os.environ.get("EMBEDDING_DIM", "512")))
+    if name == "openai":
+        return OpenAIEmbedder(model=os.environ.get("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small"))
+    raise ValueError(f"Unknown embedder: {name}")
+
+
+# --- Vector Index ---
+# Layout on disk (inside the index directory):
+#   embeddings.<n>.f32 - raw float32 matrix of shape (capacity, dim), memory-mapped
+#   meta.json          - dim, count, capacity, embedder name, per-row metadata
+#                        and the name of the current embeddings file
+# Rows [0, count) are live. A published embeddings file is never modified:
+# the first upsert after a load or save copies its rows into a new file,
+# and save() flushes that file before atomically replacing meta.json to
+# point at it. Readers therefore switch to new vectors and new metadata in
+# one step; until they reload, they keep reading the old file (which stays
+# readable while mapped, even after the writer deletes it). The price is
+# one copy of the matrix per save.
+
+EMBEDDINGS_FILE = "embeddings.f32" # Indexes saved before meta.json named their embeddings file
+META_FILE = "meta.json"
+SUMMARY_CHARS = 300 # Characters of content kept per document for result previews
+
+def _date_key(value):
+    """YYYY-MM-DD (or date) -> int YYYYMMDD, 0 when missing/invalid."""
+    if not value:
+        return 0
+    try:
+        return int(datetime.strptime(str(value)[:10], "%Y-%m-%d").strftime("%Y%m%d"))
+    except ValueError:
+        return 0
+
+def _document_agency_names(doc):
+    """A document's agency names; indexes saved before they were stored split the display string."""
+    names = doc.get("agency_names")
+    if names is None:
+        names = [name for name in (doc.get("agency") or "").split(", ") if name]
+    return names
+
+class VectorIndex:
+    """
+    Local, memory-mapped embedding index with vectorised top-k cosine search
+    and agency / publication-date metadata filters.
+    """
+
+    def __init__(self, path, embedder=None, read_only=False):
+        self.path = path
+        self.embedder = embedder or get_embedder()
+        self.read_only = read_only
+        self._lock = threading.RLock()
+        self._meta_mtime = None
+        self._load()
+
+    # --- Loading ---
+    def _load(self, retry=True):
+        meta_path = os.path.join(self.path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["dim"] != self.embedder.dim or meta.get("embedder") != self.embedder.name:
+                raise ValueError(
+                    f"Vector index at {self.path} was built with {meta.get('embedder')}/{meta['dim']}, "
+                    f"not {self.embedder.name}/{self.embedder.dim}. Rebuild it or set EMBEDDER accordingly."
+                )
+            self._meta_mtime = os.path.getmtime(meta_path)
+        else:
+            if self.read_only:
+                raise FileNotFoundError(f"No vector index found at {self.path}")
+            os.makedirs(self.path, exist_ok=True)
+            meta = {"dim": self.embedder.dim, "embedder": self.embedder.name, "count": 0, "capacity": 0, "documents": []}
+
+        matrix_file = meta.get("embeddings_file", EMBEDDINGS_FILE)
+        try:
+            matrix = self._open_matrix(matrix_file, meta["capacity"])
+        except FileNotFoundError:
+            if not retry:
+                raise
+            # A writer published (and removed the old file) between reading meta.json and opening it
+            return self._load(retry=False)
+        self.count = meta["count"]
+        self.capacity = meta["capacity"]
+        self.documents = meta["documents"]
+        self._row_of = {doc["document_number"]: row for row, doc in enumerate(self.documents)}
+        self._matrix = matrix
+        self._matrix_file = matrix_file
+        self._write_file = None # New embeddings file being written, until save() publishes it
+        self._rebuild_filter_arrays()
+
+    def _open_matrix(self, name, capacity, writable=False):
+        if capacity == 0:
+            return np.zeros((0, self.embedder.dim), dtype=np.float32)
+        return np.memmap(os.path.join(self.path, name), dtype=np.float32, mode="r+" if writable else "r",
+                         shape=(capacity, self.embedder.dim))
+
+    def _rebuild_filter_arrays(self):
+        # Column arrays so metadata filters are vectorised instead of per-row Python.
+        # Agency names are flattened into one array with the row each belongs to.
+        self._filters_dirty = False
+        names, owners = [], []
+        for row, doc in enumerate(self.documents):
+            for name in _document_agency_names(doc):
+                names.append(name.lower())
+                owners.append(row)
+        self._agency_names = np.array(names, dtype=str)
+        self._agency_rows = np.array(owners, dtype=np.int64)
+        self._dates = np.array([_date_key(doc.get("publication_date")) for doc in self.documents], dtype=np.int32)
+
+    def reload_if_changed(self):
+        """Re-opens the index if another process (the pipeline) has saved a newer version."""
+        meta_path = os.path.join(self.path, META_FILE)
+        try:
+            mtime = os.path.getmtime(meta_path)
+        except OSError:
+            return False
+        if mtime == self._meta_mtime:
+            return False
+        with self._lock:
+            self._load()
+        return True
+
+    # --- Writing ---
+    def _prepare_write(self, needed):
+        """
+        Makes the matrix writable for ``needed`` rows. The first write after a
+        load or save copies the live rows into a new embeddings file, so the
+        published one is never modified; later writes grow that file in place.
+        """
+        capacity = self.capacity if needed <= self.capacity else max(needed, self.capacity * 2, 1024)
+        if self._write_file is not None and capacity == self.capacity:
+            return
+        if self._write_file is None:
+            name, source = f"embeddings.{time.time_ns()}.f32", self._matrix
+        else:
+            name, source = self._write_file, None
+            self._matrix.flush()
+            del self._matrix # Existing rows keep their offsets when the file grows
+        with open(os.path.join(self.path, name), "ab") as f:
+            f.truncate(capacity * self.embedder.dim * 4)
+        self._matrix = self._open_matrix(name, capacity, writable=True)
+        if source is not None:
+            self._matrix[:self.count] = source[:self.count]
+        self._write_file = name
+        self.capacity = capacity
+
+    def upsert(self, documents):
+        """
+        Embeds and stores documents (dicts shaped like data_pipeline.process_document_data
+        output). Existing document_numbers are overwritten. Nothing is visible
+        to other processes until save(). Returns the number of rows written.
+        """
+        if self.read_only:
+            raise PermissionError("Vector index was opened read-only.")
+        documents = [doc for doc in documents if doc.get("document_number")]
+        if not documents:
+            return 0
+        vectors = self.embedder.embed([f"{doc.get('title') or ''}\n{doc.get('content') or ''}" for doc in documents])
+
+        with self._lock:
+            new_rows = sum(1 for doc in documents if doc["document_number"] not in self._row_of)
+            self._prepare_write(self.count + new_rows)
+            for doc, vector in zip(documents, vectors):
+                entry = {
+                    "document_number": doc["document_number"],
+                    "title": doc.get("title"),
+                    "agency": doc.get("agency"),
+                    "agency_names": list(_document_agency_names(doc)),
+                    "publication_date": str(doc.get("publication_date") or ""),
+                    "document_url": doc.get("document_url"),
+                    "summary": (doc.get("content") or "")[:SUMMARY_CHARS],
+                }
+                row = self._row_of.get(entry["document_number"])
+                if row is None:
+                    row = self.count
+                    self.count += 1
+                    self.documents.append(entry)
+                    self._row_of[entry["document_number"]] = row
+                else:
+                    self.documents[row] = entry
+                self._matrix[row] = vector
+            # Filter columns are rebuilt lazily on the next search, so bulk
+            # ingest does not pay an O(count) rebuild per batch
+            self._filters_dirty = True
+        return len(documents)
+
+    def save(self):
+        """
+        Flushes the new embeddings file and publishes it together with the
+        metadata through one atomic replace of meta.json, then removes
+        embeddings files that are no longer current.
+        """
+        with self._lock:
+            if isinstance(self._matrix, np.memmap):
+                self._matrix.flush()
+            matrix_file = self._write_file or self._matrix_file
+            meta = {
+                "dim": self.embedder.dim,
+                "embedder": self.embedder.name,
+                "count": self.count,
+                "capacity": self.capacity,
+                "embeddings_file": matrix_file,
+                "documents": self.documents,
+            }
+            meta_path = os.path.join(self.path, META_FILE)
+            tmp_path = meta_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, meta_path)
+            self._meta_mtime = os.path.getmtime(meta_path)
+            self._matrix_file, self._write_file = matrix_file, None
+            for name in os.listdir(self.path):
+                # Also clears files left behind by an interrupted writer
+                if name.startswith("embeddings") and name.endswith(".f32") and name != matrix_file:
+                    try:
+                        os.remove(os.path.join(self.path, name))
+                    except OSError:
+                        pass # Still mapped on a platform that refuses to delete it; removed next save
+
+    # --- Searching ---
+    def _snapshot(self):
+        """
+        (count, matrix rows, documents, filter arrays) as of now. Reloads and
+        filter rebuilds swap in new objects, and upsert only appends past
+        ``count`` or overwrites a row with a newer version of the same
+        document, so a search can use them after releasing the lock.
+        """
+        with self._lock:
+            if self._filters_dirty:
+                self._rebuild_filter_arrays()
+            return (self.count, self._matrix[:self.count], self.documents,
+                    (self._agency_names, self._agency_rows, self._dates))
+
+    @staticmethod
+    def _filter_mask(count, filters, agency=None, start_date=None, end_date=None):
+        agency_names, agency_rows, dates = filters
+        mask = np.ones(count, dtype=bool)
+        if agency:
+            # Same rule as the keyword search: each agency name on its own, matched by prefix
+            agency_mask = np.zeros(count, dtype=bool)
+            if agency_names.size:
+                agency_mask[agency_rows[np.char.startswith(agency_names, agency.lower())]] = True
+            mask &= agency_mask
+        if start_date:
+            mask &= dates >= _date_key(start_date)
+        if end_date:
+            end_key = _date_key(end_date)
+            if end_key:
+                mask &= dates <= end_key
+        return mask
+
+    def search(self, queries, top_k=10, agency=None, start_date=None, end_date=None):
+        """
+        Batched top-k cosine search.
+
+        Args:
+            queries (list[str]): Query texts, embedded together in one call.
+            top_k (int): Results per query.
+            agency, start_date, end_date: Optional metadata filters applied before ranking.
+
+        Returns:
+            list[list[dict]]: For each query, up to top_k document metadata dicts
+            with an added "score" (cosine similarity), best first.
+        """
+        if self.count == 0 or not queries:
+            return [[] for _ in queries]
+        # Embedding (possibly a network call) and ranking run without the
+        # lock; only taking the snapshot has to wait for a writer
+        query_vectors = self.embedder.embed(list(queries))
+        count, matrix, documents, filters = self._snapshot()
+        if count == 0:
+            return [[] for _ in queries]
+        # (n_queries, dim) @ (dim, count) -> all similarities in one BLAS call
+        scores = query_vectors @ np.asarray(matrix).T
+        mask = self._filter_mask(count, filters, agency, start_date, end_date)
+        scores[:, ~mask] = -np.inf
+
+        k = min(int(top_k), count)
+        # argpartition is O(count); only the k survivors get fully sorted
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for qi in range(len(queries)):
+            rows = top[qi][np.argsort(-scores[qi, top[qi]])]
+            hits = []
+            for row in rows:
+                score = float(scores[qi, row])
+                if score <= 0:
+                    break # Only unrelated or filtered-out rows remain
+                hit = dict(documents[row])
+                hit.pop("agency_names", None) # Filter column; "agency" carries the names for display
+                hit["score"] = round(score, 4)
+                hits.append(hit)
+            results.append(hits)
+        return results
+
+
+# --- Shared Index ---
+_index = None
+_index_lock = threading.Lock()
+
+def get_vector_index(read_only=True):
+    """
+    Returns the process-wide index at VECTOR_INDEX_DIR (default ./vector_index),
+    reloading it when the pipeline has published a newer version.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = VectorIndex(os.environ.get("VECTOR_INDEX_DIR", "vector_index"), read_only=read_only)
+        else:
+            _index.reload_if_changed()
+        return _index